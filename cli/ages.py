@@ -0,0 +1,104 @@
+"""Ages of items in stock, answered from the lists of StockIndex
+
+All functions take groups: one or more { warehouse_id: [Item, ...] } with items sorted
+oldest first (like StockIndex.items_named), so items older than a date are always
+at the front of each list and are found by bisection, not by a scan.
+Ages are whole days (as Item.days_in_warehouse) counted from one "now" per query"""
+from __future__ import annotations
+import datetime
+import heapq
+import itertools
+from classes import Item
+from index import age_order
+from typing import Iterable, Iterator
+
+# bucket bounds (in days) of age histograms unless other are given
+DEFAULT_BUCKETS = (30, 90, 180, 365)
+
+
+def ages(pairs: Iterable[tuple], today: datetime.datetime) -> list[tuple]:
+    """Returns (warehouse_id, days in warehouse) of (warehouse_id, Item) pairs,
+    all counted from the same today"""
+    return [
+        (warehouse_id, (today - item.date_of_stock).days)
+        for warehouse_id, item in pairs
+    ]
+
+
+def stocked_until(items: list[Item], days: int, today: datetime.datetime) -> int:
+    """Returns the number of items (sorted oldest first) in stock for at least days"""
+    until = today - datetime.timedelta(days=days)
+    # NOTE: bisect only takes key= since Python 3.10 (see index._bisect_right)
+    start, end = 0, len(items)
+    while start < end:
+        middle = (start + end) // 2
+        if until < items[middle].date_of_stock:
+            end = middle
+        else:
+            start = middle + 1
+    return start
+
+
+def _oldest_first(pairs_per_list: Iterable[Iterator[tuple]]) -> Iterator[tuple]:
+    return heapq.merge(*pairs_per_list, key=lambda pair: age_order(pair[1]))
+
+
+def older_than(
+    groups: Iterable[dict], days: int, today: datetime.datetime
+) -> list[tuple]:
+    """Returns (warehouse_id, Item) of items in stock for at least days, oldest first"""
+    return list(
+        _oldest_first(
+            zip(
+                itertools.repeat(warehouse_id),
+                items[: stocked_until(items, days, today)],
+            )
+            for group in groups
+            for warehouse_id, items in sorted(group.items())
+        )
+    )
+
+
+def oldest(groups: Iterable[dict], amount: int) -> list[tuple]:
+    """Returns (warehouse_id, Item) of up to amount oldest items, oldest first"""
+    return list(
+        itertools.islice(
+            _oldest_first(
+                zip(itertools.repeat(warehouse_id), items)
+                for group in groups
+                for warehouse_id, items in sorted(group.items())
+            ),
+            amount,
+        )
+    )
+
+
+def age_histogram(
+    groups: Iterable[dict],
+    buckets: Iterable[int] = DEFAULT_BUCKETS,
+    today: datetime.datetime = None,
+) -> dict[int, list[int]]:
+    """Returns { warehouse_id: [amount of items, ...] } with an amount for each bucket
+    of ages: below the first bound, from each bound to the next one,
+    from the last bound on"""
+    bounds = sorted(buckets)
+    today = today if today is not None else datetime.datetime.today()
+    histogram = {}
+    for group in groups:
+        for warehouse_id, items in group.items():
+            # NOTE: numbers of items at least as old as each bound, then as old as none
+            at_least = [len(items)]
+            at_least.extend(stocked_until(items, days, today) for days in bounds)
+            at_least.append(0)
+            counts = histogram.setdefault(warehouse_id, [0] * (len(bounds) + 1))
+            for bucket in range(len(bounds) + 1):
+                counts[bucket] += at_least[bucket] - at_least[bucket + 1]
+    return dict(sorted(histogram.items()))
+
+
+def bucket_labels(buckets: Iterable[int] = DEFAULT_BUCKETS) -> list[str]:
+    """Returns labels of the buckets of age_histogram, e.g. "0-29", "30-89", "365+" """
+    bounds = [0, *sorted(buckets)]
+    labels = [f"{low}-{high - 1}" for low, high in zip(bounds, bounds[1:])]
+    labels.append(f"{bounds[-1]}+")
+    return labels
@@ -0,0 +1,77 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+from ages import age_histogram, ages, bucket_labels, older_than, oldest, stocked_until
+from classes import Item
+from index import age_order
+
+TODAY = datetime(2021, 8, 1, 12, 0, 0)
+
+
+def item(days_old: float, state: str = "Blue") -> Item:
+    return Item(state, "Remote control", None, TODAY - timedelta(days=days_old))
+
+
+class TestAges(unittest.TestCase):
+    def setUp(self) -> None:
+        self.groups = [
+            {1: [item(400), item(100), item(10)], 2: [item(30), item(29.5)]},
+            {2: [item(500, "Red"), item(1, "Red")]},
+        ]
+
+    def test_ages_are_counted_from_the_same_today(self):
+        self.assertListEqual(
+            ages([(1, item(10)), (2, item(0.5)), (3, item(-1))], TODAY),
+            [(1, 10), (2, 0), (3, -1)],
+        )
+        self.assertEqual(item(10).days_in_warehouse(TODAY), 10)
+
+    def test_stocked_until_includes_items_exactly_as_old(self):
+        items = self.groups[0][2]
+        self.assertEqual(stocked_until(items, 30, TODAY), 1)
+        self.assertEqual(stocked_until(items, 29, TODAY), 2)
+        self.assertEqual(stocked_until(items, 31, TODAY), 0)
+
+    def test_older_than(self):
+        self.assertListEqual(
+            [
+                (warehouse_id, item.days_in_warehouse(TODAY))
+                for warehouse_id, item in older_than(self.groups, 30, TODAY)
+            ],
+            [(2, 500), (1, 400), (1, 100), (2, 30)],
+        )
+        self.assertListEqual(older_than(self.groups, 1000, TODAY), [])
+
+    def test_oldest(self):
+        self.assertListEqual(
+            [
+                (warehouse_id, item.days_in_warehouse(TODAY))
+                for warehouse_id, item in oldest(self.groups, 3)
+            ],
+            [(2, 500), (1, 400), (1, 100)],
+        )
+        self.assertEqual(len(oldest(self.groups, 100)), 7)
+
+    def test_age_histogram(self):
+        self.assertDictEqual(
+            age_histogram(self.groups, (30, 365), TODAY), {1: [1, 1, 1], 2: [2, 1, 1]}
+        )
+        self.assertDictEqual(age_histogram(self.groups, (), TODAY), {1: [3], 2: [4]})
+        self.assertListEqual(bucket_labels((30, 365)), ["0-29", "30-364", "365+"])
+
+    def test_same_as_counting_every_item(self):
+        rng = random.Random(0)
+        items = sorted((item(rng.uniform(0, 1000)) for _ in range(1000)), key=age_order)
+        buckets = (7, 30, 90, 365)
+        expected = [0] * (len(buckets) + 1)
+        for days in (item.days_in_warehouse(TODAY) for item in items):
+            expected[sum(days >= bound for bound in buckets)] += 1
+        self.assertDictEqual(age_histogram([{1: items}], buckets, TODAY), {1: expected})
+        self.assertListEqual(
+            older_than([{1: items}], 90, TODAY),
+            [(1, item) for item in items if item.days_in_warehouse(TODAY) >= 90],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+from __future__ import annotations
+import collections
+import datetime
+from classes import Item
+from typing import Any, Callable, Iterable, NamedTuple, Sequence, Tuple, Union
+
+# (warehouse_id, Item) pairs, as produced by WarehouseManager
+WarehouseItemPair = Tuple[int, Item]
+
+# How to compute the value to group by from a (warehouse_id, Item) pair
+GroupKey = Callable[[int, Item], Any]
+
+GROUP_KEYS = {
+    "full_name": lambda _warehouse_id, item: item.full_name(),
+    "category": lambda _warehouse_id, item: item.category,
+    "state": lambda _warehouse_id, item: item.state,
+    "warehouse": lambda warehouse_id, _item: warehouse_id,
+}
+
+STATISTICS = ("count", "min_date", "max_date", "mean_age")
+
+
+class GroupStatistics(NamedTuple):
+    """Statistics of one group, those which were not asked for are None.
+    mean_age is expressed in days"""
+
+    count: int
+    min_date: datetime.datetime = None
+    max_date: datetime.datetime = None
+    mean_age: float = None
+
+
+def group_by(
+    pairs: Iterable[WarehouseItemPair],
+    by: Union[str, GroupKey, Sequence[Union[str, GroupKey]]] = "full_name",
+    statistics: Sequence[str] = ("count",),
+    now: datetime.datetime = None,
+) -> dict[Any, GroupStatistics]:
+    """Groups (warehouse_id, Item) pairs in a single pass
+    and returns { key: GroupStatistics }
+
+    by is a name from GROUP_KEYS, a function of (warehouse_id, item)
+    or a sequence of those, in which case keys of the result are tuples"""
+    validate_statistics(statistics)
+    key_of = _key_function(by)
+    if set(statistics) <= {"count"}:
+        # NOTE: fast path, Counter does the counting in C
+        counts = collections.Counter(key_of(*pair) for pair in pairs)
+        return {key: GroupStatistics(count) for key, count in counts.items()}
+
+    now = now if now is not None else datetime.datetime.today()
+    counts = collections.Counter()
+    min_dates = {}
+    max_dates = {}
+    age_sums = {}
+    for warehouse_id, item in pairs:
+        key = key_of(warehouse_id, item)
+        date = item.date_of_stock
+        if key in counts:
+            if date < min_dates[key]:
+                min_dates[key] = date
+            if date > max_dates[key]:
+                max_dates[key] = date
+            age_sums[key] += now - date
+        else:
+            min_dates[key] = max_dates[key] = date
+            age_sums[key] = now - date
+        counts[key] += 1
+
+    def statistic(name, value):
+        return value if name in statistics else None
+
+    return {
+        key: GroupStatistics(
+            count=count,
+            min_date=statistic("min_date", min_dates[key]),
+            max_date=statistic("max_date", max_dates[key]),
+            mean_age=statistic("mean_age", mean_age(age_sums[key], count)),
+        )
+        for key, count in counts.items()
+    }
+
+
+def validate_statistics(statistics: Sequence[str]) -> None:
+    unknown = set(statistics) - set(STATISTICS)
+    if unknown:
+        raise ValueError(f"Unknown statistics: {', '.join(sorted(unknown))}")
+
+
+def mean_age(total_age: datetime.timedelta, count: int) -> float:
+    """Returns mean age in days"""
+    return total_age / count / datetime.timedelta(days=1)
+
+
+def _key_function(by) -> GroupKey:
+    if isinstance(by, str) or callable(by):
+        return _single_key_function(by)
+    key_functions = [_single_key_function(key) for key in by]
+    return lambda warehouse_id, item: tuple(
+        key_of(warehouse_id, item) for key_of in key_functions
+    )
+
+
+def _single_key_function(by) -> GroupKey:
+    if callable(by):
+        return by
+    try:
+        return GROUP_KEYS[by]
+    except KeyError:
+        raise ValueError(f"Unknown group key: {by}") from None
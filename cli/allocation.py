@@ -0,0 +1,134 @@
+"""Choosing which items (from which warehouses) fulfil an order"""
+from __future__ import annotations
+import heapq
+import collections
+import itertools
+from index import age_order
+from typing import Callable, NamedTuple
+
+# NOTE: all policies take { warehouse_id: [Item, ...] } with items sorted oldest first
+# (like StockIndex.items_named), the amount ordered
+# and { warehouse_id: number of items } already taken (by earlier orders of a batch)
+# from the front of those lists,
+# and return up to amount (warehouse_id, Item) pairs
+
+
+def allocate_fifo(items_per_warehouse: dict, amount: int, taken: dict) -> list[tuple]:
+    """Oldest items first, wherever they are"""
+    oldest_first = heapq.merge(
+        *(
+            zip(
+                itertools.repeat(warehouse_id),
+                map(items.__getitem__, range(taken[warehouse_id], len(items))),
+            )
+            for warehouse_id, items in sorted(items_per_warehouse.items())
+        ),
+        key=lambda pair: age_order(pair[1]),
+    )
+    return list(itertools.islice(oldest_first, amount))
+
+
+def allocate_single_warehouse(
+    items_per_warehouse: dict, amount: int, taken: dict
+) -> list[tuple]:
+    """The whole order from one warehouse if possible (the one with the oldest items),
+    otherwise from as few warehouses as possible.
+    Oldest items first in each warehouse"""
+    left = {
+        id: len(items) - taken[id]
+        for id, items in items_per_warehouse.items()
+        if len(items) > taken[id]
+    }
+    able = [id for id in left if left[id] >= amount]
+    if able:
+        warehouse_ids = [
+            min(
+                able,
+                key=lambda id: (age_order(items_per_warehouse[id][taken[id]]), id),
+            )
+        ]
+    else:
+        warehouse_ids = sorted(left, key=lambda id: (-left[id], id))
+    allocation = []
+    for warehouse_id in warehouse_ids:
+        start = taken[warehouse_id]
+        missing = amount - len(allocation)
+        allocation.extend(
+            (warehouse_id, item)
+            for item in items_per_warehouse[warehouse_id][start : start + missing]
+        )
+    return allocation
+
+
+def allocate_balanced(
+    items_per_warehouse: dict, amount: int, taken: dict
+) -> list[tuple]:
+    """Each item from the warehouse which has most of them left,
+    so that stock levels even out. Oldest items first in each warehouse"""
+    # NOTE: heap of (-amount left, warehouse_id, position of the next item)
+    heap = [
+        (taken[id] - len(items), id, taken[id])
+        for id, items in items_per_warehouse.items()
+        if len(items) > taken[id]
+    ]
+    heapq.heapify(heap)
+    allocation = []
+    while heap and len(allocation) < amount:
+        left, warehouse_id, position = heap[0]
+        allocation.append((warehouse_id, items_per_warehouse[warehouse_id][position]))
+        if left < -1:
+            heapq.heapreplace(heap, (left + 1, warehouse_id, position + 1))
+        else:
+            heapq.heappop(heap)
+    return allocation
+
+
+ALLOCATION_POLICIES: dict[str, Callable[[dict, int, dict], list[tuple]]] = {
+    "fifo": allocate_fifo,
+    "single_warehouse": allocate_single_warehouse,
+    "balanced": allocate_balanced,
+}
+
+
+def allocate(
+    items_per_warehouse: dict, amount: int, policy: str = "fifo", taken: dict = None
+) -> list:
+    """Returns (warehouse_id, Item) pairs chosen by the policy to fulfil an order,
+    fewer than amount if there are not enough items.
+    taken counts items (per warehouse) already promised to other orders,
+    it is updated with the items of this order"""
+    try:
+        allocate_with_policy = ALLOCATION_POLICIES[policy]
+    except KeyError:
+        raise ValueError(f"Unknown allocation policy: {policy}") from None
+    if taken is None:
+        taken = collections.Counter()
+    if amount <= 0:
+        return []
+    allocation = allocate_with_policy(items_per_warehouse, amount, taken)
+    taken.update(id for id, _item in allocation)
+    return allocation
+
+
+class OrderResult(NamedTuple):
+    """Outcome of one (item_name, amount) order,
+    allocation holds the (warehouse_id, Item) pairs taken out of stock"""
+
+    item_name: str
+    amount: int
+    status: str  # "fulfilled", "partial" or "rejected"
+    allocation: list
+
+    @classmethod
+    def of(cls, item_name: str, amount: int, allocation: list) -> OrderResult:
+        if amount > 0 and len(allocation) == amount:
+            status = "fulfilled"
+        elif allocation:
+            status = "partial"
+        else:
+            status = "rejected"
+        return cls(item_name, amount, status, allocation)
+
+    def amounts_by_warehouse(self) -> dict[int, int]:
+        """Returns { warehouse_id: amount of items taken from it }"""
+        return dict(collections.Counter(id for id, _item in self.allocation))
@@ -1,35 +1,247 @@
-from classes import User, Employee
+from __future__ import annotations
+from classes import User, Employee, Item, Warehouse
 from loader import PersonnelLoader, WarehouseLoader
-import json
+from index import NameMatch, StockIndex, normalize_name
+from aggregation import group_by
+from ages import DEFAULT_BUCKETS, age_histogram, ages, older_than, oldest
+from allocation import OrderResult, allocate
+from concurrency import ReadWriteLock, reading, writing
+from json_records import JSONRecords, iter_json_records
+from metrics import REGISTRY, timed
+from profiling import PROFILER, profiled
+from snapshot import Snapshot
+from datetime import datetime
+import argparse
+import collections
+import importlib
 import itertools
+import os
+import threading
+from typing import Iterable, Iterator
+
+DATA_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PERSONNEL_FILE = os.path.join(DATA_DIRECTORY, "personnel.json")
+DEFAULT_STOCK_FILE = os.path.join(DATA_DIRECTORY, "stock.json")
+DEFAULT_SNAPSHOT_FILE = os.path.join(DATA_DIRECTORY, "warehouse.snapshot")
+
+# names suggested when a searched item is not in stock
+SUGGESTIONS = 5
 
 
 def read_and_parse_json_file(file_name):
-    with open(file_name) as f:
-        records = json.loads(f.read())
-    return records
+    return list(iter_json_records(file_name))
+
+
+def ordered_items(results: list[OrderResult]) -> int:
+    """Returns how many items were taken out of stock for the orders"""
+    return sum(len(result.allocation) for result in results)
+
+
+def file_version(file_name: str) -> tuple:
+    """Returns something that changes whenever the file changes"""
+    stat = os.stat(file_name)
+    return (stat.st_mtime_ns, stat.st_size)
 
 
 class WarehouseManager:
-    personnel_records = read_and_parse_json_file("cli/personnel.json")
-    item_records = read_and_parse_json_file("cli/stock.json")
+    # NOTE: records are streamed from the files each time they are loaded
+    personnel_records = JSONRecords(DEFAULT_PERSONNEL_FILE)
+    item_records = JSONRecords(DEFAULT_STOCK_FILE)
+
+    # built by _load() when any of them is used for the first time
+    _LAZY_ATTRIBUTES = (
+        "_personnel",
+        "_personnel_index",
+        "_stock",
+        "_warehouses",
+        "_index",
+    )
+
+    # how remove_ordered_items chooses items, see allocation.ALLOCATION_POLICIES
+    allocation_policy = "fifo"
+
+    # (class, personnel_file, stock_file) -> (file versions, WarehouseManager)
+    _instances = {}
 
     def __init__(
-        self, personnel_records=personnel_records, item_records=item_records
+        self,
+        personnel_records=personnel_records,
+        item_records=item_records,
+        snapshot: Snapshot = None,
+        warehouse_loader: WarehouseLoader = None,
     ) -> None:
-        self._personnel = list(PersonnelLoader().load_records(personnel_records))
-        self._stock = list(WarehouseLoader().load_records(item_records))
-        self._warehouses = {warehouse.id: warehouse for warehouse in self._stock}
+        self._personnel_records = personnel_records
+        self._item_records = item_records
+        self._snapshot = snapshot
+        self._warehouse_loader = warehouse_loader or WarehouseLoader()
+        # NOTE: queries read under this lock, changes of stock write under it,
+        # hold lock.read() to see the same stock in several queries
+        self.lock = ReadWriteLock()
+        self._load_lock = threading.Lock()
+
+    @classmethod
+    def from_files(
+        cls,
+        personnel_file: str = DEFAULT_PERSONNEL_FILE,
+        stock_file: str = DEFAULT_STOCK_FILE,
+        snapshot_file: str = None,
+        warehouse_loader: WarehouseLoader = None,
+    ) -> WarehouseManager:
+        """Returns a (lazily loaded) manager of the data in given files.
+        The same manager is returned as long as the files don't change.
+        If snapshot_file is given, data is loaded from it (while it is up to date)
+        and it is (re)written after loading the files"""
+        key = (cls, os.path.abspath(personnel_file), os.path.abspath(stock_file))
+        versions = (file_version(personnel_file), file_version(stock_file))
+        cached_versions, manager = cls._instances.get(
+            key + (snapshot_file,), (None, None)
+        )
+        if cached_versions != versions:
+            manager = cls(
+                JSONRecords(key[1]),
+                JSONRecords(key[2]),
+                snapshot=Snapshot(snapshot_file, sources=key[1:])
+                if snapshot_file
+                else None,
+                warehouse_loader=warehouse_loader,
+            )
+            cls._instances[key + (snapshot_file,)] = (versions, manager)
+        return manager
+
+    def __getattr__(self, name):
+        # NOTE: only called when an attribute is missing,
+        # so there is no cost at all once the data is loaded
+        if name in type(self)._LAZY_ATTRIBUTES:
+            with self._load_lock:
+                if not self.is_loaded:  # NOTE: another thread may have loaded it
+                    self._load()
+            return object.__getattribute__(self, name)
+        raise AttributeError(
+            f"{type(self).__name__!r} object has no attribute {name!r}"
+        )
+
+    @timed()
+    @profiled()
+    def _load(self) -> None:
+        """Loads the records given to the constructor
+        (or their snapshot, if up to date)"""
+        loaded = self._snapshot.load() if self._snapshot else None
+        if loaded:
+            personnel, stock = loaded
+        else:
+            personnel = list(PersonnelLoader().load_records(self._personnel_records))
+            stock = list(self._warehouse_loader.load_records(self._item_records))
+            if self._snapshot:
+                self._snapshot.save(personnel, stock)
+        self._index_personnel(personnel)
+        self._index_stock(stock)
+        # NOTE: records are not needed anymore, let them be garbage collected
+        del self._personnel_records, self._item_records
+
+    # NOTE: other threads use the lazy attributes as soon as they are set,
+    # without waiting for _load(), so each of them is only set once complete
+    # (and _stock last, is_loaded)
+
+    def _index_personnel(self, personnel: list[Employee]) -> None:
+        personnel_index = {}
+        for employee in personnel:
+            # NOTE: first one wins, like a search through the list would
+            personnel_index.setdefault(employee.name, employee)
+        self._personnel = personnel
+        self._personnel_index = personnel_index
+
+    def _index_stock(self, stock: list[Warehouse]) -> None:
+        """Keeps track of the loaded warehouses, see _register_warehouse"""
+        self._warehouses = {warehouse.id: warehouse for warehouse in stock}
+        self._index = StockIndex(stock)
+        self._stock = stock
+
+    @property
+    def is_loaded(self) -> bool:
+        return "_stock" in self.__dict__
 
     def __repr__(self) -> str:
         return f"{type(self).__name__}(number_of_items={len(self._stock)}, id={self._warehouses})"
 
+    @timed()
     def get_employee(self, user_name: str) -> Employee:
         """Returns Employee instance with a given name if in system, otherwise None"""
-        return next(
-            (employee for employee in self._personnel if employee.is_named(user_name)),
-            None,
-        )
+        return self._personnel_index.get(user_name)
+
+    def _register_warehouse(self, warehouse: Warehouse) -> None:
+        """Starts keeping track of a warehouse (loaded or new) and its stock"""
+        self._warehouses[warehouse.id] = warehouse
+        self._index.add_warehouse(warehouse)
+
+    @timed()
+    @writing
+    def add_item(self, warehouse_id: int, item: Item) -> None:
+        """Adds item to the warehouse with given ID (created if needed)"""
+        self._add_item(warehouse_id, item)
+
+    def _add_item(self, warehouse_id: int, item: Item) -> None:
+        warehouse = self._warehouses.get(warehouse_id)
+        if warehouse is None:
+            warehouse = Warehouse(warehouse_id)
+            self._stock.append(warehouse)
+            self._stock.sort(key=lambda w: w.id)
+            self._register_warehouse(warehouse)
+        warehouse.add_item(item)
+
+    @timed()
+    @writing
+    def remove_item(self, warehouse_id: int, item: Item) -> Item:
+        """Removes item equal to the given one from the warehouse with given ID
+        and returns it"""
+        return self._remove_item(warehouse_id, item)
+
+    def _remove_item(self, warehouse_id: int, item: Item) -> Item:
+        warehouse = self._warehouses[warehouse_id]
+        # NOTE: the indexed object itself is removed from the stock in O(1)
+        return warehouse.remove_item(self._index.find(warehouse_id, item))
+
+    @timed()
+    @writing
+    def apply_stock_changes(
+        self, changes: Iterable[tuple], metadata: dict = None
+    ) -> list[tuple]:
+        """Applies ("add" or "remove", warehouse_id, Item) changes in order,
+        under one lock.
+        Returns the removals of items which were not in stock (they change nothing).
+        Backends which store every change right away (see sqlite_backend) store metadata
+        (as save_snapshot does) together with the changes, here it is not used"""
+        missing = []
+        for event, warehouse_id, item in changes:
+            if event == "add":
+                self._add_item(warehouse_id, item)
+            else:
+                try:
+                    self._remove_item(warehouse_id, item)
+                except (KeyError, ValueError):
+                    missing.append((event, warehouse_id, item))
+        return missing
+
+    @timed()
+    @writing
+    def save_snapshot(self, metadata: dict = None) -> None:
+        """Writes the stock as it is now (with metadata, e.g. how far a delta feed
+        was applied to it) to the snapshot, to be loaded instead of the source files"""
+        if self._snapshot is None:
+            raise ValueError("There is no snapshot file to save to")
+        self._snapshot.save(self._personnel, self._stock, metadata)
+
+    @property
+    def has_snapshot(self) -> bool:
+        return self._snapshot is not None
+
+    @property
+    def snapshot_metadata(self) -> dict:
+        """Returns metadata saved with the snapshot the stock was loaded from
+        (or last saved to), {} without a snapshot"""
+        self._stock  # NOTE: loads the snapshot, if not loaded yet
+        return self._snapshot.metadata if self._snapshot else {}
+
+    # NOTE: the _all_* iterables are lazy, they should be consumed under self.lock
 
     def _all_items_in_warehouse_filtered(
         self, source=lambda w: w.stock, filter=lambda _x: True
@@ -49,72 +261,161 @@ class WarehouseManager:
     def _all_named_items_with_warehouse_id(self, item_name):
         """Returns an iterable -> tuple of all items with a given item_name in our warehouses with the id of warehouse
         (warehouse_id, Item), (warehouse_id, Item), ..."""
-        return self._all_items_in_warehouse_filtered(
-            source=lambda w: w.search(item_name)
-        )
+        return self._all_indexed_items(self._index.items_named(item_name))
 
     # TODO: private
-    # TODO: use _all_items_in_warehouse_filtered
     def _all_items_of_category_with_warehouse_id(self, category):
         """Returns an iterable -> tuple of all items with of a given category in our warehouses with the id of warehouse
         (warehouse_id, Item), (warehouse_id, Item), ..."""
-        return self._all_items_in_warehouse_filtered(
-            filter=lambda i: i.category == category
+        return self._all_indexed_items(self._index.items_of_category(category))
+
+    def _all_indexed_items(self, items_per_warehouse: dict):
+        """Flattens { warehouse_id: [Item, ...] } from the index
+        into (warehouse_id, Item) pairs, in the order of warehouse IDs"""
+        return itertools.chain.from_iterable(
+            ((id, item) for item in items_per_warehouse[id])
+            for id in sorted(items_per_warehouse)
         )
 
+    @timed(items=len)
+    @reading
+    def get_items_named(self, item_name: str) -> list[tuple]:
+        """Returns list of (warehouse_id, Item) with a given item name
+        (case insensitive), by warehouse, oldest first"""
+        return list(self._all_named_items_with_warehouse_id(item_name))
+
+    @timed(items=len)
+    @reading
+    def search_item_names(self, query: str, limit: int = 10) -> list[NameMatch]:
+        """Returns up to limit names of items in stock matching the query, best first:
+        the exact name, names with all words of the query in any order
+        (the last one may be unfinished), names with words close to misspelled ones"""
+        return self._index.search_names(query, limit)
+
+    def iter_items(
+        self, item_name: str = None, category: str = None
+    ) -> Iterator[tuple]:
+        """Yields (warehouse_id, Item) of all items, or of those with a given name
+        or category (by warehouse, oldest first), without building a list of them.
+        Stock stays locked for reading until the iteration ends
+        (or the iterator is closed)"""
+        with self.lock.read():
+            if item_name is not None:
+                yield from self._all_named_items_with_warehouse_id(item_name)
+            elif category is not None:
+                yield from self._all_items_of_category_with_warehouse_id(category)
+            else:
+                yield from self._all_items_with_warehouse_id()
+
+    @timed(items=len)
+    @reading
+    def get_days_in_warehouse(self, item_name: str, today=None) -> list[tuple]:
+        """Returns (warehouse_id, days_in_warehouse) for every item with a given name,
+        in the same order as _all_named_items_with_warehouse_id"""
+        today = today if today is not None else datetime.today()
+        return ages(self._all_named_items_with_warehouse_id(item_name), today)
+
+    def _age_groups(self, item_name: str = None, category: str = None) -> list[dict]:
+        """Returns { warehouse_id: [Item, ...] } of the index (oldest first) with items
+        of a given name or category, or of all items (one for each category)"""
+        if item_name is not None:
+            return [self._index.items_named(item_name)]
+        if category is not None:
+            return [self._index.items_of_category(category)]
+        return [
+            self._index.items_of_category(category)
+            for category in self._index.categories()
+        ]
+
+    @timed(items=len)
+    @reading
+    def get_items_older_than(
+        self, days: int, item_name: str = None, category: str = None, today=None
+    ) -> list[tuple]:
+        """Returns (warehouse_id, Item) of items (with a given name or category)
+        in stock for at least days, oldest first"""
+        today = today if today is not None else datetime.today()
+        return older_than(self._age_groups(item_name, category), days, today)
+
+    @timed(items=len)
+    @reading
+    def get_oldest_items(
+        self, amount: int, item_name: str = None, category: str = None
+    ) -> list[tuple]:
+        """Returns (warehouse_id, Item) of up to amount oldest items
+        (with a given name or category), oldest first"""
+        return oldest(self._age_groups(item_name, category), amount)
+
+    @timed(items=len)
+    @reading
+    def get_age_histogram(
+        self,
+        buckets=DEFAULT_BUCKETS,
+        item_name: str = None,
+        category: str = None,
+        today=None,
+    ) -> dict[int, list[int]]:
+        """Returns { warehouse_id: [amount of items, ...] } of items
+        (with a given name or category) by age: below the first of buckets (in days),
+        from each bound to the next, from the last on"""
+        return age_histogram(self._age_groups(item_name, category), buckets, today)
+
+    @timed()
+    @reading
     def calculate_total_amount(self) -> int:
         """Returns total amount of all items in all warehouses"""
         return sum(warehouse.occupancy() for warehouse in self._stock)
 
+    @timed()
+    @reading
     def calculate_item_amount_in_warehouse(self, id: int, item_name: str) -> int:
         """Returns the amount of items with a given name in the warehouse with given ID"""
-        return len(self._warehouses[id].search(item_name))
+        return self._index.count(item_name, id)
 
+    @timed()
+    @reading
     def calculate_item_total_amount(self, item_name: str = None) -> int:
         """Returns total amount of items with a given name in all warehouses combined"""
-        return sum(
-            self.calculate_item_amount_in_warehouse(warehouse.id, item_name)
-            for warehouse in self._stock
-        )
+        return self._index.count(item_name)
 
+    @timed(items=len)
+    @reading
     def get_unique_item_names(self) -> set:
         """Returns set of unique item names in all warehouses"""
-        return set(item[1].full_name() for item in self._all_items_with_warehouse_id())
+        return self._index.full_names()
 
+    @timed(items=len)
+    @reading
     def get_amount_of_item_in_each_warehouse(self, items: set) -> dict:
         """Returns dictionary with item names and amount of items per warehouse in format:
         { item_name1: { warehouse_id_1: amount_of_items, warehouse_id_2: amount_of_items, ... }, { item_name2: {...} }
         """
         return {
             item_name: {
-                warehouse.id: self.calculate_item_amount_in_warehouse(
-                    warehouse.id, item_name
-                )
+                warehouse.id: self._index.count(item_name, warehouse.id)
                 for warehouse in self._stock
             }
             for item_name in items
         }
 
+    @timed(items=len)
+    @reading
     def get_unique_categories(self) -> set[str]:
         """Returns list of unique categories in all warehouses"""
-        return set(item[1].category for item in self._all_items_with_warehouse_id())
+        return self._index.categories()
 
+    @timed(items=len)
+    @reading
     def calculate_amount_of_items_in_category(
         self, categories: set[str]
     ) -> list[tuple]:
         """Returns list of tuples with category and total amount of items of that category"""
         return [
-            (
-                category,
-                sum(
-                    1
-                    for item in self._all_items_with_warehouse_id()
-                    if item[1].category == category
-                ),
-            )
-            for category in categories
+            (category, self._index.category_count(category)) for category in categories
         ]
 
+    @timed(items=len)
+    @reading
     def get_all_items_of_category(self, category: str) -> list[tuple]:
         """Returns list of tuples with full name of item of given category and ID of warehouse
         [ (item_full_name, warehouse_id), (item_full_name, warehouse_id) ]
@@ -126,21 +427,121 @@ class WarehouseManager:
             )
         ]
 
-    def remove_ordered_items(self):
-        pass
+    @timed(items=len)
+    @reading
+    def aggregate(
+        self, by=("full_name",), statistics=("count",), now=None, filter=None
+    ) -> dict:
+        """Groups all items (optionally only those passing filter) in a single pass,
+        returns { key: GroupStatistics }, see aggregation.group_by"""
+        return group_by(
+            self._all_items_in_warehouse_filtered(filter=filter or (lambda _x: True)),
+            by=by,
+            statistics=statistics,
+            now=now,
+        )
+
+    @timed(items=len)
+    @reading
+    def get_item_amounts_by_warehouse(self) -> dict:
+        """Returns amounts of all items per warehouse, computed in a single pass,
+        in format:
+        { item_name1: { warehouse_id_1: amount_of_items, ... }, item_name2: {...} }
+        (warehouses without the item are left out)"""
+        amounts = {}
+        for (item_name, warehouse_id), statistics in self.aggregate(
+            by=("full_name", "warehouse")
+        ).items():
+            amounts.setdefault(item_name, {})[warehouse_id] = statistics.count
+        return amounts
+
+    @timed(items=len)
+    @reading
+    def get_categories_with_amount(self) -> list[tuple]:
+        """Returns list of tuples with each category and total amount of items
+        of that category, computed in a single pass"""
+        return [
+            (category, statistics.count)
+            for category, statistics in self.aggregate(by="category").items()
+        ]
+
+    @timed(items=len)
+    @writing
+    def remove_ordered_items(
+        self, item_name: str, amount: int, policy: str = None
+    ) -> list[tuple]:
+        """Removes up to amount items with a given name from stock,
+        chosen by the allocation policy (default is self.allocation_policy),
+        returns the removed items as (warehouse_id, Item) pairs"""
+        allocation = allocate(
+            self._items_named(item_name), amount, policy or self.allocation_policy
+        )
+        self._remove_allocated(allocation)
+        return allocation
+
+    @timed(items=ordered_items)
+    @writing
+    def place_orders(
+        self, orders: Iterable[tuple[str, int]], policy: str = None
+    ) -> list[OrderResult]:
+        """Fulfils many (item_name, amount) orders in one pass, as far as stock allows,
+        returns an OrderResult per order (in the same order).
+        Orders are grouped by item name, so each name is looked up once,
+        orders for the same item are served first come, first served"""
+        orders = list(orders)
+        positions_by_name = {}
+        for position, (item_name, _amount) in enumerate(orders):
+            positions_by_name.setdefault(normalize_name(item_name), []).append(position)
+        results = [None] * len(orders)
+        allocations = []
+        for name, positions in positions_by_name.items():
+            items_per_warehouse = self._items_named(name)
+            taken = collections.Counter()
+            for position in positions:
+                item_name, amount = orders[position]
+                allocation = allocate(
+                    items_per_warehouse,
+                    amount,
+                    policy or self.allocation_policy,
+                    taken,
+                )
+                allocations.append(allocation)
+                results[position] = OrderResult.of(item_name, amount, allocation)
+        # NOTE: stock changes only now, all at once
+        self._remove_allocated(itertools.chain.from_iterable(allocations))
+        return results
+
+    def _items_named(self, item_name: str) -> dict[int, list[Item]]:
+        """Returns { warehouse_id: [Item, ...] } of items with a given name,
+        oldest first, to allocate orders from"""
+        return self._index.items_named(item_name)
+
+    def _remove_allocated(self, allocation: Iterable[tuple]) -> None:
+        """Removes (warehouse_id, Item) pairs from stock, warehouse by warehouse"""
+        items_by_warehouse = {}
+        for warehouse_id, item in allocation:
+            items_by_warehouse.setdefault(warehouse_id, []).append(item)
+        for warehouse_id, items in items_by_warehouse.items():
+            self._warehouses[warehouse_id].remove_items(items)
 
 
 # TODO: write unit tests :-)
 class ConsoleUserInterface:
+    # where everything is printed, None is sys.stdout (as for print)
+    output = None
+
     def ask_user_name(self) -> str:
         return input("\nEnter your name: ")
 
     def greet_user(self, user: User):
-        return user.greet()
+        return user.greet(file=self.output)
+
+    def say_goodbye(self, user: User, actions: list) -> None:
+        user.bye(actions, file=self.output)
 
     def display_operations(self) -> None:
         """Prints list of operation in main menu"""
-        print("\nOptions:")
+        print("\nOptions:", file=self.output)
         options = [
             "List all items",
             "Search an item and place an order",
@@ -148,7 +549,7 @@ class ConsoleUserInterface:
             "Quit",
         ]
         for id, option in enumerate(options, 1):
-            print(f"{id}. {option}")
+            print(f"{id}. {option}", file=self.output)
 
     def ask_for_operation(self) -> str:
         valid_operations = ["1", "2", "3", "4"]
@@ -160,7 +561,7 @@ class ConsoleUserInterface:
         return operation
 
     def print_no_operation_error(self, operation: str) -> None:
-        print(f"\n\n\t***** No operation {operation}! *****\n")
+        print(f"\n\n\t***** No operation {operation}! *****\n", file=self.output)
 
     def display_items(self, items: dict) -> None:
         """'Input: { Item1': {id1: amount, id2: amount, id3: amount, ...}, 'Item2': {id1: amount, id2: amount, ...}}
@@ -175,7 +576,7 @@ class ConsoleUserInterface:
 
         """
         for item_name, warehouse_info in items.items():
-            print(f"\n{item_name}\n")
+            print(f"\n{item_name}\n", file=self.output)
             print(
                 "\n".join(
                     [
@@ -183,7 +584,8 @@ class ConsoleUserInterface:
                         for id, amount in warehouse_info.items()
                         if amount > 0
                     ]
-                )
+                ),
+                file=self.output,
             )
 
     def ask_for_item_name(self) -> str:
@@ -191,21 +593,27 @@ class ConsoleUserInterface:
 
     def display_search_result(self, items: list[tuple]) -> None:
         if not items:
-            print("\nNot in stock")
+            print("\nNot in stock", file=self.output)
             return
         total_number_of_items = len(items)
         item_name = items[0][1].full_name()
-        print(f"\n{total_number_of_items} {item_name} in stock")
-        for item in items:
-            id, days = item
-            print(f"\tIn Warehouse {id} for {days.days_in_warehouse()} days")
+        print(f"\n{total_number_of_items} {item_name} in stock", file=self.output)
+        for id, days in ages(items, datetime.today()):
+            print(f"\tIn Warehouse {id} for {days} days", file=self.output)
 
     def display_all_items_of_category(
         self, category: str, items_in_category_and_warehouse_id: list[tuple]
     ) -> None:
-        print(f"\n{category}:")
+        print(f"\n{category}:", file=self.output)
         for item, warehouse_id in items_in_category_and_warehouse_id:
-            print(f"{item}, Warehouse {warehouse_id}")
+            print(f"{item}, Warehouse {warehouse_id}", file=self.output)
+
+    def display_suggestions(self, matches: list[NameMatch]) -> None:
+        if matches:
+            print(
+                "Did you mean: " + ", ".join(match.name for match in matches) + "?",
+                file=self.output,
+            )
 
     def ask_if_user_want_to_order(self) -> str:
         action = input("\nDo you wanat to order? (y/n): ")
@@ -220,12 +628,15 @@ class ConsoleUserInterface:
     def ask_how_much_to_order(self) -> int:
         amount_to_order = input("\nHow many would you like to order? ")
         while not amount_to_order.isnumeric():
-            print("\n***** Input not valid! *****")
+            self.print_input_not_valid()
             amount_to_order = input("\nHow many would you like to order? ")
         return int(amount_to_order)
 
+    def print_input_not_valid(self) -> None:
+        print("\n***** Input not valid! *****", file=self.output)
+
     def print_not_enough_items_in_stock(self, max_amount: int, item_name: str) -> None:
-        print(f"\nThere are only {max_amount} {item_name}")
+        print(f"\nThere are only {max_amount} {item_name}", file=self.output)
 
     def ask_if_user_want_to_order_max_amount(self, max_amount: int) -> str:
         action = input(f"\nDo you want to order maximum amount ({max_amount})? (y/n): ")
@@ -237,20 +648,35 @@ class ConsoleUserInterface:
         return action == "y"
 
     def print_order(self, number_to_order: int, item_name: str) -> None:
-        print(f"\nYou have ordered {number_to_order} {item_name}")
+        print(f"\nYou have ordered {number_to_order} {item_name}", file=self.output)
 
     def print_order_cancelled(self) -> None:
-        print("\nOrder cancelled")
+        print("\nOrder cancelled", file=self.output)
 
     def display_categories(self, categories_numbered: dict) -> None:
-        print()
+        print(file=self.output)
         for id, value in categories_numbered.items():
             category, amount = value
-            print(f"{id}. {category} ({amount})")
+            print(f"{id}. {category} ({amount})", file=self.output)
 
     def ask_for_number_of_category_to_browse(self) -> str:
         return input("\nType the number of category you want to browse: ")
 
+    def display_metrics(self, rows: list[dict]) -> None:
+        print("\nOperation statistics (times in ms):", file=self.output)
+        print(
+            f"{'operation':<55}{'calls':>7}{'total':>11}{'mean':>10}"
+            f"{'p50':>10}{'p99':>10}{'items':>10}",
+            file=self.output,
+        )
+        for row in rows:
+            print(
+                f"{row['operation']:<55}{row['calls']:>7}{row['total_ms']:>11.3f}"
+                f"{row['mean_ms']:>10.3f}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}"
+                f"{row['items']:>10}",
+                file=self.output,
+            )
+
 
 # When writing unit tests for Controller...
 # ... you will need to sometimes patch input
@@ -273,7 +699,7 @@ class ConsoleUserInterface:
 class Controller:
     def __init__(self, manager=None, console=None, user=None) -> None:
         self.user = user
-        self.manager = manager if manager else WarehouseManager()
+        self.manager = manager if manager else WarehouseManager.from_files()
         self.console = console if console else ConsoleUserInterface()
         self._actions = []
         # TODO:
@@ -338,28 +764,33 @@ class Controller:
         operation_number = self.console.ask_for_operation()
         return operation_number
 
+    @timed()
+    @profiled()
     def operation_list_items_by_warehouse(self):
-        items = self.manager.get_unique_item_names()
         dict_of_items_with_amount_pro_warehouse = (
-            self.manager.get_amount_of_item_in_each_warehouse(items)
+            self.manager.get_item_amounts_by_warehouse()
         )
         self.console.display_items(dict_of_items_with_amount_pro_warehouse)
-        amount_of_all_items = self.manager.calculate_total_amount()
+        amount_of_all_items = sum(
+            sum(amounts.values())
+            for amounts in dict_of_items_with_amount_pro_warehouse.values()
+        )
         self._actions.append(f"You have listed all {amount_of_all_items} items")
 
+    @timed()
+    @profiled()
     def operation_search_an_item_and_place_an_order(self):
         item_name = self.console.ask_for_item_name()
-        total_number_of_items = self.manager.calculate_item_total_amount(item_name)
-        items_list = (
-            list(self.manager._all_named_items_with_warehouse_id(item_name))
-            if total_number_of_items > 0
-            else []
-        )
+        items_list = self.manager.get_items_named(item_name)
+        total_number_of_items = len(items_list)
         if items_list:
             item_name = items_list[0][1].full_name()
         self.console.display_search_result(items_list)
         self._actions.append(f"You have searched for {item_name}")
         if not total_number_of_items:
+            self.console.display_suggestions(
+                self.manager.search_item_names(item_name, SUGGESTIONS)
+            )
             return
         if not self.do_you_want_to_order():
             self.console.print_order_cancelled()
@@ -368,17 +799,19 @@ class Controller:
             return
         ordered_number = self.order(item_name, total_number_of_items)
         if ordered_number:
-            self.manager.remove_ordered_items()  # TODO
+            # NOTE: others may have ordered in the meantime, there can be fewer left
+            ordered_number = len(
+                self.manager.remove_ordered_items(item_name, ordered_number)
+            )
             self.console.print_order(ordered_number, item_name)
             self._actions.append(f"You have ordered {ordered_number} {item_name}")
         else:
             self.console.print_order_cancelled()
 
+    @timed()
+    @profiled()
     def operation_browse_by_category(self):
-        categories = self.manager.get_unique_categories()
-        category_and_amount_of_items = (
-            self.manager.calculate_amount_of_items_in_category(categories)
-        )
+        category_and_amount_of_items = self.manager.get_categories_with_amount()
         categories_numbered = {
             f"{id}": item for id, item in enumerate(category_and_amount_of_items, 1)
         }
@@ -395,8 +828,22 @@ class Controller:
             )
             self._actions.append(f"You have searched for category: {category}")
 
+    @timed()
     def operation_quit(self):
-        self.user.bye(self._actions)
+        self._say_goodbye()
+        if REGISTRY.enabled and REGISTRY.file_name:
+            REGISTRY.export()
+
+    def _say_goodbye(self):
+        """Displays goodbye, with operation statistics for logged in employees"""
+        self.console.say_goodbye(self.user, self._actions)
+        # NOTE: like the actions in bye, statistics are only for employees
+        if (
+            REGISTRY.enabled
+            and isinstance(self.user, Employee)
+            and self.user.is_authenticated
+        ):
+            self.console.display_metrics(REGISTRY.report())
 
     def main(self):
         self._welcome_user()
@@ -418,6 +865,80 @@ class Controller:
                 self.operation_quit()
 
 
+# backend name -> (module, class name), modules are imported only when selected
+BACKENDS = {
+    "python": ("app", "WarehouseManager"),
+    "numpy": ("numpy_backend", "NumpyWarehouseManager"),
+    "sqlite": ("sqlite_backend", "SqliteWarehouseManager"),
+    "mapped": ("mapped_backend", "MappedWarehouseManager"),
+}
+
+
+def get_manager_class(backend: str = "python") -> type:
+    """Returns the WarehouseManager (sub)class implementing given backend"""
+    try:
+        module_name, class_name = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown backend: {backend}") from None
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def manager_from_environment(
+    personnel_file: str = DEFAULT_PERSONNEL_FILE, stock_file: str = DEFAULT_STOCK_FILE
+) -> WarehouseManager:
+    """Returns the manager of given files,
+    configured by WAREHOUSE_* environment variables"""
+    manager_class = get_manager_class(os.environ.get("WAREHOUSE_BACKEND", "python"))
+    manager = manager_class.from_files(
+        personnel_file,
+        stock_file,
+        # NOTE: empty WAREHOUSE_SNAPSHOT disables the snapshot
+        snapshot_file=os.environ.get("WAREHOUSE_SNAPSHOT", DEFAULT_SNAPSHOT_FILE),
+        warehouse_loader=WarehouseLoader(
+            workers=int(os.environ.get("WAREHOUSE_LOAD_WORKERS", 1)),
+            chunk_size=int(
+                os.environ.get(
+                    "WAREHOUSE_LOAD_CHUNK_SIZE", WarehouseLoader.DEFAULT_CHUNK_SIZE
+                )
+            ),
+        ),
+    )
+    manager.allocation_policy = os.environ.get(
+        "WAREHOUSE_ALLOCATION_POLICY", WarehouseManager.allocation_policy
+    )
+    return manager
+
+
 if __name__ == "__main__":
-    app = Controller()
+    parser = argparse.ArgumentParser(description="Warehouse database")
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="time operations, show the statistics to employees on quit "
+        "(or set WAREHOUSE_METRICS=1)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="export metrics to this file in the Prometheus text format on quit "
+        "(or set WAREHOUSE_METRICS_FILE)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="MODES",
+        help="profile loading and each operation: cpu, memory or cpu,memory "
+        "(or set WAREHOUSE_PROFILE)",
+    )
+    parser.add_argument(
+        "--profile-directory",
+        help="where profiles are written (or set WAREHOUSE_PROFILE_DIRECTORY, "
+        "default: profiles)",
+    )
+    arguments = parser.parse_args()
+    if arguments.profile is not None:
+        PROFILER.configure(arguments.profile)
+    PROFILER.directory = arguments.profile_directory or PROFILER.directory
+    if arguments.metrics or arguments.metrics_file:
+        REGISTRY.enabled = True
+    REGISTRY.file_name = arguments.metrics_file or REGISTRY.file_name
+    app = Controller(manager=manager_from_environment())
     app.main()
@@ -1,12 +1,34 @@
 import unittest
+import collections
+import json
+import os
+import sys
+import tempfile
+import threading
 from classes import Item, User, Employee
 from datetime import datetime
 from unittest.mock import patch
 from io import StringIO
-from app import ConsoleUserInterface, Controller, WarehouseManager
+from app import (
+    ConsoleUserInterface,
+    Controller,
+    WarehouseManager,
+    DEFAULT_PERSONNEL_FILE,
+    DEFAULT_STOCK_FILE,
+)
+from index import NameMatch
+from mapped_backend import MappedWarehouseManager
+from numpy_backend import NumpyWarehouseManager, np
+from snapshot import Snapshot
+from sqlite_backend import SqliteWarehouseManager
+from stock_file import StockFile, convert
+from metrics import REGISTRY
 
 
 class TestWarehouseManager(unittest.TestCase):
+    # NOTE: subclasses run the same tests against other backends
+    manager_class = WarehouseManager
+
     personnel_for_test_get_employee = [
         {
             "user_name": "Tomek",
@@ -66,7 +88,7 @@ class TestWarehouseManager(unittest.TestCase):
     ]
 
     def setUp(self) -> None:
-        self.warehouse_manager = WarehouseManager(
+        self.warehouse_manager = self.manager_class(
             personnel_records=__class__.personnel_for_test_get_employee,
             item_records=__class__.warehouse_items_for_test,
         )
@@ -425,6 +447,926 @@ class TestWarehouseManager(unittest.TestCase):
         )
         self.assertListEqual(all_items_of_category2, [])
 
+    def test_aggregate_count_by_category_and_warehouse(self):
+        counts = self.warehouse_manager.aggregate(by=("category", "warehouse"))
+        self.assertDictEqual(
+            {key: statistics.count for key, statistics in counts.items()},
+            {
+                ("Smartwatch", 4): 1,
+                ("Remote control", 1): 1,
+                ("Remote control", 2): 2,
+                ("Remote control", 3): 3,
+                ("Remote control", 4): 1,
+            },
+        )
+
+    def test_aggregate_dates_and_mean_age(self):
+        statistics = self.warehouse_manager.aggregate(
+            by="full_name",
+            statistics=("count", "min_date", "max_date", "mean_age"),
+            now=datetime(2021, 8, 19, 9, 13, 20),
+        )["Blue Remote control"]
+        self.assertEqual(statistics.count, 4)
+        self.assertEqual(statistics.min_date, datetime(2019, 8, 19, 9, 13, 20))
+        self.assertEqual(statistics.max_date, datetime(2020, 11, 7, 0, 38, 9))
+        ages = [
+            datetime(2021, 8, 19, 9, 13, 20) - date
+            for date in [
+                datetime(2019, 8, 19, 9, 13, 20),
+                datetime(2020, 11, 7, 0, 38, 9),
+                datetime(2020, 6, 25, 22, 45, 20),
+                datetime(2020, 9, 2, 7, 19, 5),
+            ]
+        ]
+        self.assertAlmostEqual(
+            statistics.mean_age, sum(age.total_seconds() for age in ages) / 4 / 86400
+        )
+
+    def test_aggregate_only_count_leaves_other_statistics_empty(self):
+        statistics = self.warehouse_manager.aggregate(by="state")["Blue"]
+        self.assertEqual(statistics.count, 4)
+        self.assertIsNone(statistics.min_date)
+        self.assertIsNone(statistics.mean_age)
+
+    def test_aggregate_unknown_key(self):
+        with self.assertRaises(ValueError):
+            self.warehouse_manager.aggregate(by="colour")
+
+    def test_get_item_amounts_by_warehouse(self):
+        self.assertDictEqual(
+            self.warehouse_manager.get_item_amounts_by_warehouse(),
+            {
+                "Brand new Remote control": {3: 1},
+                "Blue Remote control": {1: 1, 2: 1, 3: 2},
+                "Black Smartwatch": {4: 1},
+                "High quality Remote control": {2: 1},
+                "Exceptional Remote control": {4: 1},
+            },
+        )
+
+    def test_get_categories_with_amount(self):
+        self.assertListEqual(
+            sorted(self.warehouse_manager.get_categories_with_amount()),
+            [("Remote control", 7), ("Smartwatch", 1)],
+        )
+
+    def test_loaded_items_are_compact(self):
+        items = [
+            item for _id, item in self.warehouse_manager._all_items_with_warehouse_id()
+        ]
+        self.assertFalse(hasattr(items[0], "__dict__"))
+        categories = {
+            id(item.category) for item in items if item.category == "Remote control"
+        }
+        self.assertEqual(len(categories), 1)
+
+    def test_get_days_in_warehouse(self):
+        today = datetime(2021, 8, 19, 9, 13, 19)
+        self.assertListEqual(
+            self.warehouse_manager.get_days_in_warehouse("blue remote control", today),
+            [
+                (1, (today - datetime(2020, 6, 25, 22, 45, 20)).days),
+                (2, (today - datetime(2019, 8, 19, 9, 13, 20)).days),
+                (3, (today - datetime(2020, 9, 2, 7, 19, 5)).days),
+                (3, (today - datetime(2020, 11, 7, 0, 38, 9)).days),
+            ],
+        )
+
+    def test_get_items_older_than(self):
+        today = datetime(2021, 8, 1)
+        self.assertListEqual(
+            [
+                (warehouse_id, item.full_name(), item.days_in_warehouse(today))
+                for warehouse_id, item in self.warehouse_manager.get_items_older_than(
+                    365, today=today
+                )
+            ],
+            [
+                (2, "Blue Remote control", 712),
+                (4, "Exceptional Remote control", 705),
+                (3, "Brand new Remote control", 623),
+                (1, "Blue Remote control", 401),
+            ],
+        )
+        self.assertListEqual(
+            [
+                warehouse_id
+                for warehouse_id, _item in self.warehouse_manager.get_items_older_than(
+                    300, item_name="blue remote control", today=today
+                )
+            ],
+            [2, 1, 3],
+        )
+        self.assertListEqual(
+            self.warehouse_manager.get_items_older_than(
+                30, category="Smartwatch", today=today
+            ),
+            [],
+        )
+
+    def test_get_oldest_items(self):
+        self.assertListEqual(
+            [
+                (warehouse_id, item.state)
+                for warehouse_id, item in self.warehouse_manager.get_oldest_items(2)
+            ],
+            [(2, "Blue"), (4, "Exceptional")],
+        )
+        self.assertListEqual(
+            [
+                warehouse_id
+                for warehouse_id, _item in self.warehouse_manager.get_oldest_items(
+                    10, item_name="Blue Remote control"
+                )
+            ],
+            [2, 1, 3, 3],
+        )
+
+    def test_get_age_histogram(self):
+        today = datetime(2021, 8, 1)
+        self.assertDictEqual(
+            self.warehouse_manager.get_age_histogram((30, 365), today=today),
+            {1: [0, 0, 1], 2: [1, 0, 1], 3: [0, 2, 1], 4: [1, 0, 1]},
+        )
+        self.assertDictEqual(
+            self.warehouse_manager.get_age_histogram(
+                (30, 365), category="Smartwatch", today=today
+            ),
+            {4: [1, 0, 0]},
+        )
+        self.warehouse_manager.add_item(
+            4, Item("Black", "Smartwatch", 4, datetime(2018, 1, 1))
+        )
+        self.assertDictEqual(
+            self.warehouse_manager.get_age_histogram(
+                (30, 365), item_name="black smartwatch", today=today
+            ),
+            {4: [1, 0, 1]},
+        )
+
+    def test_iter_items(self):
+        manager = self.warehouse_manager
+        self.assertEqual(len(list(manager.iter_items())), 8)
+        self.assertListEqual(
+            [id for id, _item in manager.iter_items(item_name="blue remote control")],
+            [1, 2, 3, 3],
+        )
+        self.assertListEqual(
+            list(manager.iter_items(category="Smartwatch")),
+            [(4, manager.get_items_named("Black Smartwatch")[0][1])],
+        )
+
+    def test_iter_items_reads_under_lock_until_closed(self):
+        items = self.warehouse_manager.iter_items()
+        next(items)
+        self.assertEqual(self.warehouse_manager.lock._readers, 1)
+        items.close()
+        self.assertEqual(self.warehouse_manager.lock._readers, 0)
+
+    def test_add_item_is_found_by_search_and_counts(self):
+        item = Item(
+            state="Blue",
+            category="Remote control",
+            warehouse=4,
+            date_of_stock=datetime(2021, 1, 1, 10, 0, 0),
+        )
+        self.warehouse_manager.add_item(4, item)
+        self.assertEqual(
+            self.warehouse_manager.calculate_item_amount_in_warehouse(
+                4, "blue remote control"
+            ),
+            1,
+        )
+        self.assertEqual(
+            self.warehouse_manager.calculate_item_total_amount("Blue Remote control"),
+            5,
+        )
+        self.assertIn(
+            (4, item),
+            list(
+                self.warehouse_manager._all_named_items_with_warehouse_id(
+                    "Blue Remote control"
+                )
+            ),
+        )
+
+    def test_add_item_to_new_warehouse(self):
+        item = Item(
+            state="Red",
+            category="Book",
+            warehouse=7,
+            date_of_stock=datetime(2021, 1, 1, 10, 0, 0),
+        )
+        self.warehouse_manager.add_item(7, item)
+        self.assertEqual(self.warehouse_manager.calculate_total_amount(), 9)
+        self.assertEqual(
+            self.warehouse_manager.get_all_items_of_category("Book"), [("Red Book", 7)]
+        )
+        self.assertIn("Red Book", self.warehouse_manager.get_unique_item_names())
+
+    def test_remove_item_updates_index(self):
+        self.warehouse_manager.remove_item(
+            4,
+            Item(
+                state="Black",
+                category="Smartwatch",
+                warehouse=4,
+                date_of_stock=datetime(2021, 7, 20, 3, 51, 6),
+            ),
+        )
+        self.assertEqual(
+            self.warehouse_manager.calculate_item_total_amount("Black Smartwatch"), 0
+        )
+        self.assertSetEqual(
+            self.warehouse_manager.get_unique_categories(), set(["Remote control"])
+        )
+        self.assertNotIn(
+            "Black Smartwatch", self.warehouse_manager.get_unique_item_names()
+        )
+        self.assertEqual(self.warehouse_manager.calculate_total_amount(), 7)
+
+    def test_search_item_names_by_prefix(self):
+        self.assertEqual(
+            [match.name for match in self.warehouse_manager.search_item_names("remo")],
+            [
+                "Blue Remote control",
+                "Brand new Remote control",
+                "Exceptional Remote control",
+                "High quality Remote control",
+            ],
+        )
+        self.assertEqual(
+            self.warehouse_manager.search_item_names("smart"),
+            [NameMatch("Black Smartwatch", "prefix", 0)],
+        )
+
+    def test_search_item_names_words_in_any_order(self):
+        self.assertEqual(
+            self.warehouse_manager.search_item_names("control remote blue"),
+            [NameMatch("Blue Remote control", "prefix", 0)],
+        )
+
+    def test_search_item_names_with_typos(self):
+        self.assertEqual(
+            self.warehouse_manager.search_item_names("Blue remote contrl"),
+            [NameMatch("Blue Remote control", "fuzzy", 1)],
+        )
+        self.assertEqual(
+            self.warehouse_manager.search_item_names("blak smartwach"),
+            [NameMatch("Black Smartwatch", "fuzzy", 2)],
+        )
+        self.assertEqual(self.warehouse_manager.search_item_names("keyboard"), [])
+
+    def test_search_item_names_exact_name_first(self):
+        matches = self.warehouse_manager.search_item_names("blue remote control", 2)
+        self.assertEqual(matches[0], NameMatch("Blue Remote control", "exact", 0))
+        self.assertEqual(len(matches), 1)
+        self.assertEqual(
+            self.warehouse_manager.search_item_names("remote", limit=2),
+            [
+                NameMatch("Blue Remote control", "prefix", 0),
+                NameMatch("Brand new Remote control", "prefix", 0),
+            ],
+        )
+
+    def test_search_item_names_follows_stock(self):
+        self.warehouse_manager.add_item(
+            7, Item("Red", "Keyboard", 7, datetime(2021, 1, 1, 10, 0, 0))
+        )
+        self.assertEqual(
+            self.warehouse_manager.search_item_names("keybord"),
+            [NameMatch("Red Keyboard", "fuzzy", 1)],
+        )
+        self.warehouse_manager.remove_item(
+            4, Item("Black", "Smartwatch", 4, datetime(2021, 7, 20, 3, 51, 6))
+        )
+        self.assertEqual(self.warehouse_manager.search_item_names("smart"), [])
+        self.assertEqual(self.warehouse_manager.search_item_names("black"), [])
+        self.warehouse_manager.remove_ordered_items("Blue Remote control", 3)
+        self.assertEqual(
+            len(self.warehouse_manager.search_item_names("blue remote")), 1
+        )
+        self.warehouse_manager.remove_ordered_items("Blue Remote control", 1)
+        self.assertEqual(self.warehouse_manager.search_item_names("blue remote"), [])
+
+    def test_remove_item_not_in_stock(self):
+        with self.assertRaises(ValueError):
+            self.warehouse_manager.remove_item(
+                2,
+                Item(
+                    state="Black",
+                    category="Smartwatch",
+                    warehouse=2,
+                    date_of_stock=datetime(2021, 7, 20, 3, 51, 6),
+                ),
+            )
+
+    def blue_remote_control(self, *date_of_stock):
+        return Item("Blue", "Remote control", None, datetime(*date_of_stock))
+
+    def test_remove_ordered_items_fifo(self):
+        self.assertListEqual(
+            self.warehouse_manager.remove_ordered_items("blue remote control", 2),
+            [
+                (2, self.blue_remote_control(2019, 8, 19, 9, 13, 20)),
+                (1, self.blue_remote_control(2020, 6, 25, 22, 45, 20)),
+            ],
+        )
+        self.assertEqual(
+            self.warehouse_manager.calculate_item_total_amount("Blue Remote control"),
+            2,
+        )
+        self.assertListEqual(
+            self.warehouse_manager.get_days_in_warehouse(
+                "Blue Remote control", datetime(2021, 1, 1)
+            ),
+            [(3, 120), (3, 54)],
+        )
+        self.assertEqual(self.warehouse_manager.calculate_total_amount(), 6)
+
+    def test_remove_ordered_items_single_warehouse(self):
+        self.assertListEqual(
+            self.warehouse_manager.remove_ordered_items(
+                "Blue Remote control", 2, policy="single_warehouse"
+            ),
+            [
+                (3, self.blue_remote_control(2020, 9, 2, 7, 19, 5)),
+                (3, self.blue_remote_control(2020, 11, 7, 0, 38, 9)),
+            ],
+        )
+        self.assertEqual(
+            self.warehouse_manager.calculate_item_amount_in_warehouse(
+                3, "Blue Remote control"
+            ),
+            0,
+        )
+        # NOTE: every warehouse can fulfil it, the one with the oldest item does
+        self.assertListEqual(
+            self.warehouse_manager.remove_ordered_items(
+                "Blue Remote control", 1, policy="single_warehouse"
+            ),
+            [(2, self.blue_remote_control(2019, 8, 19, 9, 13, 20))],
+        )
+
+    def test_remove_ordered_items_balanced(self):
+        self.warehouse_manager.allocation_policy = "balanced"
+        self.assertListEqual(
+            self.warehouse_manager.remove_ordered_items("Blue Remote control", 3),
+            [
+                (3, self.blue_remote_control(2020, 9, 2, 7, 19, 5)),
+                (1, self.blue_remote_control(2020, 6, 25, 22, 45, 20)),
+                (2, self.blue_remote_control(2019, 8, 19, 9, 13, 20)),
+            ],
+        )
+        self.assertDictEqual(
+            self.warehouse_manager.get_amount_of_item_in_each_warehouse(
+                {"Blue Remote control"}
+            ),
+            {"Blue Remote control": {1: 0, 2: 0, 3: 1, 4: 0}},
+        )
+
+    def test_remove_ordered_items_more_than_in_stock(self):
+        self.assertEqual(
+            len(self.warehouse_manager.remove_ordered_items("Blue Remote control", 9)),
+            4,
+        )
+        self.assertNotIn(
+            "Blue Remote control", self.warehouse_manager.get_unique_item_names()
+        )
+        self.assertListEqual(
+            self.warehouse_manager.remove_ordered_items("Blue Remote control", 1), []
+        )
+        self.assertListEqual(
+            sorted(self.warehouse_manager.get_categories_with_amount()),
+            [("Remote control", 3), ("Smartwatch", 1)],
+        )
+
+    def test_stock_stays_consistent_after_many_removals(self):
+        items = [self.blue_remote_control(2021, 1, 1 + day % 28) for day in range(100)]
+        for item in items:
+            self.warehouse_manager.add_item(5, item)
+        for item in items[::3]:
+            self.warehouse_manager.remove_item(5, item)
+        self.warehouse_manager.remove_ordered_items("Blue Remote control", 10)
+        stock = [
+            item
+            for id, item in self.warehouse_manager._all_items_with_warehouse_id()
+            if id == 5
+        ]
+        indexed = [
+            item
+            for id, item in self.warehouse_manager._all_named_items_with_warehouse_id(
+                "Blue Remote control"
+            )
+            if id == 5
+        ]
+        self.assertEqual(len(stock), 100 - 34 - 6)
+        self.assertListEqual(
+            sorted(stock, key=lambda item: item.date_of_stock), indexed
+        )
+
+    def test_place_orders(self):
+        results = self.warehouse_manager.place_orders(
+            [
+                ("Blue Remote control", 3),
+                ("Black Smartwatch", 1),
+                ("blue remote control", 2),
+                ("Red Book", 1),
+                ("BLUE REMOTE CONTROL", 1),
+            ]
+        )
+        self.assertListEqual(
+            [(result.item_name, result.status) for result in results],
+            [
+                ("Blue Remote control", "fulfilled"),
+                ("Black Smartwatch", "fulfilled"),
+                ("blue remote control", "partial"),
+                ("Red Book", "rejected"),
+                ("BLUE REMOTE CONTROL", "rejected"),
+            ],
+        )
+        self.assertDictEqual(results[0].amounts_by_warehouse(), {1: 1, 2: 1, 3: 1})
+        self.assertListEqual(
+            results[2].allocation,
+            [(3, self.blue_remote_control(2020, 11, 7, 0, 38, 9))],
+        )
+        self.assertEqual(self.warehouse_manager.calculate_total_amount(), 3)
+
+    def test_place_orders_invalid_amount_is_rejected(self):
+        (result,) = self.warehouse_manager.place_orders([("Black Smartwatch", 0)])
+        self.assertEqual(result.status, "rejected")
+        self.assertEqual(
+            self.warehouse_manager.calculate_item_total_amount("Black Smartwatch"), 1
+        )
+
+    def test_concurrent_readers_and_writers_see_consistent_stock(self):
+        manager = self.warehouse_manager  # NOTE: not loaded yet, threads race to load
+        errors = []
+        orders = collections.Counter()
+
+        def check_invariants():
+            with manager.lock.read():
+                total = manager.calculate_total_amount()
+                by_category = sum(n for _c, n in manager.get_categories_with_amount())
+                names = manager.get_unique_item_names()
+                by_name = sum(manager.calculate_item_total_amount(n) for n in names)
+                scanned = {
+                    name: statistics.count
+                    for name, statistics in manager.aggregate(by="full_name").items()
+                }
+                indexed = {name: len(manager.get_items_named(name)) for name in names}
+            if not total == by_category == by_name or scanned != indexed:
+                errors.append((total, by_category, by_name, scanned, indexed))
+
+        def read():
+            for _ in range(50):
+                check_invariants()
+
+        def write(warehouse_id):
+            for day in range(1, 29):
+                manager.add_item(
+                    warehouse_id,
+                    Item("Green", "Lamp", None, datetime(2021, 2, day, warehouse_id)),
+                )
+                if day % 2:
+                    (result,) = manager.place_orders([("green lamp", 3)])
+                    orders[warehouse_id] += len(result.allocation)
+
+        def run(function, *args):
+            try:
+                function(*args)
+            except Exception as error:  # NOTE: reported by the main thread
+                errors.append(error)
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=run, args=(read,)) for _ in range(4)]
+            threads += [
+                threading.Thread(target=run, args=(write, id)) for id in (1, 5, 6)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self.assertListEqual(errors, [])
+        check_invariants()
+        self.assertListEqual(errors, [])
+        self.assertEqual(
+            manager.calculate_total_amount(), 8 + 3 * 28 - sum(orders.values())
+        )
+        self.assertEqual(
+            manager.calculate_item_total_amount("Green Lamp"),
+            3 * 28 - sum(orders.values()),
+        )
+
+    def test_remove_ordered_items_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.warehouse_manager.remove_ordered_items(
+                "Blue Remote control", 1, policy="random"
+            )
+
+
+class SameResultsAsPythonBackend:
+    """Mixin of tests of other backends (subclasses of TestWarehouseManager)"""
+
+    def test_same_results_as_python_backend_on_sample_data(self):
+        python_manager = WarehouseManager.from_files(
+            DEFAULT_PERSONNEL_FILE, DEFAULT_STOCK_FILE
+        )
+        manager = self.manager_class.from_files(
+            DEFAULT_PERSONNEL_FILE, DEFAULT_STOCK_FILE
+        )
+        now = datetime(2021, 12, 9, 12, 0, 0)
+        names = python_manager.get_unique_item_names() | {"Missing item"}
+        categories = python_manager.get_unique_categories() | {"Missing category"}
+        for method, arguments in (
+            [
+                ("calculate_total_amount", ()),
+                ("get_unique_item_names", ()),
+                ("get_unique_categories", ()),
+                ("get_amount_of_item_in_each_warehouse", (names,)),
+                ("calculate_amount_of_items_in_category", (categories,)),
+                ("get_item_amounts_by_warehouse", ()),
+                ("get_categories_with_amount", ()),
+                ("get_items_older_than", (365, None, None, now)),
+                ("get_oldest_items", (100,)),
+                ("get_age_histogram", ((7, 30, 365), None, None, now)),
+            ]
+            + [("get_all_items_of_category", (category,)) for category in categories]
+            + [("calculate_item_total_amount", (name.upper(),)) for name in names]
+            + [("get_days_in_warehouse", (name, now)) for name in names]
+            + [
+                ("aggregate", (by, ("count", "min_date", "max_date", "mean_age"), now))
+                for by in [
+                    "state",
+                    ("category", "warehouse"),
+                    ("warehouse", "full_name"),
+                ]
+            ]
+        ):
+            with self.subTest(method=method, arguments=arguments):
+                self.assertEqual(
+                    getattr(manager, method)(*arguments),
+                    getattr(python_manager, method)(*arguments),
+                )
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class TestNumpyWarehouseManager(SameResultsAsPythonBackend, TestWarehouseManager):
+    manager_class = NumpyWarehouseManager
+
+
+class TestSqliteWarehouseManager(SameResultsAsPythonBackend, TestWarehouseManager):
+    manager_class = SqliteWarehouseManager
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.addCleanup(self.warehouse_manager.close)
+
+    def test_connections_are_reused_by_threads(self):
+        manager = self.warehouse_manager
+        for _ in range(5):
+            thread = threading.Thread(target=manager.calculate_total_amount)
+            thread.start()
+            thread.join()
+        self.assertEqual(len(manager._pool), 1)
+
+    def test_changes_are_rolled_back_on_error(self):
+        manager = self.warehouse_manager
+        with self.assertRaises(ValueError):
+            with manager.lock.write(), manager._transaction():
+                manager.add_item(7, Item("Red", "Book", 7, datetime(2021, 1, 1)))
+                raise ValueError("the order was cancelled")
+        self.assertEqual(manager.calculate_total_amount(), 8)
+        self.assertNotIn("Book", manager.get_unique_categories())
+        self.assertEqual(manager.search_item_names("red book"), [])
+        self.assertNotIn(
+            7, manager.get_amount_of_item_in_each_warehouse({"Red Book"})["Red Book"]
+        )
+
+
+class TestSqliteDatabase(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.personnel_file = os.path.join(self._directory.name, "personnel.json")
+        self.stock_file = os.path.join(self._directory.name, "stock.json")
+        with open(self.personnel_file, "w") as f:
+            json.dump(TestWarehouseManager.personnel_for_test_get_employee, f)
+        self._write_stock(TestWarehouseManager.warehouse_items_for_test)
+
+    def _write_stock(self, records):
+        with open(self.stock_file, "w") as f:
+            json.dump(records, f)
+
+    def manager(self, item_records) -> SqliteWarehouseManager:
+        manager = SqliteWarehouseManager(
+            personnel_records=TestWarehouseManager.personnel_for_test_get_employee,
+            item_records=item_records,
+            snapshot=Snapshot(
+                os.path.join(self._directory.name, "warehouse.snapshot"),
+                sources=[self.personnel_file, self.stock_file],
+            ),
+        )
+        self.addCleanup(manager.close)
+        return manager
+
+    def test_database_is_kept_next_to_the_snapshot(self):
+        manager = self.manager(TestWarehouseManager.warehouse_items_for_test)
+        self.assertEqual(manager.calculate_total_amount(), 8)
+        self.assertEqual(
+            manager.database, os.path.join(self._directory.name, "warehouse.sqlite")
+        )
+        self.assertTrue(os.path.exists(manager.database))
+
+    def test_database_is_used_instead_of_records(self):
+        manager = self.manager(TestWarehouseManager.warehouse_items_for_test)
+        manager.add_item(7, Item("Red", "Book", 7, datetime(2021, 1, 1)))
+
+        def unusable_records():
+            raise AssertionError("records should not be loaded")
+            yield
+
+        reopened = self.manager(unusable_records())
+        self.assertEqual(reopened.calculate_total_amount(), 9)
+        self.assertEqual(reopened.get_all_items_of_category("Book"), [("Red Book", 7)])
+        self.assertEqual(reopened.search_item_names("red bo")[0].name, "Red Book")
+
+    def test_database_is_imported_again_when_source_changes(self):
+        manager = self.manager(TestWarehouseManager.warehouse_items_for_test)
+        manager.save_snapshot({"delta_offset": 10})
+        self.assertEqual(manager.calculate_total_amount(), 8)
+        records = TestWarehouseManager.warehouse_items_for_test[:3]
+        self._write_stock(records)
+        reopened = self.manager(records)
+        self.assertEqual(reopened.calculate_total_amount(), 3)
+        self.assertEqual(reopened.snapshot_metadata, {})
+
+    def test_metadata_is_stored_with_the_changes(self):
+        manager = self.manager(TestWarehouseManager.warehouse_items_for_test)
+        missing = manager.apply_stock_changes(
+            [("add", 2, Item("Red", "Book", 2, datetime(2021, 1, 1)))] * 2
+            + [("remove", 9, Item("Red", "Book", 9, datetime(2021, 1, 1)))],
+            metadata={"delta_offset": 3},
+        )
+        self.assertEqual(len(missing), 1)
+        reopened = self.manager([])
+        self.assertEqual(reopened.snapshot_metadata, {"delta_offset": 3})
+        self.assertEqual(reopened.calculate_item_amount_in_warehouse(2, "red book"), 2)
+
+
+class TestMappedWarehouseManager(SameResultsAsPythonBackend, TestWarehouseManager):
+    manager_class = MappedWarehouseManager
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.addCleanup(self.warehouse_manager.close)
+
+    def test_queries_build_no_python_stock(self):
+        manager = self.warehouse_manager
+        self.assertEqual(manager.calculate_item_total_amount("blue remote control"), 4)
+        self.assertEqual(len(manager.get_items_named("Black Smartwatch")), 1)
+        self.assertEqual(manager.get_categories_with_amount()[0], ("Remote control", 7))
+        self.assertFalse(manager.is_materialized)
+        manager.add_item(7, Item("Red", "Book", 7, datetime(2021, 1, 1)))
+        self.assertTrue(manager.is_materialized)
+        self.assertEqual(manager.calculate_total_amount(), 9)
+        self.assertEqual(manager.search_item_names("red bo")[0].name, "Red Book")
+
+
+class TestMappedWarehouseManagerWithoutNumpy(TestMappedWarehouseManager):
+    """Records are scanned with struct.iter_unpack instead"""
+
+    def setUp(self) -> None:
+        patcher = patch("stock_file.np", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+
+class TestMappedStockFile(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.personnel_file = os.path.join(self._directory.name, "personnel.json")
+        self.stock_file = os.path.join(self._directory.name, "stock.json")
+        with open(self.personnel_file, "w") as f:
+            json.dump(TestWarehouseManager.personnel_for_test_get_employee, f)
+        self._write_stock(TestWarehouseManager.warehouse_items_for_test)
+
+    def _write_stock(self, records):
+        with open(self.stock_file, "w") as f:
+            json.dump(records, f)
+
+    def manager(self, item_records) -> MappedWarehouseManager:
+        manager = MappedWarehouseManager(
+            personnel_records=TestWarehouseManager.personnel_for_test_get_employee,
+            item_records=item_records,
+            snapshot=Snapshot(
+                os.path.join(self._directory.name, "warehouse.snapshot"),
+                sources=[self.personnel_file, self.stock_file],
+            ),
+        )
+        self.addCleanup(manager.close)
+        return manager
+
+    def unusable_records(self):
+        raise AssertionError("records should not be loaded")
+        yield
+
+    def test_stock_file_is_kept_next_to_the_snapshot(self):
+        manager = self.manager(TestWarehouseManager.warehouse_items_for_test)
+        self.assertEqual(manager.calculate_total_amount(), 8)
+        self.assertEqual(
+            manager.stock_file_name,
+            os.path.join(self._directory.name, "warehouse.stock"),
+        )
+        reopened = self.manager(self.unusable_records())
+        self.assertEqual(reopened.calculate_item_total_amount("Black Smartwatch"), 1)
+
+    def test_changes_are_saved_with_the_snapshot(self):
+        manager = self.manager(TestWarehouseManager.warehouse_items_for_test)
+        manager.add_item(7, Item("Red", "Book", 7, datetime(2021, 1, 1)))
+        manager.save_snapshot({"delta_offset": 10})
+        reopened = self.manager(self.unusable_records())
+        self.assertEqual(reopened.snapshot_metadata, {"delta_offset": 10})
+        self.assertEqual(reopened.get_all_items_of_category("Book"), [("Red Book", 7)])
+        self.assertFalse(reopened.is_materialized)
+
+    def test_changes_saved_by_threads_at_once(self):
+        manager = self.manager(TestWarehouseManager.warehouse_items_for_test)
+        manager.add_item(7, Item("Red", "Book", 7, datetime(2021, 1, 1)))
+        threads = [
+            threading.Thread(target=manager.save_snapshot, args=({"n": n},))
+            for n in range(8)
+        ]
+        with patch("mapped_backend.warnings.warn") as warn:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        warn.assert_not_called()
+        self.assertFalse(
+            [file for file in os.listdir(self._directory.name) if ".tmp" in file]
+        )
+        reopened = self.manager(self.unusable_records())
+        self.assertEqual(reopened.get_all_items_of_category("Book"), [("Red Book", 7)])
+
+    def test_stock_file_is_converted_again_when_source_changes(self):
+        manager = self.manager(TestWarehouseManager.warehouse_items_for_test)
+        manager.save_snapshot({"delta_offset": 10})
+        records = TestWarehouseManager.warehouse_items_for_test[:3]
+        self._write_stock(records)
+        reopened = self.manager(records)
+        self.assertEqual(reopened.calculate_total_amount(), 3)
+        self.assertEqual(reopened.snapshot_metadata, {})
+
+    def test_converted_stock_file_as_records(self):
+        file_name = os.path.join(self._directory.name, "stock.bin")
+        convert(TestWarehouseManager.warehouse_items_for_test, file_name)
+        stock_file = StockFile(file_name)
+        manager = MappedWarehouseManager(
+            TestWarehouseManager.personnel_for_test_get_employee, stock_file
+        )
+        self.addCleanup(manager.close)
+        self.assertEqual(
+            manager.calculate_item_amount_in_warehouse(3, "blue remote control"), 2
+        )
+        self.assertEqual(manager.stock_file_name, file_name)
+        self.assertFalse(manager.has_snapshot)
+
+
+class TestWarehouseManagerLoading(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.personnel_file = os.path.join(self._directory.name, "personnel.json")
+        self.stock_file = os.path.join(self._directory.name, "stock.json")
+        self._write(
+            self.personnel_file, TestWarehouseManager.personnel_for_test_get_employee
+        )
+        self._write(self.stock_file, TestWarehouseManager.warehouse_items_for_test)
+
+    def _write(self, file_name, records):
+        with open(file_name, "w") as f:
+            json.dump(records, f)
+
+    def test_records_are_not_loaded_until_first_use(self):
+        consumed = []
+
+        def records():
+            consumed.append(True)
+            yield from TestWarehouseManager.warehouse_items_for_test
+
+        warehouse_manager = WarehouseManager(
+            personnel_records=[], item_records=records()
+        )
+        self.assertFalse(consumed)
+        self.assertFalse(warehouse_manager.is_loaded)
+        self.assertEqual(warehouse_manager.calculate_total_amount(), 8)
+        self.assertTrue(consumed)
+        self.assertTrue(warehouse_manager.is_loaded)
+
+    def test_from_files(self):
+        warehouse_manager = WarehouseManager.from_files(
+            self.personnel_file, self.stock_file
+        )
+        self.assertFalse(warehouse_manager.is_loaded)
+        self.assertEqual(warehouse_manager.calculate_total_amount(), 8)
+        self.assertIsNotNone(warehouse_manager.get_employee("Ania"))
+
+    def test_from_files_is_cached_until_file_changes(self):
+        first = WarehouseManager.from_files(self.personnel_file, self.stock_file)
+        self.assertIs(
+            WarehouseManager.from_files(self.personnel_file, self.stock_file), first
+        )
+        self._write(self.stock_file, TestWarehouseManager.warehouse_items_for_test[:3])
+        stat = os.stat(self.stock_file)
+        os.utime(self.stock_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        second = WarehouseManager.from_files(self.personnel_file, self.stock_file)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.calculate_total_amount(), 3)
+
+    def _snapshot(self):
+        return Snapshot(
+            os.path.join(self._directory.name, "warehouse.snapshot"),
+            sources=[self.personnel_file, self.stock_file],
+        )
+
+    def _touch(self, file_name):
+        stat = os.stat(file_name)
+        os.utime(file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_snapshot_is_written_and_used_instead_of_records(self):
+        loaded = WarehouseManager.from_files(
+            self.personnel_file,
+            self.stock_file,
+            snapshot_file=self._snapshot().file_name,
+        )
+        self.assertEqual(loaded.calculate_total_amount(), 8)
+
+        def unusable_records():
+            raise AssertionError("records should not be loaded")
+            yield
+
+        from_snapshot = WarehouseManager(
+            personnel_records=unusable_records(),
+            item_records=unusable_records(),
+            snapshot=self._snapshot(),
+        )
+        self.assertSetEqual(
+            set(from_snapshot._all_items_with_warehouse_id()),
+            set(loaded._all_items_with_warehouse_id()),
+        )
+        self.assertEqual(
+            from_snapshot.calculate_item_amount_in_warehouse(3, "Blue Remote control"),
+            2,
+        )
+        self.assertTrue(from_snapshot.get_employee("Ania").authenticate("hunter2"))
+
+    def test_snapshots_saved_by_threads_at_once(self):
+        snapshot = self._snapshot()
+        threads = [
+            threading.Thread(target=snapshot.save, args=([], [], {"n": n}))
+            for n in range(8)
+        ]
+        with patch("snapshot.warnings.warn") as warn:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        warn.assert_not_called()
+        self.assertListEqual(
+            sorted(os.listdir(self._directory.name)),
+            ["personnel.json", "stock.json", "warehouse.snapshot"],
+        )
+        self.assertIsNotNone(self._snapshot().load())
+
+    def test_snapshot_is_not_used_when_source_changes(self):
+        snapshot = self._snapshot()
+        snapshot.save([], [])
+        self.assertIsNotNone(self._snapshot().load())
+        self._write(self.stock_file, TestWarehouseManager.warehouse_items_for_test[:3])
+        self._touch(self.stock_file)
+        self.assertIsNone(self._snapshot().load())
+
+    def test_snapshot_is_used_when_source_is_only_touched(self):
+        self._snapshot().save([], [])
+        self._touch(self.stock_file)
+        self.assertIsNotNone(self._snapshot().load())
+
+    def test_broken_snapshot_is_not_used(self):
+        with open(self._snapshot().file_name, "wb") as f:
+            f.write(b"not a snapshot")
+        self.assertIsNone(self._snapshot().load())
+
+    def test_missing_attribute(self):
+        with self.assertRaises(AttributeError):
+            WarehouseManager(personnel_records=[], item_records=[]).no_such_thing
+
 
 class TestConsoleUserInterface(unittest.TestCase):
     def setUp(self):
@@ -552,6 +1494,19 @@ class TestConsoleUserInterface(unittest.TestCase):
             f"\n4 Blue Remote control in stock\n\tIn Warehouse 2 for {(today - datetime(2019, 8, 19, 9, 13, 20)).days} days\n\tIn Warehouse 3 for {(today - datetime(2020, 11, 7, 0, 38, 9)).days} days\n\tIn Warehouse 1 for {(today - datetime(2020, 6, 25, 22, 45, 20)).days} days\n\tIn Warehouse 3 for {(today - datetime(2020, 9, 2, 7, 19, 5)).days} days\n",
         )
 
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_display_suggestions(self, output):
+        self.cui.display_suggestions(
+            [
+                NameMatch("Blue Remote control", "fuzzy", 1),
+                NameMatch("Blue Keyboard", "fuzzy", 2),
+            ]
+        )
+        self.cui.display_suggestions([])
+        self.assertEqual(
+            output.getvalue(), "Did you mean: Blue Remote control, Blue Keyboard?\n"
+        )
+
     @patch("sys.stdout", new_callable=StringIO)
     def test_display_all_items_of_category(self, output):
         category = "Laptop"
@@ -653,6 +1608,71 @@ class ControllerTest(unittest.TestCase):
     #     print(self.user.is_authenticated)
     #     self.assertTrue(self.app.log_in())
 
+    @patch("app.ConsoleUserInterface.print_order")
+    @patch("app.ConsoleUserInterface.ask_how_much_to_order", return_value=2)
+    @patch("app.Controller.do_you_want_to_order", return_value=True)
+    @patch("app.ConsoleUserInterface.display_search_result")
+    @patch(
+        "app.ConsoleUserInterface.ask_for_item_name", return_value="blue remote control"
+    )
+    def test_order_removes_items_from_stock(self, *_mocks):
+        manager = WarehouseManager(
+            personnel_records=TestWarehouseManager.personnel_for_test_get_employee,
+            item_records=TestWarehouseManager.warehouse_items_for_test,
+        )
+        app = Controller(manager=manager, user=self.employee)
+        self.employee.is_authenticated = True
+        app.operation_search_an_item_and_place_an_order()
+        self.assertEqual(manager.calculate_item_total_amount("Blue Remote control"), 2)
+        self.assertIn("You have ordered 2 Blue Remote control", app._actions)
+
+    @patch("app.ConsoleUserInterface.display_suggestions")
+    @patch("app.ConsoleUserInterface.display_search_result")
+    @patch("app.ConsoleUserInterface.ask_for_item_name", return_value="blue remot")
+    def test_search_not_in_stock_suggests_names(
+        self, _ask, display_search_result, display_suggestions
+    ):
+        manager = WarehouseManager(
+            personnel_records=TestWarehouseManager.personnel_for_test_get_employee,
+            item_records=TestWarehouseManager.warehouse_items_for_test,
+        )
+        app = Controller(manager=manager, user=self.user)
+        app.operation_search_an_item_and_place_an_order()
+        display_search_result.assert_called_once_with([])
+        display_suggestions.assert_called_once_with(
+            [NameMatch("Blue Remote control", "prefix", 0)]
+        )
+
+    @patch("app.ConsoleUserInterface.display_metrics")
+    @patch("app.ConsoleUserInterface.display_items")
+    @patch("builtins.print")
+    def test_metrics_are_shown_on_quit(self, _print, _display_items, display_metrics):
+        manager = WarehouseManager(
+            personnel_records=TestWarehouseManager.personnel_for_test_get_employee,
+            item_records=TestWarehouseManager.warehouse_items_for_test,
+        )
+        self.employee.authenticate("qwe321")
+        app = Controller(manager=manager, user=self.employee)
+        with patch.object(REGISTRY, "enabled", True):
+            REGISTRY.clear()
+            self.addCleanup(REGISTRY.clear)
+            app.operation_list_items_by_warehouse()
+            app.operation_quit()
+        operations = [row["operation"] for row in display_metrics.call_args.args[0]]
+        self.assertIn("Controller.operation_list_items_by_warehouse", operations)
+        self.assertIn("WarehouseManager.get_item_amounts_by_warehouse", operations)
+
+    @patch("app.ConsoleUserInterface.display_metrics")
+    @patch("builtins.print")
+    def test_metrics_are_not_shown_to_customers(self, _print, display_metrics):
+        # NOTE: neither to someone who only typed an employee's name
+        for user in (self.user, self.employee):
+            app = Controller(manager=self.app.manager, user=user)
+            with patch.object(REGISTRY, "enabled", True):
+                self.addCleanup(REGISTRY.clear)
+                app.operation_quit()
+        display_metrics.assert_not_called()
+
     @patch("app.Controller.log_in")
     @patch("app.ConsoleUserInterface.ask_if_user_want_to_order", return_value="y")
     def test_do_you_want_to_order(self, _input, log_in_mock):
@@ -0,0 +1,583 @@
+"""Benchmarks of the warehouse tool, see: python cli/benchmark.py --help"""
+from __future__ import annotations
+import argparse
+import collections
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import datagen
+import deltas
+from app import (
+    BACKENDS,
+    DEFAULT_PERSONNEL_FILE,
+    DEFAULT_STOCK_FILE,
+    WarehouseManager,
+    get_manager_class,
+)
+from json_records import JSONRecords
+from loader import (
+    CachedDateParser,
+    Loader,
+    PersonnelLoader,
+    WarehouseLoader,
+    parse_fixed_layout,
+)
+from snapshot import Snapshot
+from stock_file import StockFile, convert, np
+from typing import Any, Callable
+
+
+class DictItem:
+    """Item as it used to be: a __dict__ per instance, strings not shared"""
+
+    def __init__(
+        self, state: str, category: str, warehouse: int, date_of_stock: datetime
+    ) -> None:
+        del warehouse
+        self.state = state
+        self.category = category
+        self.date_of_stock = date_of_stock
+
+
+def load_dict_items(records) -> list[DictItem]:
+    loader = Loader(
+        strategies={
+            "date_of_stock": lambda d, **_kwargs: datetime.datetime.fromisoformat(d)
+        },
+        target_builder=DictItem,
+    )
+    return list(loader.load_records(records))
+
+
+def load_warehouses(records) -> list:
+    return list(WarehouseLoader().load_records(records))
+
+
+def retained_memory(load: Callable[[], Any]) -> tuple[Any, int]:
+    """Returns result of load() and number of bytes allocated by it
+    which are still in use"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = load()
+        gc.collect()
+        retained, _peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, retained
+
+
+def benchmark_memory(arguments) -> None:
+    records = JSONRecords(arguments.file)
+    number_of_items = sum(1 for _record in records)
+    print(f"Items: {number_of_items}")
+    for description, load in [
+        ("dict-backed items", load_dict_items),
+        ("__slots__ items, interned strings", load_warehouses),
+    ]:
+        _result, retained = retained_memory(lambda: load(records))
+        print(f"{description}: {retained / number_of_items:.1f} bytes per item")
+
+
+def benchmark_startup(arguments) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = Snapshot(
+            os.path.join(directory, "warehouse.snapshot"),
+            sources=[arguments.personnel_file, arguments.file],
+        )
+        for description in ["JSON (writes snapshot)", "snapshot"]:
+            manager = WarehouseManager(
+                JSONRecords(arguments.personnel_file),
+                JSONRecords(arguments.file),
+                snapshot=snapshot,
+            )
+            start = time.perf_counter()
+            manager.calculate_total_amount()  # NOTE: triggers loading
+            print(f"{description}: {time.perf_counter() - start:.3f} s")
+
+
+def benchmark_dates(arguments) -> None:
+    unique_dates = [record["date_of_stock"] for record in JSONRecords(arguments.file)]
+    # NOTE: items are bulk-stocked, the same timestamp comes many times in a row
+    dates = [date for date in unique_dates for _copy in range(arguments.repeat)]
+    print(f"{len(dates)} timestamps, each repeated {arguments.repeat} times")
+    # NOTE: called the way Loader calls strategies
+    kwargs = dict(
+        property="date_of_stock", record={}, target_class=None, load_record=None
+    )
+    for description, strategy in [
+        ("fromisoformat", lambda d, **_kwargs: datetime.datetime.fromisoformat(d)),
+        ("fixed layout slicing", lambda d, **_kwargs: parse_fixed_layout(d)),
+        ("cached fromisoformat", CachedDateParser()),
+        ("cached fixed layout slicing", CachedDateParser(parse=parse_fixed_layout)),
+    ]:
+        seconds = min(
+            timeit.repeat(
+                lambda: [strategy(date, **kwargs) for date in dates], number=1, repeat=5
+            )
+        )
+        distinct_objects = len(
+            {id(date) for date in [strategy(d, **kwargs) for d in dates]}
+        )
+        print(
+            f"{description}: {seconds / len(dates) * 1e9:.0f} ns per timestamp, "
+            f"{distinct_objects} datetime objects"
+        )
+
+
+def latency_statistics(samples: list[float]) -> dict:
+    """Returns throughput and latency percentiles (in ms)
+    of call durations (in seconds)"""
+    ordered = sorted(samples)
+    total = sum(ordered)
+
+    def percentile(p):
+        # NOTE: nearest rank, exact for the small numbers of calls of slow operations
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {
+        "calls": len(ordered),
+        "seconds": total,
+        "per_second": len(ordered) / total if total else None,
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def peak_memory(call: Callable[[], Any]) -> int:
+    """Returns the highest number of bytes allocated by call() at any moment"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        call()
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def measure(operation: Callable[[Any], Any], calls: list, memory: bool) -> dict:
+    """Calls operation with each of calls (timed one by one),
+    then once more traced for memory"""
+    samples = []
+    for argument in calls:
+        start = time.perf_counter()
+        operation(argument)
+        samples.append(time.perf_counter() - start)
+    statistics = latency_statistics(samples)
+    # NOTE: tracing slows everything down, so it is a separate call
+    statistics["peak_memory_bytes"] = (
+        peak_memory(lambda: operation(calls[0])) if memory else None
+    )
+    return statistics
+
+
+def typed_queries(rng: random.Random, names: list[str], k: int) -> list[str]:
+    """Returns k queries as typed by operators:
+    unfinished names and names with a typo"""
+    queries = []
+    for name in rng.choices(names, k=k):
+        if rng.random() < 0.5:
+            queries.append(name[: rng.randint(1, len(name))])
+        else:
+            position = rng.randrange(len(name))
+            queries.append(name[:position] + name[position + 1 :])
+    return queries
+
+
+def run_suite(
+    personnel_file: str,
+    stock_file: str,
+    backend: str = "python",
+    calls: int = 1000,
+    heavy_calls: int = 5,
+    memory: bool = True,
+    seed: int = 0,
+) -> dict:
+    """Returns { operation: statistics } of the hot paths on given data files"""
+    rng = random.Random(seed)
+    manager_class = get_manager_class(backend)
+    personnel_records = JSONRecords(personnel_file)
+    stock_records = JSONRecords(stock_file)
+    results = {}
+
+    def load_personnel(_argument):
+        return list(PersonnelLoader().load_records(personnel_records))
+
+    results["load_personnel"] = measure(load_personnel, [None] * heavy_calls, memory)
+    results["load_stock"] = measure(
+        lambda _argument: list(WarehouseLoader().load_records(stock_records)),
+        [None] * heavy_calls,
+        memory,
+    )
+
+    def load_manager(_argument):
+        manager = manager_class(personnel_records, stock_records)
+        manager.calculate_total_amount()  # NOTE: triggers loading
+        return manager
+
+    results["load_manager"] = measure(load_manager, [None] * heavy_calls, memory)
+    manager = load_manager(None)
+    employee_names = [employee.name for employee in load_personnel(None)]
+    item_names = sorted(manager.get_unique_item_names())
+    categories = sorted(manager.get_unique_categories())
+    results["get_employee"] = measure(
+        manager.get_employee, rng.choices(employee_names, k=calls), memory
+    )
+    results["search"] = measure(
+        manager.get_items_named, rng.choices(item_names, k=calls), memory
+    )
+    results["suggest"] = measure(
+        manager.search_item_names, typed_queries(rng, item_names, calls), memory
+    )
+    results["list_all"] = measure(
+        lambda _argument: manager.get_item_amounts_by_warehouse(),
+        [None] * heavy_calls,
+        memory,
+    )
+    results["browse_category"] = measure(
+        manager.get_all_items_of_category,
+        rng.choices(categories, k=heavy_calls),
+        memory,
+    )
+    results["older_than"] = measure(
+        lambda days: manager.get_items_older_than(days),
+        [rng.randint(30, 1000) for _ in range(heavy_calls)],
+        memory,
+    )
+    results["age_histogram"] = measure(
+        lambda category: manager.get_age_histogram(category=category),
+        rng.choices(categories, k=calls),
+        memory,
+    )
+    # NOTE: last, it empties the stock a little
+    results["order"] = measure(
+        lambda order: manager.remove_ordered_items(*order),
+        [(rng.choice(item_names), rng.randint(1, 5)) for _ in range(calls)],
+        memory,
+    )
+    return results
+
+
+def git_commit() -> str:
+    """Returns the commit the benchmarked code comes from (None outside of git)"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def generated_data(directory: str, arguments, items: int) -> tuple[str, str]:
+    """Returns (personnel_file, stock_file) generated for the size,
+    reused if already generated into the directory"""
+    path = os.path.join(
+        directory,
+        f"items-{items}-names-{arguments.names}-batch-{arguments.batch}"
+        f"-org-{arguments.depth}x{arguments.width}-seed-{arguments.seed}",
+    )
+    files = (os.path.join(path, "personnel.json"), os.path.join(path, "stock.json"))
+    if not all(os.path.exists(file) for file in files):
+        print(f"Generating {items} items into {path}", file=sys.stderr)
+        files = datagen.generate(
+            path,
+            items,
+            names=arguments.names,
+            batch=arguments.batch,
+            depth=arguments.depth,
+            width=arguments.width,
+            seed=arguments.seed,
+        )
+    return files
+
+
+def benchmark_deltas(arguments) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        personnel_file, stock_file = datagen.generate(
+            directory, arguments.items, warehouses=10, seed=arguments.seed
+        )
+        feed_file = os.path.join(directory, "deltas.jsonl")
+        with open(feed_file, "w") as f:
+            datagen.write_events(
+                f, arguments.events, warehouses=10, seed=arguments.seed
+            )
+        print(f"{arguments.events} events applied to {arguments.items} items:")
+        for batch_size in arguments.batch_sizes:
+            manager = WarehouseManager(
+                JSONRecords(personnel_file),
+                JSONRecords(stock_file),
+                snapshot=Snapshot(
+                    os.path.join(directory, "warehouse.snapshot"),
+                    sources=[personnel_file, stock_file],
+                ),
+            )
+            feed = deltas.DeltaFeed(feed_file, manager, batch_size)
+            progress = feed.apply(checkpoint=False)
+            start = time.perf_counter()
+            feed.checkpoint()
+            print(
+                f"batches of {batch_size:>6}: "
+                f"{progress.events_per_second:>10,.0f} events/s"
+                f"  ({progress.missing} not in stock, {progress.rejected} invalid)"
+                f", checkpoint {time.perf_counter() - start:.3f} s"
+            )
+            # NOTE: the next manager starts from the source files again
+            os.remove(os.path.join(directory, "warehouse.snapshot"))
+
+
+def benchmark_scan(arguments) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        _personnel_file, json_file = datagen.generate(
+            directory, arguments.items, warehouses=10, seed=arguments.seed
+        )
+        file_name = os.path.join(directory, "stock.bin")
+        start = time.perf_counter()
+        convert(JSONRecords(json_file), file_name)
+        size = os.path.getsize(file_name)
+        print(
+            f"{arguments.items} items converted in {time.perf_counter() - start:.3f} s"
+            f", {size / arguments.items:.1f} bytes per item"
+        )
+        stock_files = {"struct.iter_unpack": StockFile(file_name, vectorized=False)}
+        if np is not None:
+            stock_files["NumPy frombuffer"] = StockFile(file_name)
+        warehouses = stock_files["struct.iter_unpack"].load_warehouses()
+        name = {next(iter(stock_files["struct.iter_unpack"].group_statistics()))[:2]}
+        scans = {}
+        for description, stock_file in stock_files.items():
+            scans[f"group statistics, {description}"] = stock_file.group_statistics
+            scans[
+                f"select a name, {description}"
+            ] = lambda stock_file=stock_file: stock_file.select(name)
+        # NOTE: the same single pass over Items (as loaded from JSON), for comparison
+        scans["group counts, Python objects"] = lambda: collections.Counter(
+            (item.state, item.category, warehouse.id)
+            for warehouse in warehouses
+            for item in warehouse.stock
+        )
+        for description, scan in scans.items():
+            seconds = min(timeit.repeat(scan, number=1, repeat=arguments.repeat))
+            print(
+                f"{description:<40}{arguments.items / seconds:>15,.0f} records/s"
+                f"  {size / seconds / 2**20:>9,.1f} MiB/s"
+            )
+
+
+def print_results(runs: list[dict]) -> None:
+    for run in runs:
+        for operation, statistics in run["results"].items():
+            peak = statistics["peak_memory_bytes"]
+            print(
+                f"{run['items']:>9} items  {operation:<16}"
+                f"{statistics['per_second']:>13,.1f}/s"
+                f"  p50 {statistics['p50_ms']:>10.4f} ms"
+                f"  p99 {statistics['p99_ms']:>10.4f} ms"
+                + (f"  peak {peak / 2**20:>8.1f} MiB" if peak is not None else "")
+            )
+
+
+def benchmark_suite(arguments) -> None:
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        runs = []
+        for items in arguments.sizes:
+            personnel_file, stock_file = generated_data(
+                arguments.data_directory or temporary_directory, arguments, items
+            )
+            runs.append(
+                {
+                    "items": items,
+                    "names": arguments.names,
+                    "batch": arguments.batch,
+                    "depth": arguments.depth,
+                    "width": arguments.width,
+                    "employees": datagen.number_of_employees(
+                        arguments.depth, arguments.width
+                    ),
+                    "results": run_suite(
+                        personnel_file,
+                        stock_file,
+                        backend=arguments.backend,
+                        calls=arguments.calls,
+                        heavy_calls=arguments.heavy_calls,
+                        memory=not arguments.no_memory,
+                        seed=arguments.seed,
+                    ),
+                }
+            )
+            print_results(runs[-1:])
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "machine": platform.platform(),
+                    "backend": arguments.backend,
+                    "runs": runs,
+                },
+                f,
+                indent=2,
+            )
+
+
+def compare_results(old: dict, new: dict, threshold: float) -> list[str]:
+    """Returns lines comparing throughput of operations measured in both results,
+    those slower by more than threshold (a fraction) are marked as regressions"""
+    old_runs = {run["items"]: run["results"] for run in old["runs"]}
+    lines = []
+    for run in new["runs"]:
+        for operation, statistics in run["results"].items():
+            before = old_runs.get(run["items"], {}).get(operation)
+            if before is None or not before["per_second"]:
+                continue
+            ratio = statistics["per_second"] / before["per_second"]
+            lines.append(
+                f"{run['items']:>9} items  {operation:<16}{ratio:>7.2f}x"
+                + ("  REGRESSION" if ratio < 1 - threshold else "")
+            )
+    return lines
+
+
+def benchmark_compare(arguments) -> None:
+    with open(arguments.old) as f:
+        old = json.load(f)
+    with open(arguments.new) as f:
+        new = json.load(f)
+    print(
+        f"Throughput of {new.get('commit')} ({new.get('backend')}) "
+        f"relative to {old.get('commit')} ({old.get('backend')}):"
+    )
+    lines = compare_results(old, new, arguments.threshold)
+    print("\n".join(lines))
+    if any(line.endswith("REGRESSION") for line in lines):
+        sys.exit(1)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    benchmarks = parser.add_subparsers(dest="benchmark", required=True)
+    memory = benchmarks.add_parser(
+        "memory", help="bytes per loaded item, before and after __slots__"
+    )
+    memory.add_argument("--file", default=DEFAULT_STOCK_FILE, help="stock JSON file")
+    memory.set_defaults(run=benchmark_memory)
+    startup = benchmarks.add_parser(
+        "startup", help="load time from JSON and from a snapshot"
+    )
+    startup.add_argument("--file", default=DEFAULT_STOCK_FILE, help="stock JSON file")
+    startup.add_argument(
+        "--personnel-file", default=DEFAULT_PERSONNEL_FILE, help="personnel JSON file"
+    )
+    startup.set_defaults(run=benchmark_startup)
+    dates = benchmarks.add_parser("dates", help="date_of_stock parsing strategies")
+    dates.add_argument("--file", default=DEFAULT_STOCK_FILE, help="stock JSON file")
+    dates.add_argument(
+        "--repeat", type=int, default=10, help="how many times each timestamp repeats"
+    )
+    dates.set_defaults(run=benchmark_dates)
+    suite = benchmarks.add_parser(
+        "suite",
+        help="load, get_employee, search, list all, browse and order on generated data",
+    )
+    suite.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 100_000],
+        help="numbers of items to generate (e.g. 1000 ... 10000000)",
+    )
+    suite.add_argument(
+        "--names",
+        type=int,
+        default=len(datagen.STATES) * len(datagen.CATEGORIES),
+        help="number of distinct item names",
+    )
+    suite.add_argument(
+        "--batch", type=int, default=1, help="items stocked together (same date)"
+    )
+    suite.add_argument("--depth", type=int, default=3, help="levels of organisation")
+    suite.add_argument(
+        "--width", type=int, default=10, help="employees headed by each employee"
+    )
+    suite.add_argument("--seed", type=int, default=0, help="random seed")
+    suite.add_argument(
+        "--backend", choices=sorted(BACKENDS), default="python", help="manager backend"
+    )
+    suite.add_argument(
+        "--calls", type=int, default=1000, help="calls of get_employee, search, order"
+    )
+    suite.add_argument(
+        "--heavy-calls",
+        type=int,
+        default=5,
+        help="calls of loading, list all and browse",
+    )
+    suite.add_argument(
+        "--no-memory", action="store_true", help="skip tracing peak memory (faster)"
+    )
+    suite.add_argument(
+        "--data-directory",
+        help="keep generated data here and reuse it (default: a temporary directory)",
+    )
+    suite.add_argument("--output", help="store the results in this JSON file")
+    suite.set_defaults(run=benchmark_suite)
+    deltas_ = benchmarks.add_parser(
+        "deltas", help="events per second applied from a generated delta feed"
+    )
+    deltas_.add_argument(
+        "--items", type=int, default=100_000, help="items in stock to begin with"
+    )
+    deltas_.add_argument("--events", type=int, default=100_000, help="number of events")
+    deltas_.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="+",
+        default=[1, 100, 1000, 10_000],
+        help="events applied under one lock",
+    )
+    deltas_.add_argument("--seed", type=int, default=0, help="random seed")
+    deltas_.set_defaults(run=benchmark_deltas)
+    scan = benchmarks.add_parser(
+        "scan", help="conversion of generated stock to a stock file, scan throughput"
+    )
+    scan.add_argument("--items", type=int, default=1_000_000, help="number of items")
+    scan.add_argument(
+        "--repeat", type=int, default=3, help="runs of each scan (the best counts)"
+    )
+    scan.add_argument("--seed", type=int, default=0, help="random seed")
+    scan.set_defaults(run=benchmark_scan)
+    compare = benchmarks.add_parser(
+        "compare", help="compare two suite results, exit status 1 on a regression"
+    )
+    compare.add_argument("old", help="JSON results of the baseline")
+    compare.add_argument("new", help="JSON results to check")
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="slowdown (fraction of throughput) reported as a regression",
+    )
+    compare.set_defaults(run=benchmark_compare)
+    arguments = parser.parse_args(argv)
+    arguments.run(arguments)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import sys
 from datetime import datetime
+from typing import Protocol, TextIO
 
 
 class User:
@@ -14,6 +16,10 @@ class User:
     def __repr__(self):
         return f"User(name={self._name})"
 
+    @property
+    def name(self) -> str:
+        return self._name
+
     def get_user_name():
         return input("Enter name: ")
 
@@ -23,14 +29,14 @@ class User:
     def is_named(self, name):
         return self._name == name
 
-    def greet(self) -> None:
-        print(f"\nHello, {self._name}!\nWelcome to our Warehouse Database.")
-        print("If you don't find what you are looking for, ", end="")
-        print("please ask one of our staff members to assist you.")
+    def greet(self, file: TextIO = None) -> None:
+        print(f"\nHello, {self._name}!\nWelcome to our Warehouse Database.", file=file)
+        print("If you don't find what you are looking for, ", end="", file=file)
+        print("please ask one of our staff members to assist you.", file=file)
 
-    def bye(self, actions: list) -> None:
+    def bye(self, actions: list, file: TextIO = None) -> None:
         del actions  # don't show actions to just any user
-        print(f"\nThank you for your visit, {self._name}!\n")
+        print(f"\nThank you for your visit, {self._name}!\n", file=file)
 
 
 class Employee(User):
@@ -68,20 +74,38 @@ class Employee(User):
     def order(self, item: Item, amount: int) -> None:
         print(f"You have ordered {item}. \nOrdered amount: {amount}")
 
-    def greet(self) -> None:
-        print(f"\nHello, {self._name}!")
-        print("If you experience a problem with the system, ", end="")
-        print("please contact technical support.")
+    def greet(self, file: TextIO = None) -> None:
+        print(f"\nHello, {self._name}!", file=file)
+        print("If you experience a problem with the system, ", end="", file=file)
+        print("please contact technical support.", file=file)
+
+    def bye(self, actions: list, file: TextIO = None) -> None:
+        super().bye(actions, file)
+        print(
+            "\n".join(f"{id}. {action}" for id, action in enumerate(actions, 1)),
+            file=file,
+        )
+
 
-    def bye(self, actions: list) -> None:
-        super().bye(actions)
-        print("\n".join(f"{id}. {action}" for id, action in enumerate(actions, 1)))
+# Notified by Warehouse whenever its stock changes (for example: indexes)
+class StockListener(Protocol):
+    def item_added(self, warehouse: Warehouse, item: Item) -> None:
+        ...
+
+    def item_removed(self, warehouse: Warehouse, item: Item) -> None:
+        ...
+
+    def items_removed(self, warehouse: Warehouse, items: list[Item]) -> None:
+        ...
 
 
 class Warehouse:
     def __init__(self, id: int, stock: list[Item] = None) -> None:
         self.id = id
         self.stock = stock if stock is not None else []
+        self._listeners = []
+        # id(item) -> position in stock, built by the first removal
+        self._positions = None
 
     def __str__(self) -> str:
         return f"Warehouse ID: {self.id} ({self.stock} items in stock)"
@@ -92,8 +116,68 @@ class Warehouse:
     def occupancy(self) -> int:
         return len(self.stock)
 
+    def add_listener(self, listener: StockListener) -> None:
+        self._listeners.append(listener)
+
     def add_item(self, item: Item) -> None:
+        if self._positions is not None:
+            self._positions[id(item)] = len(self.stock)
         self.stock.append(item)
+        for listener in self._listeners:
+            listener.item_added(self, item)
+
+    def add_items(self, items: list[Item]) -> None:
+        if self._positions is not None:
+            self._positions.update(
+                (id(item), position)
+                for position, item in enumerate(items, len(self.stock))
+            )
+        self.stock.extend(items)
+        for listener in self._listeners:
+            for item in items:
+                listener.item_added(self, item)
+
+    def remove_item(self, item: Item) -> Item:
+        """Removes an item equal to the given one (preferably the same object)
+        from the stock and returns it, raises ValueError if there is no such item.
+        The last item of the stock takes the place of the removed one,
+        so removing an item which is in the stock is O(1)"""
+        removed = self._take(item)
+        for listener in self._listeners:
+            listener.item_removed(self, removed)
+        return removed
+
+    def remove_items(self, items: list[Item]) -> list[Item]:
+        """Removes many items like remove_item, listeners are notified once"""
+        removed = []
+        try:
+            for item in items:
+                removed.append(self._take(item))
+        finally:
+            # NOTE: even if some item was missing, listeners learn about the others
+            if removed:
+                for listener in self._listeners:
+                    listener.items_removed(self, removed)
+        return removed
+
+    def _take(self, item: Item) -> Item:
+        position = self._position(item)
+        taken = self.stock[position]
+        del self._positions[id(taken)]
+        last = self.stock.pop()
+        if position < len(self.stock):
+            self.stock[position] = last
+            self._positions[id(last)] = position
+        return taken
+
+    def _position(self, item: Item) -> int:
+        if self._positions is None:
+            self._positions = {id(item): p for p, item in enumerate(self.stock)}
+        position = self._positions.get(id(item))
+        if position is None or self.stock[position] is not item:
+            position = self.stock.index(item)  # NOTE: an equal item, not the same one
+            self._positions[id(self.stock[position])] = position
+        return position
 
     def search(self, search_term: str) -> list[Item]:
         return [
@@ -104,6 +188,9 @@ class Warehouse:
 
 
 class Item:
+    # NOTE: no __dict__ per instance, there can be millions of items
+    __slots__ = ("state", "category", "date_of_stock")
+
     def __init__(
         self, state: str, category: str, warehouse: int, date_of_stock: datetime
     ) -> None:
@@ -125,6 +212,10 @@ class Item:
         # necessary for instances to behave sanely in dicts and sets.
         return hash((self.state, self.category, self.date_of_stock))
 
+    def __reduce__(self):
+        # NOTE: compact pickles (items are sent between processes in bulk)
+        return (_unpickle_item, (self.state, self.category, self.date_of_stock))
+
     def __str__(self) -> str:
         return f'''state="{self.state}",
                    category="{self.category}",
@@ -136,6 +227,13 @@ class Item:
     def full_name(self) -> str:
         return f"{self.state} {self.category}"
 
-    def days_in_warehouse(self) -> str:
-        today = datetime.today()
+    def days_in_warehouse(self, today: datetime = None) -> int:
+        """Returns whole days since the item was stocked, pass today to count many items
+        from the same moment"""
+        today = today if today is not None else datetime.today()
         return (today - self.date_of_stock).days
+
+
+def _unpickle_item(state: str, category: str, date_of_stock: datetime) -> Item:
+    # strings shared by many items are shared again after unpickling
+    return Item(sys.intern(state), sys.intern(category), None, date_of_stock)
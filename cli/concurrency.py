@@ -0,0 +1,110 @@
+"""Locking which lets many threads share one WarehouseManager"""
+from __future__ import annotations
+import contextlib
+import functools
+import threading
+from typing import Callable, Iterator
+
+
+class ReadWriteLock:
+    """Lock held either by any number of readers or by a single writer.
+    Waiting writers go first, so a stream of readers can't starve them.
+    It is reentrant: a thread may read again while reading or writing,
+    and write again while writing (but not start writing while reading)"""
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0  # read holds of all threads
+        self._writer = None  # ident of the thread which writes
+        self._writes = 0  # how many times the writer holds the lock
+        self._waiting_writers = 0
+        self._local = threading.local()  # .reads: read holds of this thread
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(readers={self._readers}, writer={self._writer})"
+
+    def _reads(self) -> int:
+        return getattr(self._local, "reads", 0)
+
+    def acquire_read(self) -> None:
+        with self._condition:
+            if self._writer != threading.get_ident() and not self._reads():
+                self._condition.wait_for(
+                    lambda: self._writer is None and not self._waiting_writers
+                )
+            self._readers += 1
+        self._local.reads = self._reads() + 1
+
+    def release_read(self) -> None:
+        if not self._reads():
+            raise RuntimeError("release_read() of a lock which is not read")
+        self._local.reads -= 1
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self) -> None:
+        with self._condition:
+            if self._writer == threading.get_ident():
+                self._writes += 1
+                return
+            if self._reads():
+                # NOTE: two readers upgrading at once would wait for each other forever
+                raise RuntimeError("can't write while reading")
+            self._waiting_writers += 1
+            try:
+                self._condition.wait_for(
+                    lambda: self._writer is None and not self._readers
+                )
+            finally:
+                self._waiting_writers -= 1
+            self._writer = threading.get_ident()
+            self._writes = 1
+
+    def release_write(self) -> None:
+        with self._condition:
+            if self._writer != threading.get_ident():
+                raise RuntimeError("release_write() of a lock which is not written")
+            self._writes -= 1
+            if not self._writes:
+                self._writer = None
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def read(self) -> Iterator[None]:
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write(self) -> Iterator[None]:
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+def reading(method: Callable) -> Callable:
+    """Decorator of methods which only read, they run under self.lock.read()"""
+
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.lock.read():
+            return method(self, *args, **kwargs)
+
+    return locked
+
+
+def writing(method: Callable) -> Callable:
+    """Decorator of methods which change something, they run under self.lock.write()"""
+
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.lock.write():
+            return method(self, *args, **kwargs)
+
+    return locked
@@ -0,0 +1,92 @@
+import threading
+import time
+import unittest
+from concurrency import ReadWriteLock
+
+
+class TestReadWriteLock(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lock = ReadWriteLock()
+
+    def in_thread(self, function) -> threading.Thread:
+        thread = threading.Thread(target=function, daemon=True)
+        thread.start()
+        return thread
+
+    def test_readers_share_the_lock(self):
+        both_reading = threading.Barrier(2, timeout=5)
+
+        def read():
+            with self.lock.read():
+                both_reading.wait()
+
+        threads = [self.in_thread(read) for _ in range(2)]
+        for thread in threads:
+            thread.join(5)
+        self.assertFalse(both_reading.broken)
+
+    def test_writer_waits_for_readers(self):
+        events = []
+
+        def write():
+            with self.lock.write():
+                events.append("write")
+
+        with self.lock.read():
+            writer = self.in_thread(write)
+            time.sleep(0.05)
+            events.append("read done")
+        writer.join(5)
+        self.assertListEqual(events, ["read done", "write"])
+
+    def test_waiting_writer_goes_before_new_readers(self):
+        events = []
+        writer_may_finish = threading.Event()
+
+        def write():
+            with self.lock.write():
+                events.append("write")
+                writer_may_finish.wait(5)
+
+        def read():
+            with self.lock.read():
+                events.append("read")
+
+        with self.lock.read():
+            writer = self.in_thread(write)
+            while not self.lock._waiting_writers:
+                time.sleep(0.001)
+            reader = self.in_thread(read)
+            time.sleep(0.05)
+            self.assertListEqual(events, [])
+        while not events:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        self.assertListEqual(events, ["write"])
+        writer_may_finish.set()
+        writer.join(5)
+        reader.join(5)
+        self.assertListEqual(events, ["write", "read"])
+
+    def test_reentrant(self):
+        with self.lock.write(), self.lock.write(), self.lock.read():
+            with self.lock.read():
+                pass
+        with self.lock.read(), self.lock.read():
+            pass
+        self.assertEqual(self.lock._readers, 0)
+        self.assertIsNone(self.lock._writer)
+
+    def test_no_writing_while_reading(self):
+        with self.lock.read(), self.assertRaises(RuntimeError):
+            self.lock.acquire_write()
+
+    def test_release_without_acquire(self):
+        with self.assertRaises(RuntimeError):
+            self.lock.release_read()
+        with self.assertRaises(RuntimeError):
+            self.lock.release_write()
+
+
+if __name__ == "__main__":
+    unittest.main()
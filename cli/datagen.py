@@ -0,0 +1,248 @@
+"""Synthetic warehouse data, see: python cli/datagen.py --help
+
+Writes stock.json and personnel.json shaped like the real ones, at any size:
+items are streamed to the file, so 10M of them don't have to fit in memory"""
+from __future__ import annotations
+import argparse
+import datetime
+import itertools
+import json
+import os
+import random
+from typing import TextIO
+
+STATES = [
+    "Almost new",
+    "Black",
+    "Blue",
+    "Brand new",
+    "Cheap",
+    "Elegant",
+    "Exceptional",
+    "Funny",
+    "High quality",
+    "Original",
+    "Red",
+    "Second hand",
+    "White",
+    "Wireless",
+]
+CATEGORIES = [
+    "Beamer",
+    "Camera",
+    "GPS",
+    "Game console",
+    "HDMI cable",
+    "Headphones",
+    "Home-cinema",
+    "Keyboard",
+    "Laptop",
+    "Microphone",
+    "Monitor",
+    "Mouse",
+    "Pen drive",
+    "Printer",
+    "Remote control",
+    "Router",
+    "Scanner",
+    "Smart TV",
+    "Smartphone",
+    "Smartwatch",
+    "Speakers",
+    "Surveillance camera",
+    "Tablet",
+    "Television",
+    "USB hub",
+    "iOS charger",
+]
+FIRST_DATE = datetime.datetime(2019, 1, 1)
+DATE_SPAN_SECONDS = 4 * 365 * 24 * 3600
+
+
+def item_names(number_of_names: int) -> list[tuple[str, str]]:
+    """Returns number_of_names distinct (state, category) pairs,
+    every category is used before a state is repeated
+    (then states "State N" follow the real ones)"""
+    states = itertools.chain(STATES, (f"State {n}" for n in itertools.count(1)))
+    names = []
+    for state in states:
+        if len(names) >= number_of_names:
+            return names
+        names.extend(
+            (state, category) for category in CATEGORIES[: number_of_names - len(names)]
+        )
+    return names
+
+
+def employee_name(number: int) -> str:
+    return f"Employee {number}"
+
+
+def employee_password(number: int) -> str:
+    return f"password{number}"
+
+
+def organisation(depth: int, width: int) -> list[dict]:
+    """Returns personnel records: width top-level employees,
+    each of them head of width employees, and so on, depth levels in total.
+    Employees are numbered from 1, level by level"""
+    numbers = itertools.count(1)
+
+    def employee() -> dict:
+        number = next(numbers)
+        return {
+            "user_name": employee_name(number),
+            "password": employee_password(number),
+        }
+
+    top = level = [employee() for _ in range(width)]
+    for _ in range(depth - 1):
+        next_level = []
+        for head in level:
+            head["head_of"] = [employee() for _ in range(width)]
+            next_level.extend(head["head_of"])
+        level = next_level
+    return top
+
+
+def number_of_employees(depth: int, width: int) -> int:
+    return sum(width ** level for level in range(1, depth + 1))
+
+
+def write_stock(
+    file: TextIO,
+    items: int,
+    names: int = len(STATES) * len(CATEGORIES),
+    warehouses: int = 4,
+    batch: int = 1,
+    seed: int = 0,
+) -> None:
+    """Writes a JSON array of items with random names (out of names),
+    warehouses and dates. Items are stocked in batches of the same name,
+    warehouse and date (like deliveries)"""
+    rng = random.Random(seed)
+    pool = item_names(names)
+    file.write("[")
+    separator = "\n"
+    written = 0
+    while written < items:
+        state, category = rng.choice(pool)
+        warehouse = rng.randint(1, warehouses)
+        date = FIRST_DATE + datetime.timedelta(seconds=rng.randrange(DATE_SPAN_SECONDS))
+        # NOTE: formatted by hand,
+        # json.dumps per item would dominate for millions of them
+        record = (
+            f'{{"state": "{state}", "category": "{category}", '
+            f'"warehouse": {warehouse}, "date_of_stock": "{date}"}}'
+        )
+        for _ in range(min(batch, items - written)):
+            file.write(separator)
+            file.write(record)
+            separator = ",\n"
+            written += 1
+    file.write("\n]\n")
+
+
+def write_events(
+    file: TextIO,
+    events: int,
+    names: int = len(STATES) * len(CATEGORIES),
+    warehouses: int = 4,
+    removals: float = 0.5,
+    seed: int = 0,
+) -> None:
+    """Writes a delta feed (JSON Lines) of items stocked after the stock file,
+    a share (removals) of the events removes one of the items added before"""
+    rng = random.Random(seed)
+    pool = item_names(names)
+    added = []
+    date = FIRST_DATE + datetime.timedelta(seconds=DATE_SPAN_SECONDS)
+    for _ in range(events):
+        if added and rng.random() < removals:
+            # NOTE: any of the items in stock,
+            # swapped with the last one to pop it in O(1)
+            position = rng.randrange(len(added))
+            added[position], added[-1] = added[-1], added[position]
+            event, (state, category, warehouse, date_of_stock) = "remove", added.pop()
+        else:
+            state, category = rng.choice(pool)
+            warehouse = rng.randint(1, warehouses)
+            date += datetime.timedelta(seconds=rng.randrange(1, 600))
+            date_of_stock = date
+            added.append((state, category, warehouse, date_of_stock))
+            event = "add"
+        file.write(
+            f'{{"event": "{event}", "state": "{state}", "category": "{category}", '
+            f'"warehouse": {warehouse}, "date_of_stock": "{date_of_stock}"}}\n'
+        )
+
+
+def generate(
+    directory: str,
+    items: int,
+    names: int = len(STATES) * len(CATEGORIES),
+    warehouses: int = 4,
+    batch: int = 1,
+    depth: int = 2,
+    width: int = 4,
+    seed: int = 0,
+) -> tuple[str, str]:
+    """Writes personnel.json and stock.json into the directory, returns their paths"""
+    os.makedirs(directory, exist_ok=True)
+    personnel_file = os.path.join(directory, "personnel.json")
+    stock_file = os.path.join(directory, "stock.json")
+    with open(personnel_file, "w") as f:
+        json.dump(organisation(depth, width), f, indent=1)
+    with open(stock_file, "w") as f:
+        write_stock(f, items, names, warehouses, batch, seed)
+    return personnel_file, stock_file
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "directory", help="where to write personnel.json and stock.json"
+    )
+    parser.add_argument("--items", type=int, default=100_000, help="number of items")
+    parser.add_argument(
+        "--names",
+        type=int,
+        default=len(STATES) * len(CATEGORIES),
+        help="number of distinct item names (default: as many as in the real data)",
+    )
+    parser.add_argument(
+        "--warehouses", type=int, default=4, help="number of warehouses"
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=1,
+        help="items stocked together with the same name, warehouse and date",
+    )
+    parser.add_argument(
+        "--depth", type=int, default=2, help="levels of the organisation chart"
+    )
+    parser.add_argument(
+        "--width", type=int, default=4, help="employees headed by each employee"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    arguments = parser.parse_args(argv)
+    generate(
+        arguments.directory,
+        arguments.items,
+        names=arguments.names,
+        warehouses=arguments.warehouses,
+        batch=arguments.batch,
+        depth=arguments.depth,
+        width=arguments.width,
+        seed=arguments.seed,
+    )
+    print(
+        f"{arguments.items} items, "
+        f"{number_of_employees(arguments.depth, arguments.width)} employees "
+        f"written to {arguments.directory}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import io
+import json
+import tempfile
+import unittest
+from app import WarehouseManager
+from datagen import generate, item_names, number_of_employees, organisation, write_stock
+from json_records import JSONRecords
+
+
+class TestDatagen(unittest.TestCase):
+    def test_item_names(self):
+        self.assertListEqual(
+            item_names(2), [("Almost new", "Beamer"), ("Almost new", "Camera")]
+        )
+        names = item_names(1000)
+        self.assertEqual(len(set(names)), 1000)
+        self.assertIn(("State 1", "Beamer"), names)
+
+    def test_organisation(self):
+        personnel = organisation(depth=3, width=2)
+        self.assertEqual(len(personnel), 2)
+        self.assertEqual(personnel[0]["user_name"], "Employee 1")
+        self.assertEqual(len(personnel[0]["head_of"][0]["head_of"]), 2)
+        self.assertNotIn("head_of", personnel[0]["head_of"][0]["head_of"][0])
+        self.assertEqual(number_of_employees(3, 2), 14)
+
+    def test_stock_is_valid_json(self):
+        file = io.StringIO()
+        write_stock(file, 10, names=3, warehouses=2, batch=4)
+        records = json.loads(file.getvalue())
+        self.assertEqual(len(records), 10)
+        self.assertLessEqual({r["warehouse"] for r in records}, {1, 2})
+        self.assertLessEqual(len({r["date_of_stock"] for r in records}), 3)
+        self.assertEqual(records[0], records[3])
+
+    def test_generated_files_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            personnel_file, stock_file = generate(
+                directory, 500, names=30, depth=2, width=3
+            )
+            manager = WarehouseManager(
+                JSONRecords(personnel_file), JSONRecords(stock_file)
+            )
+            self.assertEqual(manager.calculate_total_amount(), 500)
+            self.assertLessEqual(len(manager.get_unique_item_names()), 30)
+            employee = manager.get_employee("Employee 12")
+            self.assertTrue(employee.authenticate("password12"))
+            self.assertIsNone(manager.get_employee("Employee 13"))
+
+
+if __name__ == "__main__":
+    unittest.main()
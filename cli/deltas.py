@@ -0,0 +1,244 @@
+"""Stock changes fed as they happen, see: python cli/deltas.py --help
+
+A delta feed is a JSON Lines file of events appended by whoever stocks or ships items.
+An event is the record of an item (as in the stock file)
+with "event": "add" or "remove", e.g. (on one line):
+{"event": "add", "state": "Blue", "category": "Keyboard", "warehouse": 3,
+ "date_of_stock": "2021-08-01 12:00:00"}
+A removal removes an item equal to the given one from its warehouse.
+
+Events are applied in batches, each under one write lock of the manager, only complete
+lines are read, so the feed can be applied while it is written to (tailed).
+With a snapshot, the stock is saved as a checkpoint together with the offset of the feed
+it includes (atomically), so a restart loads it and resumes where it left off.
+Backends which store changes right away store the offset with every batch instead"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+import warnings
+from app import (
+    DEFAULT_PERSONNEL_FILE,
+    DEFAULT_STOCK_FILE,
+    WarehouseManager,
+    manager_from_environment,
+)
+from classes import Item
+from loader import CachedDateParser, Loader, intern_string
+from metrics import timed
+from typing import Iterator, NamedTuple
+
+EVENTS = ("add", "remove")
+DEFAULT_BATCH_SIZE = 1000
+# how often a followed feed is checked for new events and checkpointed
+DEFAULT_INTERVAL_SECONDS = 1.0
+DEFAULT_CHECKPOINT_SECONDS = 60.0
+
+
+class StockChange(NamedTuple):
+    event: str
+    warehouse: int
+    item: Item
+
+
+def _build_change(
+    event: str, state: str, category: str, warehouse: int, date_of_stock
+) -> StockChange:
+    if event not in EVENTS:
+        raise ValueError(f"Unknown event: {event!r}")
+    return StockChange(
+        event, warehouse, Item(state, category, warehouse, date_of_stock)
+    )
+
+
+class ChangeLoader(Loader):
+    """Used to load events of a delta feed into instances of StockChange"""
+
+    def __init__(self):
+        super().__init__(
+            target_builder=_build_change,
+            strategies={
+                "date_of_stock": CachedDateParser(),
+                "state": intern_string,
+                "category": intern_string,
+            },
+        )
+
+
+class FeedProgress(NamedTuple):
+    """What one DeltaFeed.apply() did"""
+
+    applied: int  # events which changed the stock
+    missing: int  # removals of items which were not in stock
+    rejected: int  # lines which are not valid events
+    offset: int  # the feed is applied up to this byte
+    seconds: float
+
+    @property
+    def events_per_second(self) -> float:
+        events = self.applied + self.missing + self.rejected
+        return events / self.seconds if self.seconds else None
+
+
+class DeltaFeed:
+    """Applies a delta feed to a WarehouseManager, from where the stock
+    (its snapshot) left off, see the module documentation"""
+
+    def __init__(
+        self,
+        file_name: str,
+        manager: WarehouseManager,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        self.file_name = os.path.abspath(file_name)
+        self.manager = manager
+        self.batch_size = batch_size
+        self._loader = ChangeLoader()
+        metadata = manager.snapshot_metadata
+        # NOTE: the checkpoint of another feed doesn't count
+        self.offset = (
+            metadata.get("delta_offset", 0)
+            if metadata.get("delta_feed") == self.file_name
+            else 0
+        )
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.file_name!r}, offset={self.offset})"
+
+    def batches(self) -> Iterator[tuple[list[StockChange], int, int]]:
+        """Yields (changes, number of rejected lines, offset after them)
+        of complete lines from the offset on, batch_size changes at a time
+        (the offset itself is not moved)"""
+        offset = self.offset
+        with open(self.file_name, "rb") as f:
+            if os.fstat(f.fileno()).st_size < offset:
+                raise ValueError(
+                    f"{self.file_name} is shorter than the offset {offset} "
+                    "it was applied up to, it is not the same feed"
+                )
+            f.seek(offset)
+            changes = []
+            rejected = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # NOTE: still being written, it is read next time
+                try:
+                    if line.strip():
+                        changes.append(self._loader.load_record(json.loads(line)))
+                except (ValueError, TypeError, KeyError) as error:
+                    warnings.warn(
+                        f"{self.file_name}: invalid event at byte {offset}: {error}"
+                    )
+                    rejected += 1
+                offset += len(line)
+                if len(changes) >= self.batch_size:
+                    yield changes, rejected, offset
+                    changes = []
+                    rejected = 0
+            if changes or rejected:
+                yield changes, rejected, offset
+
+    @timed()
+    def apply(self, checkpoint: bool = True) -> FeedProgress:
+        """Applies all complete events not applied yet, then saves a checkpoint
+        (if there were any and the manager has a snapshot)"""
+        start = time.perf_counter()
+        applied = missing = rejected = 0
+        for changes, rejected_lines, offset in self.batches():
+            missing_changes = self.manager.apply_stock_changes(
+                changes, self._metadata(offset)
+            )
+            applied += len(changes) - len(missing_changes)
+            missing += len(missing_changes)
+            rejected += rejected_lines
+            self.offset = offset
+        if checkpoint and applied + missing + rejected:
+            self.checkpoint()
+        return FeedProgress(
+            applied, missing, rejected, self.offset, time.perf_counter() - start
+        )
+
+    def checkpoint(self) -> None:
+        """Saves the stock with the offset of the feed it includes
+        (if there is a snapshot)"""
+        if self.manager.has_snapshot:
+            self.manager.save_snapshot(self._metadata(self.offset))
+
+    def _metadata(self, offset: int) -> dict:
+        """Returns metadata of stock which includes the feed up to offset"""
+        return {"delta_feed": self.file_name, "delta_offset": offset}
+
+    def follow(
+        self,
+        stop: threading.Event,
+        interval: float = DEFAULT_INTERVAL_SECONDS,
+        checkpoint_seconds: float = DEFAULT_CHECKPOINT_SECONDS,
+    ) -> None:
+        """Applies events as they are appended until stop is set,
+        saving a checkpoint at most every checkpoint_seconds (and when stopped)"""
+        last_checkpoint = time.monotonic()
+        changed = False
+        while True:
+            progress = self.apply(checkpoint=False)
+            changed = changed or any(progress[:3])
+            if changed and time.monotonic() - last_checkpoint >= checkpoint_seconds:
+                self.checkpoint()
+                last_checkpoint = time.monotonic()
+                changed = False
+            if stop.wait(interval):
+                break
+        if changed:
+            self.checkpoint()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("feed", help="JSON Lines file of events")
+    parser.add_argument(
+        "--personnel-file", default=DEFAULT_PERSONNEL_FILE, help="personnel JSON file"
+    )
+    parser.add_argument(
+        "--stock-file", default=DEFAULT_STOCK_FILE, help="stock JSON file"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="events applied under one lock",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="keep applying events as they are appended (until interrupted)",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_INTERVAL_SECONDS,
+        help="seconds between checks for new events, with --follow",
+    )
+    arguments = parser.parse_args(argv)
+    manager = manager_from_environment(arguments.personnel_file, arguments.stock_file)
+    feed = DeltaFeed(arguments.feed, manager, arguments.batch_size)
+    print(f"Applying {feed.file_name} from byte {feed.offset}")
+    if arguments.follow:
+        stop = threading.Event()
+        # NOTE: a batch is never interrupted half applied, the checkpoint would be wrong
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *_args: stop.set())
+        feed.follow(stop, arguments.interval)
+    else:
+        progress = feed.apply()
+        print(
+            f"{progress.applied} applied, {progress.missing} not in stock, "
+            f"{progress.rejected} invalid, up to byte {progress.offset} "
+            f"in {progress.seconds:.3f} s"
+        )
+    print(f"{manager.calculate_total_amount()} items in stock")
+
+
+if __name__ == "__main__":
+    main()
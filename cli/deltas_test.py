@@ -0,0 +1,184 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+import app_test
+from app import WarehouseManager
+from datagen import write_events
+from deltas import DeltaFeed
+from json_records import JSONRecords
+from mapped_backend import MappedWarehouseManager
+from snapshot import Snapshot
+from sqlite_backend import SqliteWarehouseManager
+
+
+def event(event, state, category, warehouse, date_of_stock):
+    return json.dumps(
+        {
+            "event": event,
+            "state": state,
+            "category": category,
+            "warehouse": warehouse,
+            "date_of_stock": date_of_stock,
+        }
+    )
+
+
+RED_KEYBOARD = ("Red", "Keyboard", 2, "2021-08-01 12:00:00")
+BLACK_SMARTWATCH = ("Black", "Smartwatch", 4, "2021-07-20 03:51:06")
+
+
+class TestDeltaFeed(unittest.TestCase):
+    manager_class = WarehouseManager
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.personnel_file = self._path("personnel.json")
+        self.stock_file = self._path("stock.json")
+        self.feed_file = self._path("deltas.jsonl")
+        with open(self.personnel_file, "w") as f:
+            json.dump(app_test.TestWarehouseManager.personnel_for_test_get_employee, f)
+        with open(self.stock_file, "w") as f:
+            json.dump(app_test.TestWarehouseManager.warehouse_items_for_test, f)
+        self.manager = self.new_manager()
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self._directory.name, file_name)
+
+    def new_manager(self) -> WarehouseManager:
+        """Returns a manager of the stock file, as after a restart"""
+        return self.manager_class(
+            JSONRecords(self.personnel_file),
+            JSONRecords(self.stock_file),
+            snapshot=Snapshot(
+                self._path("warehouse.snapshot"),
+                sources=[self.personnel_file, self.stock_file],
+            ),
+        )
+
+    def append(self, *lines: str) -> None:
+        with open(self.feed_file, "a") as f:
+            f.write("".join(lines))
+
+    def test_events_update_stock_and_indexes(self):
+        self.append(
+            event("add", *RED_KEYBOARD) + "\n",
+            event("add", *RED_KEYBOARD) + "\n",
+            event("remove", *BLACK_SMARTWATCH) + "\n",
+            event("remove", *RED_KEYBOARD) + "\n",
+        )
+        progress = DeltaFeed(self.feed_file, self.manager, batch_size=3).apply()
+        self.assertEqual(progress[:4], (4, 0, 0, os.path.getsize(self.feed_file)))
+        self.assertEqual(self.manager.calculate_total_amount(), 8)
+        self.assertEqual(
+            self.manager.calculate_item_amount_in_warehouse(2, "red keyboard"), 1
+        )
+        self.assertSetEqual(
+            self.manager.get_unique_categories(), {"Remote control", "Keyboard"}
+        )
+        self.assertEqual(
+            [match.name for match in self.manager.search_item_names("keyb")],
+            ["Red Keyboard"],
+        )
+        self.assertEqual(self.manager.search_item_names("smartwatch"), [])
+
+    def test_missing_and_invalid_events_are_skipped(self):
+        self.append(
+            event("remove", *RED_KEYBOARD) + "\n",
+            "not json\n",
+            event("ship", *RED_KEYBOARD) + "\n",
+            "\n",
+            event("add", *RED_KEYBOARD) + "\n",
+        )
+        with self.assertWarns(UserWarning):
+            progress = DeltaFeed(self.feed_file, self.manager).apply()
+        self.assertEqual(progress[:3], (1, 1, 2))
+        self.assertEqual(self.manager.calculate_total_amount(), 9)
+
+    def test_unfinished_line_waits_for_the_rest(self):
+        line = event("add", *RED_KEYBOARD) + "\n"
+        self.append(line, line[:20])
+        feed = DeltaFeed(self.feed_file, self.manager)
+        self.assertEqual(feed.apply().applied, 1)
+        self.assertEqual(feed.offset, len(line))
+        self.append(line[20:])
+        self.assertEqual(feed.apply().applied, 1)
+        self.assertEqual(self.manager.calculate_item_total_amount("Red Keyboard"), 2)
+
+    def test_restart_resumes_from_checkpoint(self):
+        self.append(event("add", *RED_KEYBOARD) + "\n")
+        DeltaFeed(self.feed_file, self.manager).apply()
+        self.append(event("remove", *BLACK_SMARTWATCH) + "\n")
+
+        manager = self.new_manager()
+        self.assertEqual(manager.calculate_total_amount(), 9)
+        feed = DeltaFeed(self.feed_file, manager)
+        self.assertEqual(feed.apply()[:3], (1, 0, 0))
+        self.assertEqual(manager.calculate_total_amount(), 8)
+
+        manager = self.new_manager()
+        self.assertEqual(DeltaFeed(self.feed_file, manager).apply()[:3], (0, 0, 0))
+        self.assertEqual(manager.calculate_item_total_amount("Red Keyboard"), 1)
+        self.assertEqual(manager.calculate_item_total_amount("Black Smartwatch"), 0)
+
+    def test_checkpoint_of_another_feed_is_not_used(self):
+        self.append(event("add", *RED_KEYBOARD) + "\n")
+        DeltaFeed(self.feed_file, self.manager).apply()
+        other_feed = self._path("other.jsonl")
+        with open(other_feed, "w") as f:
+            f.write(event("add", *RED_KEYBOARD) + "\n")
+        self.assertEqual(DeltaFeed(other_feed, self.new_manager()).offset, 0)
+
+    def test_feed_shorter_than_checkpoint(self):
+        self.append(event("add", *RED_KEYBOARD) + "\n")
+        DeltaFeed(self.feed_file, self.manager).apply()
+        os.truncate(self.feed_file, 0)
+        with self.assertRaises(ValueError):
+            DeltaFeed(self.feed_file, self.new_manager()).apply()
+
+    def test_follow_applies_events_until_stopped(self):
+        self.append("")
+        feed = DeltaFeed(self.feed_file, self.manager)
+        stop = threading.Event()
+        follower = threading.Thread(target=feed.follow, args=(stop, 0.01))
+        follower.start()
+        self.append(event("add", *RED_KEYBOARD) + "\n")
+        while feed.offset == 0:
+            stop.wait(0.01)
+        stop.set()
+        follower.join()
+        self.assertEqual(self.manager.calculate_item_total_amount("Red Keyboard"), 1)
+        self.assertEqual(self.new_manager().calculate_total_amount(), 9)
+
+    def test_generated_events_remove_only_added_items(self):
+        file = io.StringIO()
+        write_events(file, 1000, names=20, warehouses=3, removals=0.4)
+        self.append(file.getvalue())
+        progress = DeltaFeed(self.feed_file, self.manager).apply()
+        self.assertEqual(progress.applied, 1000)
+        self.assertEqual(progress.missing, 0)
+        removals = file.getvalue().count('"remove"')
+        self.assertEqual(self.manager.calculate_total_amount(), 8 + 1000 - 2 * removals)
+
+
+class TestDeltaFeedOfSqliteDatabase(TestDeltaFeed):
+    manager_class = SqliteWarehouseManager
+
+    def test_offset_is_stored_with_every_batch(self):
+        self.append(event("add", *RED_KEYBOARD) + "\n")
+        DeltaFeed(self.feed_file, self.manager).apply(checkpoint=False)
+        self.assertEqual(
+            self.new_manager().snapshot_metadata["delta_offset"],
+            os.path.getsize(self.feed_file),
+        )
+
+
+class TestDeltaFeedOfMappedStockFile(TestDeltaFeed):
+    manager_class = MappedWarehouseManager
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,482 @@
+from __future__ import annotations
+import bisect
+import collections
+import operator
+import threading
+from classes import Item, Warehouse
+from typing import Iterable, NamedTuple
+
+
+# removed items are searched for one by one only while there are
+# fewer than 1 / _SEARCH_LIMIT of the list, otherwise the list is filtered
+_SEARCH_LIMIT = 64
+
+
+def normalize_name(name: str) -> str:
+    """Returns the form of an item name used for (case insensitive) lookups"""
+    return name.lower()
+
+
+# Order of items within the index: oldest first
+# (state only makes the order total for items of the same category)
+age_order = operator.attrgetter("date_of_stock", "state")
+
+
+class StockIndex:
+    """Inverted index of the stock of many warehouses:
+    normalized full name -> { warehouse_id -> [Item, ...] }
+    category -> { warehouse_id -> [Item, ...] }
+    Lists of items are sorted by age_order (on first use, loading stays cheap),
+    so they also work as priority queues of the oldest items (see allocation)
+
+    Once a warehouse is added to the index, the index listens to it
+    and stays up to date with every item added or removed"""
+
+    def __init__(self, warehouses: Iterable[Warehouse] = ()) -> None:
+        self._by_name = {}
+        self._by_category = {}
+        # NOTE: exact (not normalized) full names, needed to list unique names
+        self._full_names = collections.Counter()
+        # names in stock (those counted in _full_names), for search as you type
+        self._name_search = NameSearch()
+        # id(list) -> list of items, for lists which are not sorted yet
+        self._unsorted = {}
+        self._sort_lock = threading.Lock()
+        for warehouse in warehouses:
+            self.add_warehouse(warehouse)
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(names={len(self._by_name)}, "
+            f"categories={len(self._by_category)})"
+        )
+
+    def add_warehouse(self, warehouse: Warehouse) -> None:
+        """Indexes all items already in the warehouse and subscribes to its changes"""
+        for item in warehouse.stock:
+            self._append(warehouse.id, item)
+        for index in (self._by_name, self._by_category):
+            for items_per_warehouse in index.values():
+                items = items_per_warehouse.get(warehouse.id)
+                if items:
+                    self._unsorted[id(items)] = items
+        warehouse.add_listener(self)
+
+    def item_added(self, warehouse: Warehouse, item: Item) -> None:
+        full_name = item.full_name()
+        for items_per_warehouse in (
+            self._by_name.setdefault(normalize_name(full_name), {}),
+            self._by_category.setdefault(item.category, {}),
+        ):
+            items = items_per_warehouse.setdefault(warehouse.id, [])
+            if id(items) in self._unsorted:
+                items.append(item)
+            else:
+                items.insert(_bisect_right(items, age_order(item)), item)
+        self._count_full_name(full_name)
+
+    def item_removed(self, warehouse: Warehouse, item: Item) -> None:
+        self.items_removed(warehouse, [item])
+
+    def items_removed(self, warehouse: Warehouse, items: list[Item]) -> None:
+        for index, key_of in (
+            (self._by_name, lambda item: normalize_name(item.full_name())),
+            (self._by_category, lambda item: item.category),
+        ):
+            removed_by_key = {}
+            for item in items:
+                removed_by_key.setdefault(key_of(item), []).append(item)
+            for key, removed in removed_by_key.items():
+                self._remove_from(index, key, warehouse.id, removed)
+        self._full_names.subtract(item.full_name() for item in items)
+        for full_name in {item.full_name() for item in items}:
+            if not self._full_names[full_name]:
+                del self._full_names[full_name]
+                self._name_search.discard(full_name)
+
+    def _append(self, warehouse_id: int, item: Item) -> None:
+        full_name = item.full_name()
+        self._by_name.setdefault(normalize_name(full_name), {}).setdefault(
+            warehouse_id, []
+        ).append(item)
+        self._by_category.setdefault(item.category, {}).setdefault(
+            warehouse_id, []
+        ).append(item)
+        self._count_full_name(full_name, sort=False)
+
+    def _count_full_name(self, full_name: str, sort: bool = True) -> None:
+        self._full_names[full_name] += 1
+        if self._full_names[full_name] == 1:
+            self._name_search.add(full_name, sort)
+
+    def _remove_from(
+        self, index: dict, key: str, warehouse_id: int, removed: list[Item]
+    ) -> None:
+        """Removes items from index[key][warehouse_id], dropping empty entries"""
+        items_per_warehouse = index[key]
+        items = items_per_warehouse[warehouse_id]
+        if len(removed) * _SEARCH_LIMIT < len(items):
+            self._sort(items)
+            for item in removed:
+                del items[_position(items, item)]
+        else:
+            # NOTE: when many items go, one pass over the list beats a search for each
+            # (items removed from warehouses are the very objects which are indexed)
+            removed_ids = {id(item) for item in removed}
+            items[:] = [item for item in items if id(item) not in removed_ids]
+        if not items:
+            self._unsorted.pop(id(items), None)
+            del items_per_warehouse[warehouse_id]
+            if not items_per_warehouse:
+                del index[key]
+
+    def _sort(self, items: list[Item]) -> list[Item]:
+        if id(items) in self._unsorted:
+            # NOTE: readers may sort concurrently, while list.sort() runs
+            # the list looks empty, so a sorted copy replaces the contents at once
+            with self._sort_lock:
+                if id(items) in self._unsorted:
+                    items[:] = sorted(items, key=age_order)
+                    del self._unsorted[id(items)]
+        return items
+
+    def _sorted(self, items_per_warehouse: dict) -> dict[int, list[Item]]:
+        for items in items_per_warehouse.values():
+            self._sort(items)
+        return items_per_warehouse
+
+    def items_named(self, item_name: str) -> dict[int, list[Item]]:
+        """Returns { warehouse_id: [Item, ...] } of items with a given name
+        (case insensitive), oldest first"""
+        return self._sorted(self._by_name.get(normalize_name(item_name), {}))
+
+    def items_of_category(self, category: str) -> dict[int, list[Item]]:
+        """Returns { warehouse_id: [Item, ...] } of items of a given category,
+        oldest first"""
+        return self._sorted(self._by_category.get(category, {}))
+
+    def find(self, warehouse_id: int, item: Item) -> Item:
+        """Returns the indexed item equal to the given one (preferably the same object),
+        raises ValueError if there is no such item in the warehouse"""
+        items = self.items_named(item.full_name()).get(warehouse_id, [])
+        return items[_position(items, item)]
+
+    def count(self, item_name: str, warehouse_id: int = None) -> int:
+        """Returns amount of items with a given name in a warehouse
+        (or in all of them)"""
+        return _count(self._by_name.get(normalize_name(item_name), {}), warehouse_id)
+
+    def category_count(self, category: str, warehouse_id: int = None) -> int:
+        """Returns amount of items of a given category in a warehouse
+        (or in all of them)"""
+        return _count(self._by_category.get(category, {}), warehouse_id)
+
+    def full_names(self) -> set[str]:
+        return set(self._full_names)
+
+    def search_names(self, query: str, limit: int = 10) -> list[NameMatch]:
+        """Returns up to limit names of items in stock best matching the query,
+        see NameSearch.search"""
+        return self._name_search.search(query, limit)
+
+    def categories(self) -> set[str]:
+        return set(self._by_category)
+
+
+class NameMatch(NamedTuple):
+    name: str  # full name of the item, as in stock
+    # "exact", "prefix" (all words found, the last one maybe unfinished) or "fuzzy"
+    kind: str
+    distance: int  # edits needed to correct the misspelled words (0 unless fuzzy)
+
+
+# key of a trie node where a word ends (no character of a word is "")
+_END = ""
+
+
+class NameSearch:
+    """Search of distinct item names as they are typed, in three indexes of their words
+    (words of the state and the category, normalized):
+    word -> names with the word (words of a query may come in any order)
+    a trie of words (the last word of a query may be unfinished)
+    trigram -> words with the trigram (to correct misspelled words)
+    Names are added and discarded one by one, as they come in and out of stock"""
+
+    # NOTE: best candidates are ranked, enough for good results and still fast
+    CANDIDATE_LIMIT = 200
+    COMPLETION_LIMIT = 1000
+
+    def __init__(self, names: Iterable[str] = ()) -> None:
+        self._names = {}  # normalized name -> [full name, ...]
+        # word -> [(length, normalized name), ...] of names with the word,
+        # shortest first (best ranked first)
+        self._postings = {}
+        self._trie = {}
+        # words whose names are not sorted yet (names added while loading)
+        self._unsorted = set()
+        self._sort_lock = threading.Lock()
+        self._words_of_trigram = {}
+        for name in names:
+            self.add(name, sort=False)
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(names={len(self._names)}, "
+            f"words={len(self._postings)})"
+        )
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, full_name: str, sort: bool = True) -> None:
+        """Adds the name,
+        sort=False postpones sorting to the first search (for loading)"""
+        key = normalize_name(full_name)
+        full_names = self._names.setdefault(key, [])
+        if full_name in full_names:
+            return
+        full_names.append(full_name)
+        if len(full_names) > 1:
+            return  # NOTE: the same name in different case, already indexed
+        for word in set(key.split()):
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = []
+                self._add_word(word)
+            if sort and word not in self._unsorted:
+                bisect.insort(postings, _posting(key))
+            else:
+                postings.append(_posting(key))
+                self._unsorted.add(word)
+
+    def discard(self, full_name: str) -> None:
+        key = normalize_name(full_name)
+        full_names = self._names.get(key, [])
+        if full_name not in full_names:
+            return
+        full_names.remove(full_name)
+        if full_names:
+            return
+        del self._names[key]
+        for word in set(key.split()):
+            postings = self._sorted_postings(word)
+            del postings[bisect.bisect_left(postings, _posting(key))]
+            if not postings:
+                del self._postings[word]
+                self._remove_word(word)
+
+    def _sorted_postings(self, word: str) -> list[tuple]:
+        postings = self._postings[word]
+        if word in self._unsorted:
+            # NOTE: searches run concurrently, the same way as StockIndex._sort
+            with self._sort_lock:
+                if word in self._unsorted:
+                    postings[:] = sorted(postings)
+                    self._unsorted.discard(word)
+        return postings
+
+    def _add_word(self, word: str) -> None:
+        node = self._trie
+        for character in word:
+            node = node.setdefault(character, {})
+        node[_END] = word
+        for trigram in _trigrams(word):
+            self._words_of_trigram.setdefault(trigram, set()).add(word)
+
+    def _remove_word(self, word: str) -> None:
+        path = [self._trie]
+        for character in word:
+            path.append(path[-1][character])
+        del path[-1][_END]
+        # NOTE: nodes left without words below them are pruned, bottom up
+        for depth in range(len(word), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][word[depth - 1]]
+        for trigram in _trigrams(word):
+            words = self._words_of_trigram[trigram]
+            words.discard(word)
+            if not words:
+                del self._words_of_trigram[trigram]
+
+    def _completions(self, prefix: str) -> dict[str, tuple]:
+        """Returns { word: (0, letters completed) } of words starting with prefix,
+        shortest first"""
+        node = self._trie
+        for character in prefix:
+            node = node.get(character)
+            if node is None:
+                return {}
+        completions = {}
+        level = [node]
+        while level and len(completions) < self.COMPLETION_LIMIT:
+            next_level = []
+            for node in level:
+                for character, child in node.items():
+                    if character == _END:
+                        completions[child] = (0, len(child) - len(prefix))
+                    else:
+                        next_level.append(child)
+            level = next_level
+        return completions
+
+    def _corrections(self, word: str) -> dict[str, tuple]:
+        """Returns { word: (0, 0) } if the word is known,
+        otherwise { known word: (edit distance, 0) } of known words
+        it may be a misspelling of"""
+        if word in self._postings:
+            return {word: (0, 0)}
+        limit = 0 if len(word) <= 2 else 1 if len(word) <= 5 else 2
+        if not limit:
+            return {}
+        trigrams = _trigrams(word)
+        shared = collections.Counter()
+        for trigram in trigrams:
+            shared.update(self._words_of_trigram.get(trigram, ()))
+        # NOTE: each edit changes at most 3 trigrams, words sharing fewer can't be close
+        enough = max(1, len(trigrams) - 3 * limit)
+        corrections = {}
+        for candidate, count in shared.items():
+            if count >= enough:
+                distance = edit_distance(word, candidate, limit)
+                if distance <= limit:
+                    corrections[candidate] = (distance, 0)
+        return corrections
+
+    def search(self, query: str, limit: int = 10) -> list[NameMatch]:
+        """Returns up to limit names best matching the query: the exact name first,
+        then names with all words of the query in any order
+        (the last word may be unfinished),
+        then names with words close to the misspelled ones; shorter names first"""
+        words = normalize_name(query).split()
+        if not words or limit <= 0:
+            return []
+        # NOTE: for each word of the query, words of names accepted in its place
+        # -> (edit distance, letters completed)
+        accepted = [self._corrections(word) for word in words[:-1]]
+        accepted.append(self._completions(words[-1]) or self._corrections(words[-1]))
+        if not all(accepted):
+            return []
+        # NOTE: names are gathered for the most selective word, checked for the others
+        first = min(
+            accepted,
+            key=lambda words: sum(len(self._postings[word]) for word in words),
+        )
+        others = [words for words in accepted if words is not first]
+        exact_key = " ".join(words)
+        costs = {exact_key: (0, 0)} if exact_key in self._names else {}
+        for word, cost in sorted(first.items(), key=lambda item: (item[1], item[0])):
+            for _length, key in self._sorted_postings(word):
+                if key not in costs:
+                    total = _cost(key, others, cost)
+                    if total is not None:
+                        costs[key] = total
+                        if len(costs) >= self.CANDIDATE_LIMIT:
+                            break
+            else:
+                continue
+            break
+        ranked = sorted(
+            costs.items(),
+            key=lambda item: (item[0] != exact_key, item[1], len(item[0]), item[0]),
+        )
+        return [
+            NameMatch(
+                self._names[key][0],
+                "exact" if key == exact_key else "fuzzy" if distance else "prefix",
+                distance,
+            )
+            for key, (distance, _completed) in ranked[:limit]
+        ]
+
+
+def _cost(key: str, others: list[dict], cost: tuple) -> tuple:
+    """Returns (edit distance, letters completed) of the best words of the name (key)
+    accepted for the other words of the query, None if some of them is missing"""
+    distance, completed = cost
+    words = key.split()
+    for accepted in others:
+        best = min((accepted[word] for word in words if word in accepted), default=None)
+        if best is None:
+            return None
+        distance += best[0]
+        completed += best[1]
+    return (distance, completed)
+
+
+def _posting(key: str) -> tuple:
+    return (len(key), key)
+
+
+def _trigrams(word: str) -> set[str]:
+    padded = f"${word}$"
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Returns the Levenshtein distance of a and b,
+    or limit + 1 if it is more than limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, a_character in enumerate(a, 1):
+        current = [i]
+        for j, b_character in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (a_character != b_character),
+                )
+            )
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def _count(items_per_warehouse: dict[int, list[Item]], warehouse_id: int = None):
+    if warehouse_id is None:
+        return sum(len(items) for items in items_per_warehouse.values())
+    return len(items_per_warehouse.get(warehouse_id, ()))
+
+
+# NOTE: bisect only takes key= since Python 3.10
+def _bisect_left(items: list[Item], key: tuple, start: int = 0) -> int:
+    """Returns the first position in a list sorted by age_order
+    where key could be inserted"""
+    end = len(items)
+    while start < end:
+        middle = (start + end) // 2
+        if age_order(items[middle]) < key:
+            start = middle + 1
+        else:
+            end = middle
+    return start
+
+
+def _bisect_right(items: list[Item], key: tuple, start: int = 0) -> int:
+    """Returns the last position in a list sorted by age_order
+    where key could be inserted"""
+    end = len(items)
+    while start < end:
+        middle = (start + end) // 2
+        if key < age_order(items[middle]):
+            end = middle
+        else:
+            start = middle + 1
+    return start
+
+
+def _position(items: list[Item], item: Item) -> int:
+    """Binary search for the item in a list sorted by age_order"""
+    key = age_order(item)
+    start = _bisect_left(items, key)
+    end = _bisect_right(items, key, start)
+    for position in range(start, end):
+        if items[position] is item:
+            return position
+    for position in range(start, end):
+        if items[position] == item:
+            return position
+    raise ValueError(f"{item!r} not in index")
@@ -0,0 +1,145 @@
+from __future__ import annotations
+import json
+import os
+from typing import Any, Iterator, TextIO
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+# longest record (in characters) buffered while waiting for it to become valid JSON
+DEFAULT_MAX_RECORD_SIZE = 1 << 24
+
+# file extensions of JSON Lines files (one record per line)
+JSON_LINES_EXTENSIONS = (".jsonl", ".ndjson")
+
+
+def iter_json_array(
+    file: TextIO,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_record_size: int = DEFAULT_MAX_RECORD_SIZE,
+) -> Iterator:
+    """Yields elements of a top-level JSON array one at a time,
+    reading the file in chunks instead of all at once"""
+    reader = _ChunkedJSONReader(file, chunk_size, max_record_size)
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.expect("]")
+        return
+    while True:
+        yield reader.decode_value()
+        separator = reader.next_character()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise reader.error(f"Expecting ',' or ']' but found {separator!r}")
+
+
+def iter_json_lines(file: TextIO) -> Iterator:
+    """Yields records of a JSON Lines file
+    (one JSON value per line, blank lines are skipped)"""
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_json_records(
+    file_name: str, json_lines: bool = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator:
+    """Yields records from a file containing either a top-level JSON array
+    or JSON Lines.
+    If json_lines is not given, it is guessed from the file extension"""
+    if json_lines is None:
+        json_lines = os.path.splitext(file_name)[1].lower() in JSON_LINES_EXTENSIONS
+    with open(file_name) as f:
+        if json_lines:
+            yield from iter_json_lines(f)
+        else:
+            yield from iter_json_array(f, chunk_size)
+
+
+class JSONRecords:
+    """Re-iterable view of the records stored in a JSON (or JSON Lines) file,
+    the file is streamed again on each iteration and nothing is kept in memory"""
+
+    def __init__(self, file_name: str, json_lines: bool = None) -> None:
+        self.file_name = file_name
+        self.json_lines = json_lines
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(file_name={self.file_name!r})"
+
+    def __iter__(self) -> Iterator:
+        return iter_json_records(self.file_name, self.json_lines)
+
+
+class _ChunkedJSONReader:
+    def __init__(self, file: TextIO, chunk_size: int, max_record_size: int) -> None:
+        self._file = file
+        self._chunk_size = chunk_size
+        self._max_record_size = max_record_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        # number of characters dropped from the front of the buffer (for error messages)
+        self._offset = 0
+        self._eof = False
+
+    def error(self, message: str) -> ValueError:
+        return ValueError(f"{message} at character {self._offset + self._position}")
+
+    def peek(self) -> str:
+        """Returns next non-whitespace character without consuming it
+        ("" at the end of file)"""
+        self._skip_whitespace()
+        return self._buffer[self._position : self._position + 1]
+
+    def next_character(self) -> str:
+        character = self.peek()
+        self._position += len(character)
+        return character
+
+    def expect(self, expected: str) -> None:
+        character = self.next_character()
+        if character != expected:
+            raise self.error(f"Expecting {expected!r} but found {character!r}")
+
+    def decode_value(self) -> Any:
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError as e:
+                if self._eof:
+                    raise
+                # NOTE: a record cut at the end of the buffer can't be told apart from
+                # a syntax error, so stop reading once no record could be this long
+                if len(self._buffer) - self._position > self._max_record_size:
+                    raise self.error(
+                        f"{e.msg} "
+                        f"(record longer than {self._max_record_size} characters)"
+                    ) from e
+                self._fill()
+                continue
+            # NOTE: a number (or literal) cut at the end of the buffer looks complete
+            if end == len(self._buffer) and not self._eof:
+                self._fill()
+                continue
+            self._position = end
+            return value
+
+    def _skip_whitespace(self) -> None:
+        while True:
+            self._position = json.decoder.WHITESPACE.match(
+                self._buffer, self._position
+            ).end()
+            if self._position < len(self._buffer) or self._eof:
+                return
+            self._fill()
+
+    def _fill(self) -> None:
+        """Drops the consumed part of the buffer and reads the next chunk"""
+        self._offset += self._position
+        self._buffer = self._buffer[self._position :]
+        self._position = 0
+        chunk = self._file.read(self._chunk_size)
+        self._eof = not chunk
+        self._buffer += chunk
@@ -0,0 +1,87 @@
+import unittest
+import json
+import os
+import tempfile
+from io import StringIO
+from json_records import (
+    JSONRecords,
+    iter_json_array,
+    iter_json_lines,
+    iter_json_records,
+)
+
+
+class TestJSONRecords(unittest.TestCase):
+    records = [
+        {
+            "state": "Black",
+            "category": "Smartwatch",
+            "warehouse": 4,
+            "date_of_stock": "2021-07-20 03:51:06",
+        },
+        {"user_name": "Tomek", "head_of": [{"user_name": "Ania", "head_of": []}]},
+        12345,
+        "text, with ] and [ inside",
+        [],
+        None,
+    ]
+
+    def test_iter_json_array_small_chunks(self):
+        text = json.dumps(self.records, indent=2)
+        for chunk_size in (1, 2, 3, 7, 64, 1 << 16):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertListEqual(
+                    list(iter_json_array(StringIO(text), chunk_size)), self.records
+                )
+
+    def test_iter_json_array_is_lazy(self):
+        records = iter_json_array(StringIO('[{"a": 1}, {"b": 2}, oops'), 4)
+        self.assertEqual(next(records), {"a": 1})
+        self.assertEqual(next(records), {"b": 2})
+        with self.assertRaises(ValueError):
+            next(records)
+
+    def test_iter_json_array_empty(self):
+        self.assertListEqual(list(iter_json_array(StringIO(" [ ] "))), [])
+
+    def test_iter_json_array_not_an_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(StringIO('{"a": 1}')))
+
+    def test_iter_json_array_missing_separator(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(StringIO("[1 2]")))
+
+    def test_iter_json_array_syntax_error_does_not_read_whole_file(self):
+        file = StringIO("[{oops}, " + ", ".join(["1"] * 100000) + "]")
+        with self.assertRaises(ValueError):
+            list(iter_json_array(file, 16, max_record_size=64))
+        self.assertLess(file.tell(), 1000)
+
+    def test_iter_json_lines(self):
+        text = "\n".join(json.dumps(record) for record in self.records) + "\n\n"
+        self.assertListEqual(list(iter_json_lines(StringIO(text))), self.records)
+
+    def test_iter_json_records_guesses_format_from_extension(self):
+        with tempfile.TemporaryDirectory() as directory:
+            array_file = os.path.join(directory, "stock.json")
+            lines_file = os.path.join(directory, "stock.jsonl")
+            with open(array_file, "w") as f:
+                json.dump(self.records, f)
+            with open(lines_file, "w") as f:
+                f.writelines(json.dumps(record) + "\n" for record in self.records)
+            self.assertListEqual(list(iter_json_records(array_file)), self.records)
+            self.assertListEqual(list(iter_json_records(lines_file)), self.records)
+
+    def test_json_records_can_be_iterated_many_times(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, "stock.json")
+            with open(file_name, "w") as f:
+                json.dump(self.records, f)
+            records = JSONRecords(file_name)
+            self.assertListEqual(list(records), self.records)
+            self.assertListEqual(list(records), self.records)
+
+
+if __name__ == "__main__":
+    unittest.main()
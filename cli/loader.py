@@ -1,16 +1,40 @@
 from __future__ import annotations
+import argparse
 import itertools
 import datetime
 import collections
 import functools
+import os
+import sys
+import types
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from classes import Employee, Item, Warehouse
-from typing import Any, Iterable, TypeVar, Callable, Protocol, Dict, Union
+from json_records import JSONRecords
+from profiling import PROFILER
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    TypeVar,
+    Callable,
+    Protocol,
+    Dict,
+    Optional,
+    Union,
+)
 
 
 def no_transformation(value, **_kwargs):
     return value
 
 
+def intern_string(value, **_kwargs):
+    """Makes equal strings (like categories repeated in many records)
+    share one object"""
+    return sys.intern(value)
+
+
 # Type hints to explain the interface of Loader better, ignore if confusing
 # The type of objects that Loader will generate
 TargetClass = TypeVar("TargetClass")
@@ -47,6 +71,9 @@ class Loader:
     """Can load most reasonable iterables of dictionaries
     into object structures"""
 
+    # NOTE: keeps the cache of compiled builders bounded for very irregular records
+    MAX_COMPILED_BUILDERS = 64
+
     def __init__(
         self,
         strategies: Dict[str, ValueTransformation],
@@ -64,13 +91,63 @@ class Loader:
     ) -> Union[Iterable[TargetClass], Any]:
         return self.post_processor(self.load_record(record) for record in records)
 
+    def __setattr__(self, name: str, value: Any) -> None:
+        # compiled builders depend on these, they have to be compiled again
+        if name in ("strategies", "default_strategy", "target_builder"):
+            self.__dict__["_compiled_builders"] = {}
+        if name == "strategies":
+            # NOTE: a read-only copy, changed in place they would not be compiled again
+            # (assign new strategies instead)
+            value = types.MappingProxyType(dict(value))
+        super().__setattr__(name, value)
+
     def load_record(self, record: Record) -> TargetClass:
+        keys = tuple(record)
+        build = self._compiled_builders.get(keys)
+        if build is None:
+            build = self._compile_builder(keys)
+            if len(self._compiled_builders) < __class__.MAX_COMPILED_BUILDERS:
+                self._compiled_builders[keys] = build
+        return build(record)
+
+    def _load_record_generic(self, record: Record) -> TargetClass:
         kwargs = {
             key: self._apply_strategy(self._select_strategy(key), key, value, record)
             for key, value in record.items()
         }
         return self.target_builder(**kwargs)
 
+    def _compile_builder(self, keys: tuple) -> Callable[[Record], TargetClass]:
+        """Returns a function loading records with given keys (in given order):
+        strategies are selected once, identity strategies are skipped
+        and the others are called directly"""
+        if type(self)._apply_strategy is not Loader._apply_strategy:
+            # NOTE: a subclass wants to see every single value
+            return self._load_record_generic
+        transformations = []
+        for key in keys:
+            strategy = self._select_strategy(key)
+            if strategy is not no_transformation:
+                transformations.append((key, strategy))
+        target_builder = self.target_builder
+        load_record = self.load_record
+        if not transformations:
+            return lambda record: target_builder(**record)
+
+        def build(record: Record) -> TargetClass:
+            kwargs = dict(record)
+            for key, strategy in transformations:
+                kwargs[key] = strategy(
+                    kwargs[key],
+                    property=key,
+                    record=record,
+                    target_class=target_builder,
+                    load_record=load_record,
+                )
+            return target_builder(**kwargs)
+
+        return build
+
     def _select_strategy(self, property: str) -> ValueTransformation:
         return self.strategies.get(property, self.default_strategy)
 
@@ -86,27 +163,117 @@ class Loader:
         )
 
 
-T = TypeVar("T")
+def naive_utc(date: datetime.datetime) -> datetime.datetime:
+    """Returns a timezone aware date as naive UTC (dates of stock are naive,
+    aware ones can't be compared with them nor stored in snapshots)"""
+    if date.tzinfo is None:
+        return date
+    return date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
 
 
-def tree_flattener(root: T, children_attr: str) -> Iterable[T]:
-    """Will traverse any tree and flatten it to an iterable"""
-    children = root.__getattribute__(children_attr)
-    if callable(children_attr):
-        children = children()  # in case children_attr is actually a method!
-    return itertools.chain(
-        [root],
-        itertools.chain.from_iterable(
-            tree_flattener(c, children_attr) for c in children
-        ),
-    )
+def parse_iso_date(text: str) -> datetime.datetime:
+    """Parses an ISO timestamp, one with a UTC offset as naive UTC"""
+    return naive_utc(datetime.datetime.fromisoformat(text))
 
 
-def forest_flattener(roots: Iterable[T], children_attr: str) -> Iterable[T]:
-    """Will traverse any forest and flatten to an iterable"""
-    return itertools.chain.from_iterable(
-        tree_flattener(root, children_attr) for root in roots
-    )
+def parse_fixed_layout(text: str) -> datetime.datetime:
+    """Parses "YYYY-MM-DD HH:MM:SS" by slicing fields at fixed offsets,
+    falls back to parse_iso_date for anything else"""
+    digits = text[0:4] + text[5:7] + text[8:10] + text[11:13] + text[14:16] + text[17:]
+    if (
+        len(text) == 19
+        and text[4] == text[7] == "-"
+        and text[10] in " T"
+        and text[13] == text[16] == ":"
+        and digits.isascii()
+        and digits.isdigit()
+    ):
+        return datetime.datetime(
+            int(text[0:4]),
+            int(text[5:7]),
+            int(text[8:10]),
+            int(text[11:13]),
+            int(text[14:16]),
+            int(text[17:19]),
+        )
+    return parse_iso_date(text)
+
+
+class CachedDateParser:
+    """ValueTransformation parsing ISO timestamps, which remembers maxsize
+    most recently parsed ones (feeds repeat timestamps a lot).
+    Items stocked at the same time also share a single datetime object"""
+
+    DEFAULT_MAXSIZE = 1 << 16
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_MAXSIZE,
+        parse: Callable[[str], datetime.datetime] = parse_iso_date,
+    ) -> None:
+        self.maxsize = maxsize
+        self.parse = parse
+        self._parse_cached = functools.lru_cache(maxsize=maxsize)(parse)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(maxsize={self.maxsize}, parse={self.parse})"
+
+    def __call__(self, value: str, **_kwargs) -> datetime.datetime:
+        return self._parse_cached(value)
+
+    def __reduce__(self):
+        # NOTE: the cache itself doesn't need to travel to worker processes
+        return (type(self), (self.maxsize, self.parse))
+
+    def cache_info(self):
+        return self._parse_cached.cache_info()
+
+
+T = TypeVar("T")
+
+
+def tree_flattener(
+    root: T, children_attr: str, order: str = "dfs", max_depth: int = None
+) -> Iterable[T]:
+    """Will traverse any tree and flatten it to an iterable"""
+    return forest_flattener([root], children_attr, order=order, max_depth=max_depth)
+
+
+def forest_flattener(
+    roots: Iterable[T], children_attr: str, order: str = "dfs", max_depth: int = None
+) -> Iterable[T]:
+    """Will traverse any forest and flatten to an iterable.
+    order is "dfs" (pre-order: every node is followed by its subtree)
+    or "bfs" (level by level), nodes deeper than max_depth (roots are 0) are skipped.
+    No recursion: the depth of the trees is not limited by the stack"""
+    # NOTE: checked right away, the generator itself only runs once iterated
+    if order not in ("dfs", "bfs"):
+        raise ValueError(f"Unknown order: {order}")
+    if max_depth is not None and max_depth < 0:
+        raise ValueError(f"max_depth can't be negative: {max_depth}")
+    return _flatten_forest(roots, children_attr, order, max_depth)
+
+
+def _flatten_forest(
+    roots: Iterable[T], children_attr: str, order: str, max_depth: Optional[int]
+) -> Iterator[T]:
+    pending = collections.deque((root, 0) for root in roots)
+    # NOTE: dfs takes nodes from the same end it puts children to (a stack)
+    take_next = pending.popleft if order == "bfs" else pending.pop
+    if order == "dfs":
+        pending.reverse()
+    while pending:
+        node, depth = take_next()
+        yield node
+        if max_depth is not None and depth >= max_depth:
+            continue
+        children = getattr(node, children_attr)
+        if callable(children):
+            children = children()  # in case children_attr is actually a method!
+        if order == "bfs":
+            pending.extend((child, depth + 1) for child in children)
+        else:
+            pending.extend((child, depth + 1) for child in reversed(list(children)))
 
 
 class PersonnelLoader(Loader):
@@ -137,17 +304,39 @@ class WarehouseLoader(Loader):
     # but I was feeling fancy
     WarehouseItem = collections.namedtuple("WarehouseItem", ["item", "warehouse"])
 
-    def __init__(self):
+    DEFAULT_CHUNK_SIZE = 10_000
+
+    def __init__(
+        self,
+        workers: int = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        strategies: Dict[str, ValueTransformation] = None,
+    ):
+        """With workers, records are loaded in chunks of chunk_size records
+        by that many processes (0 means one per CPU), otherwise in this process.
+        strategies replace the default ones for the same properties
+        (they are sent to the workers, so they have to be picklable)"""
         super().__init__(
             target_builder=self._build_warehouse_item,
             strategies={
-                "date_of_stock": lambda d, *_args, **_kwargs:
                 # parse date_of_stock to datetime
-                datetime.datetime.fromisoformat(d)
+                "date_of_stock": CachedDateParser(),
+                "state": intern_string,
+                "category": intern_string,
+                **(strategies or {}),
             },
             # don't just return items, group by warehouse instead!
             post_processor=self._group_by_warehouse,
         )
+        self.workers = os.cpu_count() if workers == 0 else workers
+        self.chunk_size = chunk_size
+        # NOTE: a copy, for the same reason as Loader.strategies
+        self._custom_strategies = dict(strategies) if strategies else None
+
+    def load_records(self, records: Iterable[Record]) -> Iterable[Warehouse]:
+        if self.workers and self.workers > 1:
+            return self._load_records_in_parallel(records)
+        return super().load_records(records)
 
     def _build_warehouse_item(self, **kwargs):
         return __class__.WarehouseItem(
@@ -155,22 +344,128 @@ class WarehouseLoader(Loader):
         )
 
     def _group_by_warehouse(self, warehouse_items):
-        # NOTE: this is neccesary because Warehouse.add_item is not helpful
-        def add_item(warehouse, i):
-            """Adds the actual item to a warehouse instance
-            and returns the warehouse"""
-            warehouse.add_item(i.item)
-            return warehouse
-
-        def build_warehouse(id, items):
-            """Given an id and iterable of decorated items
-            it will return a Warehouse with actual items"""
-            return functools.reduce(add_item, items, Warehouse(id))
-
-        def sorted_groupby(items, key):
-            """Because itertools.groupby doesn't work (as expected)
-            if the data is not sorted!"""
-            return itertools.groupby(sorted(items, key=key), key=key)
-
-        groupped_items = sorted_groupby(warehouse_items, key=lambda i: i.warehouse)
-        return (build_warehouse(id, items) for id, items in groupped_items)
+        """Appends every item to the stock of its warehouse as it arrives
+        (no sorting, no copy of all items), then yields warehouses by ID"""
+        stocks = {}
+        for warehouse_item in warehouse_items:
+            stock = stocks.get(warehouse_item.warehouse)
+            if stock is None:
+                stock = stocks[warehouse_item.warehouse] = []
+            stock.append(warehouse_item.item)
+        yield from _build_warehouses(stocks)
+
+    def load_chunks(self, records: Iterable[Record]) -> Iterator[dict[int, list[Item]]]:
+        """Yields { warehouse_id: [Item, ...] } of chunks of chunk_size records,
+        in order (loaded by the workers, if any), so that all items are never held
+        at once"""
+        if self.workers and self.workers > 1:
+            yield from self._map_chunks(_load_warehouse_chunk, records)
+            return
+        records = iter(records)
+        for chunk in iter(lambda: list(itertools.islice(records, self.chunk_size)), []):
+            partial = {}
+            for warehouse_item in map(self.load_record, chunk):
+                partial.setdefault(warehouse_item.warehouse, []).append(
+                    warehouse_item.item
+                )
+            yield partial
+
+    def _load_records_in_parallel(self, records):
+        """Workers turn chunks of records into { warehouse_id: [Item, ...] },
+        which are merged (in the order of chunks) into warehouses"""
+        stocks = {}
+        for partial in self._map_chunks(_load_warehouse_chunk, records):
+            for id, items in partial.items():
+                stocks.setdefault(id, []).extend(items)
+        return _build_warehouses(stocks)
+
+    def _map_chunks(self, function, records):
+        """Yields function(chunk) for chunks of records, in order, run by workers
+        which each build their loader once. Only a few chunks are in flight at once,
+        so records are consumed lazily"""
+        records = iter(records)
+        chunks = iter(lambda: list(itertools.islice(records, self.chunk_size)), [])
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_start_worker,
+            initargs=(type(self), self._custom_strategies),
+        ) as executor:
+            in_flight = collections.deque()
+            for chunk in chunks:
+                in_flight.append(executor.submit(function, chunk))
+                if len(in_flight) >= 2 * self.workers:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+
+def _build_warehouses(stocks: dict[int, list[Item]]) -> Iterable[Warehouse]:
+    return (Warehouse(id, stocks[id]) for id in sorted(stocks))
+
+
+# NOTE: pids of worker processes which have profiled a chunk already
+_profiled_workers = set()
+
+
+# NOTE: the loader of a worker process, built once by _start_worker,
+# so that its CachedDateParser is shared by all chunks of that worker
+_worker_loader = None
+
+
+def _start_worker(loader_class, strategies):
+    """Runs once in every worker process, before its first chunk"""
+    global _worker_loader
+    _worker_loader = loader_class(strategies=strategies)
+
+
+def _load_warehouse_chunk(records):
+    """Runs in a worker process, returns { warehouse_id: [Item, ...] }.
+    When profiling, the first chunk of each worker is profiled (they are all alike)"""
+    profiling = PROFILER.enabled and os.getpid() not in _profiled_workers
+    _profiled_workers.add(os.getpid())
+    with PROFILER.profile("load_warehouse_chunk") if profiling else nullcontext():
+        partial = {}
+        for warehouse_item in map(_worker_loader.load_record, records):
+            partial.setdefault(warehouse_item.warehouse, []).append(warehouse_item.item)
+    return partial
+
+
+def main(argv=None) -> None:
+    """Loads personnel and stock files,
+    profiled if asked to (or WAREHOUSE_PROFILE is set)"""
+    parser = argparse.ArgumentParser(description="Loads personnel and stock files")
+    directory = os.path.dirname(os.path.abspath(__file__))
+    parser.add_argument(
+        "--personnel-file",
+        default=os.path.join(directory, "personnel.json"),
+        help="personnel JSON file",
+    )
+    parser.add_argument(
+        "--stock-file",
+        default=os.path.join(directory, "stock.json"),
+        help="stock JSON file",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="worker processes (0 means one per CPU)"
+    )
+    parser.add_argument("--profile", metavar="MODES", help="cpu, memory or cpu,memory")
+    parser.add_argument("--profile-directory", help="where profiles are written")
+    arguments = parser.parse_args(argv)
+    if arguments.profile is not None:
+        PROFILER.configure(arguments.profile)
+        # NOTE: worker processes configure their profiler from the environment
+        os.environ["WAREHOUSE_PROFILE"] = arguments.profile
+    if arguments.profile_directory:
+        PROFILER.directory = arguments.profile_directory
+        os.environ["WAREHOUSE_PROFILE_DIRECTORY"] = arguments.profile_directory
+    for loader, file_name in [
+        (PersonnelLoader(), arguments.personnel_file),
+        (WarehouseLoader(workers=arguments.workers), arguments.stock_file),
+    ]:
+        with PROFILER.profile(f"{type(loader).__name__}.load_records"):
+            loaded = list(loader.load_records(JSONRecords(file_name)))
+        print(f"{type(loader).__name__}: {len(loaded)} loaded from {file_name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+import datetime
+import pickle
+import unittest
+import loader
+from classes import Employee
+from loader import (
+    CachedDateParser,
+    Loader,
+    PersonnelLoader,
+    WarehouseLoader,
+    forest_flattener,
+    no_transformation,
+    parse_fixed_layout,
+    tree_flattener,
+)
+
+
+class Point:
+    def __init__(self, x, y, label="") -> None:
+        self.x = x
+        self.y = y
+        self.label = label
+
+    def __eq__(self, other):
+        return (self.x, self.y, self.label) == (other.x, other.y, other.label)
+
+
+class TestLoader(unittest.TestCase):
+    def setUp(self) -> None:
+        self.calls = []
+
+        def double(value, property, record, target_class, load_record):
+            self.calls.append((value, property, record, target_class))
+            return value * 2
+
+        self.double = double
+        self.loader = Loader(strategies={"x": double}, target_builder=Point)
+
+    def test_load_record(self):
+        record = {"x": 1, "y": 2}
+        self.assertEqual(self.loader.load_record(record), Point(2, 2))
+        self.assertListEqual(self.calls, [(1, "x", record, Point)])
+
+    def test_load_records_with_different_keys(self):
+        self.assertListEqual(
+            list(
+                self.loader.load_records(
+                    [{"x": 1, "y": 2}, {"y": 3, "label": "a", "x": 4}, {"x": 5, "y": 6}]
+                )
+            ),
+            [Point(2, 2), Point(8, 3, "a"), Point(10, 6)],
+        )
+
+    def test_same_result_as_generic_loading(self):
+        record = {"x": 1, "y": 2, "label": "b"}
+        self.assertEqual(
+            self.loader.load_record(record), self.loader._load_record_generic(record)
+        )
+
+    def test_default_strategy(self):
+        loader = Loader(
+            strategies={"x": no_transformation},
+            default_strategy=lambda value, **_kwargs: -value,
+            target_builder=Point,
+        )
+        self.assertEqual(loader.load_record({"x": 1, "y": 2}), Point(1, -2))
+
+    def test_changed_strategies_are_used(self):
+        self.loader.load_record({"x": 1, "y": 2})
+        self.loader.strategies = {"y": self.double}
+        self.assertEqual(self.loader.load_record({"x": 1, "y": 2}), Point(1, 4))
+
+    def test_strategies_are_copied_and_read_only(self):
+        strategies = {"x": self.double}
+        loader = Loader(strategies=strategies, target_builder=Point)
+        self.assertEqual(loader.load_record({"x": 1, "y": 2}), Point(2, 2))
+        strategies["y"] = self.double
+        self.assertEqual(loader.load_record({"x": 1, "y": 2}), Point(2, 2))
+        with self.assertRaises(TypeError):
+            loader.strategies["y"] = self.double
+
+    def test_overridden_apply_strategy_is_called(self):
+        class CountingLoader(Loader):
+            applied = 0
+
+            def _apply_strategy(self, strategy, property, value, record):
+                __class__.applied += 1
+                return super()._apply_strategy(strategy, property, value, record)
+
+        loader = CountingLoader(strategies={}, target_builder=Point)
+        self.assertEqual(loader.load_record({"x": 1, "y": 2}), Point(1, 2))
+        self.assertEqual(CountingLoader.applied, 2)
+
+
+class TestDateParsing(unittest.TestCase):
+    def test_parse_fixed_layout(self):
+        for text in [
+            "2020-08-01 02:58:45",
+            "2020-08-01T02:58:45",
+            "2020-08-01 02:58:45.123456",
+            "2020-08-01",
+        ]:
+            with self.subTest(text=text):
+                self.assertEqual(
+                    parse_fixed_layout(text), datetime.datetime.fromisoformat(text)
+                )
+
+    def test_parse_fixed_layout_invalid(self):
+        for text in ["2020-13-01 02:58:45", "2020-08-01 +2:58:45", "yesterday"]:
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                parse_fixed_layout(text)
+
+    def test_parse_fixed_layout_checks_separators(self):
+        for text in ["2021/07/20 03:51:06", "2021-07-20 03-51-06"]:
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                parse_fixed_layout(text)
+
+    def test_cached_date_parser_shares_parsed_dates(self):
+        parse = CachedDateParser(maxsize=2)
+        first = parse("2020-08-01 02:58:45", property="date_of_stock")
+        self.assertEqual(first, datetime.datetime(2020, 8, 1, 2, 58, 45))
+        self.assertIs(parse("2020-08-01 02:58:45"), first)
+        self.assertEqual(parse.cache_info().hits, 1)
+
+    def test_cached_date_parser_is_bounded(self):
+        parse = CachedDateParser(maxsize=2)
+        for day in range(1, 10):
+            parse(f"2020-08-0{day} 02:58:45")
+        self.assertEqual(parse.cache_info().currsize, 2)
+
+    def test_cached_date_parser_converts_offsets_to_naive_utc(self):
+        for parse in (CachedDateParser(), CachedDateParser(parse=parse_fixed_layout)):
+            for text in ["2021-07-20T05:51:06+02:00", "2021-07-20 03:51:06+00:00"]:
+                with self.subTest(parse=parse, text=text):
+                    date = parse(text)
+                    self.assertIsNone(date.tzinfo)
+                    self.assertEqual(date, datetime.datetime(2021, 7, 20, 3, 51, 6))
+
+    def test_cached_date_parser_can_be_pickled(self):
+        parse = pickle.loads(pickle.dumps(CachedDateParser(10, parse_fixed_layout)))
+        self.assertEqual(parse.maxsize, 10)
+        self.assertIs(parse.parse, parse_fixed_layout)
+
+
+class Node:
+    def __init__(self, name, children=()) -> None:
+        self.name = name
+        self.children = list(children)
+
+    def get_children(self):
+        return iter(self.children)
+
+
+class TestFlatteners(unittest.TestCase):
+    #     a        e
+    #    / \       |
+    #   b   d      f
+    #   |
+    #   c
+    forest = [Node("a", [Node("b", [Node("c")]), Node("d")]), Node("e", [Node("f")])]
+
+    def names(self, nodes):
+        return "".join(node.name for node in nodes)
+
+    def test_tree_flattener_depth_first(self):
+        self.assertEqual(self.names(tree_flattener(self.forest[0], "children")), "abcd")
+
+    def test_forest_flattener_depth_first(self):
+        self.assertEqual(
+            self.names(forest_flattener(self.forest, "children")), "abcdef"
+        )
+
+    def test_forest_flattener_breadth_first(self):
+        self.assertEqual(
+            self.names(forest_flattener(self.forest, "children", order="bfs")), "aebdfc"
+        )
+
+    def test_forest_flattener_max_depth(self):
+        self.assertEqual(
+            self.names(forest_flattener(self.forest, "children", max_depth=1)), "abdef"
+        )
+        self.assertEqual(
+            self.names(forest_flattener(self.forest, "children", max_depth=0)), "ae"
+        )
+
+    def test_children_attr_can_be_a_method(self):
+        self.assertEqual(
+            self.names(forest_flattener(self.forest, "get_children")), "abcdef"
+        )
+
+    def test_invalid_arguments_raise_at_the_call(self):
+        with self.assertRaises(ValueError):
+            forest_flattener(self.forest, "children", order="random")
+        with self.assertRaises(ValueError):
+            tree_flattener(self.forest[0], "children", max_depth=-1)
+
+    def test_very_deep_tree(self):
+        root = node = Node(0)
+        for depth in range(1, 100_000):
+            child = Node(depth)
+            node.children.append(child)
+            node = child
+        self.assertEqual(sum(1 for _node in tree_flattener(root, "children")), 100_000)
+
+    def test_very_wide_tree(self):
+        root = Node("root", [Node(i) for i in range(100_000)])
+        nodes = list(tree_flattener(root, "children", order="bfs"))
+        self.assertEqual(len(nodes), 100_001)
+        self.assertEqual(nodes[-1].name, 99_999)
+
+
+class TestPersonnelLoader(unittest.TestCase):
+    def test_load_records_flattens_tree(self):
+        personnel = list(
+            PersonnelLoader().load_records(
+                [
+                    {
+                        "user_name": "Tomek",
+                        "password": "q",
+                        "head_of": [
+                            {"user_name": "Ania", "password": "hunter2", "head_of": []}
+                        ],
+                    },
+                    {"user_name": "Marc", "password": "janis"},
+                ]
+            )
+        )
+        self.assertTrue(all(isinstance(e, Employee) for e in personnel))
+        self.assertListEqual(
+            [e.is_named(n) for e, n in zip(personnel, ["Tomek", "Ania", "Marc"])],
+            [True, True, True],
+        )
+
+
+def _date_cache_hits(records):
+    loader._load_warehouse_chunk(records)
+    return loader._worker_loader.strategies["date_of_stock"].cache_info().hits
+
+
+class TestWarehouseLoader(unittest.TestCase):
+    records = [
+        {
+            "state": "Blue",
+            "category": "Remote control",
+            "warehouse": 3,
+            "date_of_stock": "2020-09-02 07:19:05",
+        },
+        {
+            "state": "Black",
+            "category": "Smartwatch",
+            "warehouse": 1,
+            "date_of_stock": "2021-07-20 03:51:06",
+        },
+        {
+            "state": "Brand new",
+            "category": "Remote control",
+            "warehouse": 3,
+            "date_of_stock": "2019-11-16 14:35:51",
+        },
+    ]
+
+    def test_load_records_groups_by_warehouse(self):
+        warehouses = list(WarehouseLoader().load_records(self.records))
+        self.assertListEqual([w.id for w in warehouses], [1, 3])
+        self.assertListEqual(
+            [[i.full_name() for i in w.stock] for w in warehouses],
+            [["Black Smartwatch"], ["Blue Remote control", "Brand new Remote control"]],
+        )
+
+    def test_records_are_consumed_only_when_warehouses_are_needed(self):
+        consumed = []
+
+        def records():
+            for record in self.records:
+                consumed.append(record)
+                yield record
+
+        warehouses = WarehouseLoader().load_records(records())
+        self.assertListEqual(consumed, [])
+        self.assertListEqual([w.id for w in warehouses], [1, 3])
+        self.assertListEqual(consumed, self.records)
+
+    def test_parallel_loading_gives_the_same_warehouses(self):
+        records = self.records * 5
+        serial = list(WarehouseLoader().load_records(records))
+        parallel = list(WarehouseLoader(workers=2, chunk_size=2).load_records(records))
+        self.assertListEqual([w.id for w in parallel], [w.id for w in serial])
+        for parallel_warehouse, serial_warehouse in zip(parallel, serial):
+            self.assertListEqual(parallel_warehouse.stock, serial_warehouse.stock)
+
+    def test_load_chunks(self):
+        for loader in (WarehouseLoader(chunk_size=2), WarehouseLoader(2, chunk_size=2)):
+            chunks = list(loader.load_chunks(self.records))
+            self.assertListEqual(
+                [
+                    {id: [i.full_name() for i in items] for id, items in chunk.items()}
+                    for chunk in chunks
+                ],
+                [
+                    {3: ["Blue Remote control"], 1: ["Black Smartwatch"]},
+                    {3: ["Brand new Remote control"]},
+                ],
+            )
+
+    def test_custom_strategies(self):
+        loader = WarehouseLoader(
+            strategies={"date_of_stock": CachedDateParser(parse=parse_fixed_layout)}
+        )
+        self.assertListEqual(
+            [w.stock for w in loader.load_records(self.records)],
+            [w.stock for w in WarehouseLoader().load_records(self.records)],
+        )
+
+    def test_parallel_loading_with_custom_strategies(self):
+        loader = WarehouseLoader(
+            workers=2,
+            chunk_size=1,
+            strategies={"state": CachedDateParser(parse=str.upper)},
+        )
+        self.assertListEqual(
+            [i.state for w in loader.load_records(self.records) for i in w.stock],
+            ["BLACK", "BLUE", "BRAND NEW"],
+        )
+
+    def test_workers_keep_their_date_parser(self):
+        loader = WarehouseLoader(workers=1, chunk_size=1)
+        hits = loader._map_chunks(_date_cache_hits, self.records[:1] * 3)
+        self.assertListEqual(list(hits), [0, 1, 2])
+
+    def test_parallel_loading_of_nothing(self):
+        self.assertListEqual(list(WarehouseLoader(workers=2).load_records([])), [])
+
+    def test_items_survive_pickling(self):
+        item = next(iter(WarehouseLoader().load_records(self.records))).stock[0]
+        copy = pickle.loads(pickle.dumps(item))
+        self.assertEqual(copy, item)
+        self.assertIs(copy.category, item.category)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Load generator for the session server, see: python cli/loadgen.py --help
+
+Runs many concurrent scripted sessions (list, search, browse and, for employees,
+order) and reports sessions and operations per second. Without --port it starts
+a server in the same process on a free port"""
+from __future__ import annotations
+import argparse
+import asyncio
+import itertools
+import random
+import statistics
+import time
+from app import DEFAULT_PERSONNEL_FILE, DEFAULT_STOCK_FILE, manager_from_environment
+from server import start_server
+
+OPERATION_PROMPT = "Type the number of the operation: "
+MAX_AMOUNT_PROMPT = "maximum amount"
+
+
+class SessionScript:
+    """Answers the prompts of one session, records latency of each operation"""
+
+    def __init__(self, arguments, item_names: list[str], session_number: int) -> None:
+        self.arguments = arguments
+        self.item_names = item_names
+        self.session_number = session_number
+        self.operations = itertools.chain(
+            (
+                random.choice("123") if arguments.operations != "order" else "2"
+                for _ in range(arguments.operations_per_session)
+            ),
+            ["4"],
+        )
+        self.latencies = []
+        self._started = None
+        self._password_sent = False
+
+    def answer(self, prompt: str) -> str:
+        """Returns the answer to the prompt which ends the text received so far"""
+        arguments = self.arguments
+        if prompt.endswith(OPERATION_PROMPT):
+            now = time.perf_counter()
+            if self._started is not None:
+                self.latencies.append(now - self._started)
+            self._started = now
+            return next(self.operations)
+        if prompt.endswith("Enter your name: "):
+            return arguments.user or f"Operator {self.session_number}"
+        if prompt.endswith("Enter name of the item: "):
+            return random.choice(self.item_names)
+        if prompt.endswith("(y/n): "):
+            return "y" if arguments.user or MAX_AMOUNT_PROMPT in prompt else "n"
+        if prompt.endswith("Password or press enter to quit: "):
+            # NOTE: asked again means a wrong password, give up instead of looping
+            answer = "" if self._password_sent else arguments.password or ""
+            self._password_sent = True
+            return answer
+        if prompt.endswith("How many would you like to order? "):
+            return "1"
+        if prompt.endswith("Type the number of category you want to browse: "):
+            return "1"
+        return None  # NOTE: not a prompt, more output is coming
+
+
+async def run_session(host, port, script: SessionScript) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    received = ""
+    try:
+        while chunk := await reader.read(1 << 16):
+            # NOTE: prompts are short, the tail of the output is enough
+            received = (received + chunk.decode())[-200:]
+            answer = script.answer(received)
+            if answer is not None:
+                writer.write(f"{answer}\n".encode())
+                received = ""
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def generate_load(arguments) -> dict:
+    manager = manager_from_environment(arguments.personnel_file, arguments.stock_file)
+    server = None
+    host, port = arguments.host, arguments.port
+    if not port:
+        server = await start_server(manager, host, 0)
+        port = server.sockets[0].getsockname()[1]
+    item_names = sorted(manager.get_unique_item_names()) + ["Missing item"]
+    scripts = [
+        SessionScript(arguments, item_names, number)
+        for number in range(arguments.sessions)
+    ]
+    limit = asyncio.Semaphore(arguments.concurrency)
+
+    async def session(script):
+        async with limit:
+            await run_session(host, port, script)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(script) for script in scripts))
+    seconds = time.perf_counter() - start
+    if server:
+        server.close()
+        await server.wait_closed()
+    latencies = sorted(latency for s in scripts for latency in s.latencies)
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+    return {
+        "sessions": len(scripts),
+        "operations": len(latencies),
+        "seconds": seconds,
+        "sessions_per_second": len(scripts) / seconds,
+        "operations_per_second": len(latencies) / seconds,
+        "p50_ms": quantiles[49] * 1000 if quantiles else None,
+        "p99_ms": quantiles[98] * 1000 if quantiles else None,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="localhost", help="server host")
+    parser.add_argument("--port", type=int, help="server port (default: in-process)")
+    parser.add_argument("--sessions", type=int, default=1000, help="sessions to run")
+    parser.add_argument(
+        "--concurrency", type=int, default=500, help="sessions open at once"
+    )
+    parser.add_argument(
+        "--operations-per-session", type=int, default=5, help="menu operations"
+    )
+    parser.add_argument(
+        "--operations",
+        choices=["mixed", "order"],
+        default="mixed",
+        help="random list/search/browse, or only search and order",
+    )
+    parser.add_argument("--user", help="log in as this employee (orders items)")
+    parser.add_argument("--password", help="password of the employee")
+    parser.add_argument(
+        "--personnel-file", default=DEFAULT_PERSONNEL_FILE, help="personnel JSON file"
+    )
+    parser.add_argument(
+        "--stock-file", default=DEFAULT_STOCK_FILE, help="stock JSON file"
+    )
+    arguments = parser.parse_args(argv)
+    for name, value in asyncio.run(generate_load(arguments)).items():
+        print(
+            f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+"""WarehouseManager answering queries by scanning a stock file mapped into memory
+
+The stock file (see stock_file) holds items as fixed-width records. Amounts, names
+and categories come from a single scan of it, without building any Item, queries
+returning items scan for the records they need and build Items only for those.
+
+With a snapshot, the stock file is the file next to it (warehouse.stock next to
+warehouse.snapshot): it is converted from the source files once and mapped by every
+process as long as they don't change. A StockFile converted beforehand
+(python cli/stock_file.py stock.json stock.bin) can be given as item_records instead.
+The file itself is never changed: the first change of stock loads all items as Python
+objects, from then on queries are answered as by WarehouseManager
+(save_snapshot writes them to the stock file next to the snapshot)"""
+from __future__ import annotations
+import bisect
+import collections
+import datetime
+import functools
+import inspect
+import os
+import threading
+import warnings
+from aggregation import GroupStatistics, mean_age, validate_statistics
+from ages import DEFAULT_BUCKETS
+from app import WarehouseManager
+from concurrency import reading, writing
+from index import NameMatch, NameSearch, normalize_name
+from loader import PersonnelLoader
+from metrics import timed
+from snapshot import EPOCH, MICROSECOND
+from stock_file import StockFile, StockFileWriter, convert
+from typing import Optional
+
+# built from the stock file on the first change of stock
+_MATERIALIZED_ATTRIBUTES = ("_stock", "_warehouses", "_index")
+
+
+def mapped_file(snapshot_file: str) -> str:
+    """Returns the name of the stock file kept next to given snapshot file"""
+    return f"{os.path.splitext(snapshot_file)[0]}.stock"
+
+
+def _microseconds(date: datetime.datetime) -> int:
+    return (date - EPOCH) // MICROSECOND
+
+
+def _scanning(method):
+    """Decorator of methods answering queries from the stock file, once the stock
+    is materialized, the method of WarehouseManager answers them instead"""
+    materialized = inspect.unwrap(getattr(WarehouseManager, method.__name__))
+
+    @functools.wraps(method)
+    def answer(self, *args, **kwargs):
+        if self.is_materialized:
+            return materialized(self, *args, **kwargs)
+        return method(self, *args, **kwargs)
+
+    return answer
+
+
+class StockSummary:
+    """What a single scan of a stock file tells: amounts (and dates) of items
+    of each name in each warehouse, that is all that counting queries need"""
+
+    def __init__(self, stock_file: StockFile) -> None:
+        strings = stock_file.strings
+        # (state id, category id, warehouse id)
+        # -> [count, min date, max date, sum of dates]
+        self.groups = stock_file.group_statistics()
+        self.full_names = {}  # (state id, category id) -> full name
+        # normalized name (or category) -> {(state id, category id), ...}
+        self.names = {}
+        self.names_of_category = {}
+        self.name_amounts = {}  # normalized name -> { warehouse_id: amount }
+        self.category_amounts = collections.Counter()
+        for (state, category, warehouse_id), (count, *_dates) in self.groups.items():
+            full_name = self.full_names.get((state, category))
+            if full_name is None:
+                full_name = f"{strings[state]} {strings[category]}"
+                self.full_names[state, category] = full_name
+                self.names.setdefault(normalize_name(full_name), set()).add(
+                    (state, category)
+                )
+                self.names_of_category.setdefault(strings[category], set()).add(
+                    (state, category)
+                )
+            amounts = self.name_amounts.setdefault(normalize_name(full_name), {})
+            amounts[warehouse_id] = amounts.get(warehouse_id, 0) + count
+            self.category_amounts[strings[category]] += count
+        self.name_search = NameSearch(dict.fromkeys(self.full_names.values()))
+
+
+class MappedWarehouseManager(WarehouseManager):
+    """WarehouseManager of a stock file mapped into memory
+    (see the module documentation).
+    Without a snapshot, item records are converted into a stock file in memory"""
+
+    GROUP_KEYS = ("full_name", "category", "state", "warehouse")
+
+    # built by _load() when any of them is used for the first time
+    _LAZY_ATTRIBUTES = ("_personnel", "_personnel_index", "_stock_file")
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if isinstance(self._item_records, StockFile):
+            self.stock_file_name = self._item_records.file_name
+        elif self._snapshot:
+            self.stock_file_name = mapped_file(self._snapshot.file_name)
+        else:
+            self.stock_file_name = None
+        # saved with the stock file (as with a snapshot), as of the last load or save
+        self._metadata = {}
+        self._summary = None
+        self._summary_lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(stock_file={self.stock_file_name!r})"
+
+    def __getattr__(self, name):
+        if name in _MATERIALIZED_ATTRIBUTES:
+            # NOTE: the file is mapped first (if not mapped yet), under the same lock
+            stock_file = self._stock_file
+            with self._load_lock:
+                if not self.is_materialized:
+                    self._materialize(stock_file)
+            return object.__getattribute__(self, name)
+        return super().__getattr__(name)
+
+    def close(self) -> None:
+        """Unmaps the stock file"""
+        if self.is_loaded:
+            self._stock_file.close()
+
+    @property
+    def is_loaded(self) -> bool:
+        return "_stock_file" in self.__dict__
+
+    @property
+    def is_materialized(self) -> bool:
+        """True once the stock is kept as Python objects (after its first change)"""
+        return "_stock" in self.__dict__
+
+    @timed()
+    def _load(self) -> None:
+        """Maps the stock file,
+        converting the item records to it first (unless up to date)"""
+        self._index_personnel(
+            list(PersonnelLoader().load_records(self._personnel_records))
+        )
+        if isinstance(self._item_records, StockFile):
+            stock_file = self._item_records
+        elif self._snapshot is None:
+            writer = StockFileWriter()
+            writer.add_chunks(self._warehouse_loader.load_chunks(self._item_records))
+            stock_file = StockFile(writer.to_buffer())
+        else:
+            stock_file = self._open_stock_file()
+        self._metadata = stock_file.metadata.get("metadata", {})
+        self._stock_file = stock_file
+        # NOTE: records are not needed anymore, let them be garbage collected
+        del self._personnel_records, self._item_records
+
+    def _open_stock_file(self) -> StockFile:
+        try:
+            stock_file = StockFile(self.stock_file_name)
+        except (OSError, ValueError):
+            pass  # NOTE: not converted yet (or in the layout of another version)
+        else:
+            if self._snapshot.is_up_to_date(stock_file.metadata.get("sources", [])):
+                return stock_file
+            stock_file.close()
+        convert(
+            self._item_records,
+            self.stock_file_name,
+            self._warehouse_loader,
+            {"sources": self._snapshot.fingerprints(), "metadata": {}},
+        )
+        return StockFile(self.stock_file_name)
+
+    def _materialize(self, stock_file: StockFile) -> None:
+        self._summary = None
+        self._index_stock(stock_file.load_warehouses())
+
+    @property
+    def summary(self) -> StockSummary:
+        stock_file = self._stock_file  # NOTE: this maps the file if needed
+        summary = self._summary
+        if summary is None:
+            # NOTE: readers run concurrently, only one of them scans the file
+            with self._summary_lock:
+                if self._summary is None:
+                    self._summary = StockSummary(stock_file)
+                summary = self._summary
+        return summary
+
+    def _names_of(self, item_name: str = None, category: str = None) -> Optional[set]:
+        """Returns {(state id, category id), ...} of items with a given name
+        or category, None (any) if neither is given"""
+        if item_name is not None:
+            return self.summary.names.get(normalize_name(item_name), set())
+        if category is not None:
+            return self.summary.names_of_category.get(category, set())
+        return None
+
+    def _selected_pairs(
+        self,
+        names: Optional[set],
+        stocked_until: int = None,
+        by_warehouse: bool = True,
+        limit: int = None,
+    ):
+        """Returns (warehouse_id, Item) of records found by StockFile.select,
+        ordered by StockFile.age_ordered"""
+        if names is not None and not names:
+            return iter(())  # NOTE: not in stock, nothing to scan for
+        stock_file = self._stock_file
+        return stock_file.pairs(
+            stock_file.age_ordered(
+                stock_file.select(names, stocked_until), by_warehouse, limit
+            )
+        )
+
+    @timed()
+    @writing
+    def save_snapshot(self, metadata: dict = None) -> None:
+        """Writes the stock file next to the snapshot with metadata
+        (with the stock as it is now, if it was changed)"""
+        if self._snapshot is None:
+            raise ValueError("There is no snapshot file to save to")
+        file_name = mapped_file(self._snapshot.file_name)
+        content = {"sources": self._snapshot.fingerprints(), "metadata": metadata or {}}
+        try:
+            if self.is_materialized:
+                writer = StockFileWriter()
+                writer.add_warehouses(self._stock)
+                writer.save(file_name, content)
+            else:
+                self._stock_file.save(file_name, content)
+        except OSError as error:
+            warnings.warn(f"Stock file {file_name} not saved: {error}")
+        self._metadata = content["metadata"]
+
+    @property
+    def snapshot_metadata(self) -> dict:
+        self._stock_file  # NOTE: maps the file, if not mapped yet
+        return self._metadata if self._snapshot else {}
+
+    @_scanning
+    def _all_items_in_warehouse_filtered(
+        self, source=lambda w: w.stock, filter=lambda _x: True
+    ):
+        # NOTE: there are no Warehouse objects with stock to take items from
+        return (
+            (warehouse_id, item)
+            for warehouse_id, item in self._all_items_with_warehouse_id()
+            if filter(item)
+        )
+
+    @_scanning
+    def _all_items_with_warehouse_id(self):
+        stock_file = self._stock_file
+        return stock_file.pairs(range(len(stock_file)))
+
+    @_scanning
+    def _all_named_items_with_warehouse_id(self, item_name):
+        return self._selected_pairs(self._names_of(item_name=item_name))
+
+    @_scanning
+    def _all_items_of_category_with_warehouse_id(self, category):
+        return self._selected_pairs(self._names_of(category=category))
+
+    @timed(items=len)
+    @reading
+    @_scanning
+    def search_item_names(self, query: str, limit: int = 10) -> list[NameMatch]:
+        return self.summary.name_search.search(query, limit)
+
+    @timed(items=len)
+    @reading
+    @_scanning
+    def get_items_older_than(
+        self, days: int, item_name: str = None, category: str = None, today=None
+    ) -> list[tuple]:
+        today = today if today is not None else datetime.datetime.today()
+        return list(
+            self._selected_pairs(
+                self._names_of(item_name, category),
+                _microseconds(today - datetime.timedelta(days=days)),
+                by_warehouse=False,
+            )
+        )
+
+    @timed(items=len)
+    @reading
+    @_scanning
+    def get_oldest_items(
+        self, amount: int, item_name: str = None, category: str = None
+    ) -> list[tuple]:
+        return list(
+            self._selected_pairs(
+                self._names_of(item_name, category), by_warehouse=False, limit=amount
+            )
+        )
+
+    @timed(items=len)
+    @reading
+    @_scanning
+    def get_age_histogram(
+        self,
+        buckets=DEFAULT_BUCKETS,
+        item_name: str = None,
+        category: str = None,
+        today=None,
+    ) -> dict[int, list[int]]:
+        bounds = sorted(buckets)
+        today = today if today is not None else datetime.datetime.today()
+        # NOTE: an item is in the bucket of the number of bounds it is at least
+        # as old as, that is of the number of these dates (oldest first)
+        # it was stocked until
+        until = [
+            _microseconds(today - datetime.timedelta(days=days))
+            for days in reversed(bounds)
+        ]
+        names = self._names_of(item_name, category)
+        if names is not None and not names:
+            return {}
+        stock_file = self._stock_file
+        histogram = {}
+        for _state, _category, warehouse_id, date in stock_file.rows_at(
+            stock_file.select(names)
+        ):
+            counts = histogram.get(warehouse_id)
+            if counts is None:
+                counts = histogram[warehouse_id] = [0] * (len(bounds) + 1)
+            counts[len(until) - bisect.bisect_left(until, date)] += 1
+        return dict(sorted(histogram.items()))
+
+    @timed()
+    @reading
+    @_scanning
+    def calculate_total_amount(self) -> int:
+        return len(self._stock_file)
+
+    @timed()
+    @reading
+    @_scanning
+    def calculate_item_amount_in_warehouse(self, id: int, item_name: str) -> int:
+        return self.summary.name_amounts.get(normalize_name(item_name), {}).get(id, 0)
+
+    @timed()
+    @reading
+    @_scanning
+    def calculate_item_total_amount(self, item_name: str = None) -> int:
+        return sum(
+            self.summary.name_amounts.get(normalize_name(item_name), {}).values()
+        )
+
+    @timed(items=len)
+    @reading
+    @_scanning
+    def get_unique_item_names(self) -> set:
+        return set(self.summary.full_names.values())
+
+    @timed(items=len)
+    @reading
+    @_scanning
+    def get_amount_of_item_in_each_warehouse(self, items: set) -> dict:
+        warehouse_ids = list(self._stock_file.warehouses)
+        amounts = {}
+        for item_name in items:
+            amounts_of_name = self.summary.name_amounts.get(
+                normalize_name(item_name), {}
+            )
+            amounts[item_name] = {
+                id: amounts_of_name.get(id, 0) for id in warehouse_ids
+            }
+        return amounts
+
+    @timed(items=len)
+    @reading
+    @_scanning
+    def get_unique_categories(self) -> set[str]:
+        return set(self.summary.category_amounts)
+
+    @timed(items=len)
+    @reading
+    @_scanning
+    def calculate_amount_of_items_in_category(
+        self, categories: set[str]
+    ) -> list[tuple]:
+        category_amounts = self.summary.category_amounts
+        return [
+            (category, category_amounts.get(category, 0)) for category in categories
+        ]
+
+    @timed(items=len)
+    @reading
+    @_scanning
+    def aggregate(
+        self, by=("full_name",), statistics=("count",), now=None, filter=None
+    ) -> dict:
+        keys = [by] if isinstance(by, str) or callable(by) else list(by)
+        if filter is not None or not all(key in self.GROUP_KEYS for key in keys):
+            # NOTE: arbitrary Python functions need Items,
+            # those of every record are built
+            return super().aggregate(by, statistics, now, filter)
+        validate_statistics(statistics)
+        now = now if now is not None else datetime.datetime.today()
+        strings = self._stock_file.strings
+        # NOTE: every key is a function of the name and the warehouse,
+        # groups of those (in order of first appearance in the stock,
+        # same as the Python path) are merged
+        groups = {}
+        for (state, category, warehouse_id), (
+            count,
+            min_date,
+            max_date,
+            dates,
+        ) in self.summary.groups.items():
+            values = {
+                "full_name": self.summary.full_names[state, category],
+                "category": strings[category],
+                "state": strings[state],
+                "warehouse": warehouse_id,
+            }
+            key = values[by] if isinstance(by, str) else tuple(values[k] for k in keys)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [count, min_date, max_date, dates]
+            else:
+                group[0] += count
+                group[1] = min(group[1], min_date)
+                group[2] = max(group[2], max_date)
+                group[3] += dates
+
+        def statistic(name, value):
+            return value if name in statistics else None
+
+        return {
+            key: GroupStatistics(
+                count=count,
+                min_date=statistic("min_date", EPOCH + min_date * MICROSECOND),
+                max_date=statistic("max_date", EPOCH + max_date * MICROSECOND),
+                mean_age=statistic(
+                    "mean_age",
+                    mean_age((now - EPOCH) * count - dates * MICROSECOND, count),
+                ),
+            )
+            for key, (count, min_date, max_date, dates) in groups.items()
+        }
@@ -0,0 +1,202 @@
+"""Timing of the hot paths: call counts, latency and numbers of items per operation
+
+Off unless WAREHOUSE_METRICS is set (or registry.enabled is set at runtime),
+while off a timed call costs a single attribute check.
+WAREHOUSE_METRICS_FILE (which also turns metrics on) names the file
+to export the metrics to, in the Prometheus text format"""
+from __future__ import annotations
+import collections
+import contextlib
+import functools
+import inspect
+import os
+import threading
+import time
+from typing import Callable, Iterator
+
+# NOTE: percentiles are of the most recent calls, memory stays bounded
+RECENT_CALLS = 1024
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Metric:
+    """Statistics of one operation"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.items = 0
+        self.recent = collections.deque(maxlen=RECENT_CALLS)
+
+    def __repr__(self) -> str:
+        return f"Metric({self.name!r}, calls={self.calls}, seconds={self.seconds:.6f})"
+
+    def record(self, seconds: float, items: int = None) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        self.recent.append(seconds)
+        if items is not None:
+            self.items += items
+
+    def quantile(self, q: float) -> float:
+        """Returns the q-quantile of recent call durations (in seconds),
+        None if never called"""
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = False, file_name: str = None) -> None:
+        self.enabled = enabled
+        self.file_name = file_name
+        self._metrics = {}
+        # NOTE: sessions of the server record from many threads
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(enabled={self.enabled}, "
+            f"metrics={len(self._metrics)})"
+        )
+
+    def record(self, name: str, seconds: float, items: int = None) -> None:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(name)
+            metric.record(seconds, items)
+
+    def metrics(self) -> list[Metric]:
+        """Returns all metrics recorded so far, by name"""
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._metrics.clear()
+
+    @contextlib.contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Times the block (if enabled)"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name: str = None, items: Callable = None) -> Callable:
+        """Decorator timing each call of the function (if enabled), as the metric name
+        (default is the qualified name of the function). items(result) is the number
+        of items the call dealt with, for example len.
+        Coroutine functions are timed until they return"""
+
+        def decorator(function: Callable) -> Callable:
+            metric_name = name or function.__qualname__
+
+            if inspect.iscoroutinefunction(function):
+
+                @functools.wraps(function)
+                async def timed_coroutine(*args, **kwargs):
+                    if not self.enabled:
+                        return await function(*args, **kwargs)
+                    start = time.perf_counter()
+                    result = await function(*args, **kwargs)
+                    self.record(
+                        metric_name,
+                        time.perf_counter() - start,
+                        items(result) if items else None,
+                    )
+                    return result
+
+                return timed_coroutine
+
+            @functools.wraps(function)
+            def timed_function(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                result = function(*args, **kwargs)
+                self.record(
+                    metric_name,
+                    time.perf_counter() - start,
+                    items(result) if items else None,
+                )
+                return result
+
+            return timed_function
+
+        return decorator
+
+    def report(self) -> list[dict]:
+        """Returns a row of statistics (durations in ms) for each metric"""
+        return [
+            {
+                "operation": metric.name,
+                "calls": metric.calls,
+                "total_ms": metric.seconds * 1000,
+                "mean_ms": metric.seconds / metric.calls * 1000,
+                **{
+                    f"p{round(q * 100)}_ms": metric.quantile(q) * 1000
+                    for q in QUANTILES
+                },
+                "items": metric.items,
+            }
+            for metric in self.metrics()
+        ]
+
+    def prometheus(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format"""
+        lines = [
+            "# HELP warehouse_operation_seconds Duration of warehouse operations.",
+            "# TYPE warehouse_operation_seconds summary",
+        ]
+        metrics = self.metrics()
+        for metric in metrics:
+            label = f'operation="{metric.name}"'
+            lines.extend(
+                f'warehouse_operation_seconds{{{label},quantile="{q}"}} '
+                f"{metric.quantile(q)!r}"
+                for q in QUANTILES
+            )
+            lines.append(
+                f"warehouse_operation_seconds_sum{{{label}}} {metric.seconds!r}"
+            )
+            lines.append(f"warehouse_operation_seconds_count{{{label}}} {metric.calls}")
+        lines.extend(
+            [
+                "# HELP warehouse_operation_items_total "
+                "Items returned or changed by warehouse operations.",
+                "# TYPE warehouse_operation_items_total counter",
+            ]
+        )
+        lines.extend(
+            f'warehouse_operation_items_total{{operation="{metric.name}"}} '
+            f"{metric.items}"
+            for metric in metrics
+        )
+        return "\n".join(lines) + "\n"
+
+    def export(self, file_name: str = None) -> None:
+        """Writes the Prometheus text format to the file (default is self.file_name),
+        atomically, so a collector never reads half of it"""
+        file_name = file_name or self.file_name
+        temporary_file_name = f"{file_name}.tmp"
+        with open(temporary_file_name, "w") as f:
+            f.write(self.prometheus())
+        os.replace(temporary_file_name, file_name)
+
+
+# NOTE: the registry of the process, configured by the environment
+REGISTRY = MetricsRegistry(
+    enabled=os.environ.get("WAREHOUSE_METRICS", "") not in ("", "0")
+    or bool(os.environ.get("WAREHOUSE_METRICS_FILE")),
+    file_name=os.environ.get("WAREHOUSE_METRICS_FILE"),
+)
+timed = REGISTRY.timed
+timer = REGISTRY.timer
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from metrics import MetricsRegistry
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = MetricsRegistry(enabled=True)
+
+    def test_disabled_records_nothing(self):
+        self.registry.enabled = False
+        timed_len = self.registry.timed("len")(len)
+        self.assertEqual(timed_len([1, 2]), 2)
+        with self.registry.timer("block"):
+            pass
+        self.assertListEqual(self.registry.metrics(), [])
+
+    def test_timed_counts_calls_and_items(self):
+        @self.registry.timed(items=len)
+        def search(name):
+            return [name] * 3
+
+        search("a")
+        search("b")
+        (metric,) = self.registry.metrics()
+        self.assertEqual(metric.name, search.__qualname__)
+        self.assertEqual(metric.calls, 2)
+        self.assertEqual(metric.items, 6)
+        self.assertGreater(metric.seconds, 0)
+
+    def test_timed_coroutine(self):
+        @self.registry.timed("operation")
+        async def operation():
+            await asyncio.sleep(0.01)
+            return "done"
+
+        self.assertEqual(asyncio.run(operation()), "done")
+        (metric,) = self.registry.metrics()
+        self.assertGreaterEqual(metric.seconds, 0.01)
+
+    def test_timer_and_report(self):
+        for _ in range(10):
+            with self.registry.timer("block"):
+                pass
+        (row,) = self.registry.report()
+        self.assertEqual(row["operation"], "block")
+        self.assertEqual(row["calls"], 10)
+        self.assertLessEqual(row["p50_ms"], row["p99_ms"])
+        self.assertAlmostEqual(row["mean_ms"] * 10, row["total_ms"])
+
+    def test_quantile(self):
+        for seconds in range(1, 101):
+            self.registry.record("operation", seconds)
+        (metric,) = self.registry.metrics()
+        self.assertEqual(metric.quantile(0.5), 51)
+        self.assertEqual(metric.quantile(0.99), 100)
+
+    def test_prometheus_export(self):
+        self.registry.record("Controller.operation_quit", 0.5, items=3)
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, "warehouse.prom")
+            self.registry.export(file_name)
+            self.assertListEqual(os.listdir(directory), ["warehouse.prom"])
+            with open(file_name) as f:
+                lines = f.read().splitlines()
+        self.assertIn("# TYPE warehouse_operation_seconds summary", lines)
+        self.assertIn(
+            'warehouse_operation_seconds{operation="Controller.operation_quit",'
+            'quantile="0.5"} 0.5',
+            lines,
+        )
+        self.assertIn(
+            "warehouse_operation_seconds_count"
+            '{operation="Controller.operation_quit"} 1',
+            lines,
+        )
+        self.assertIn(
+            'warehouse_operation_items_total{operation="Controller.operation_quit"} 3',
+            lines,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
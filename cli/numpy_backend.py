@@ -0,0 +1,341 @@
+from __future__ import annotations
+import datetime
+import functools
+import threading
+from aggregation import GroupStatistics, mean_age, validate_statistics
+from app import WarehouseManager
+from classes import Item, Warehouse
+from concurrency import reading
+from index import normalize_name
+from metrics import timed
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only this backend needs it
+    np = None
+
+# ages are summed in two parts to stay exact in float64 bincount weights
+_AGE_SPLIT_BITS = 20
+
+
+class StockColumns:
+    """Stock of many warehouses as NumPy arrays (one row per item)
+    in the order of WarehouseManager._all_items_with_warehouse_id.
+    String columns are stored as codes into lists of unique values"""
+
+    def __init__(self, warehouses: list[Warehouse]) -> None:
+        items = [item for warehouse in warehouses for item in warehouse.stock]
+        self.warehouse_ids = [warehouse.id for warehouse in warehouses]
+        self.warehouse_positions = {id: p for p, id in enumerate(self.warehouse_ids)}
+        self.warehouse_codes = np.repeat(
+            np.arange(len(warehouses), dtype=np.int64),
+            [warehouse.occupancy() for warehouse in warehouses],
+        )
+        self.full_names, self.full_name_codes = _encode(
+            item.full_name() for item in items
+        )
+        self.categories, self.category_codes = _encode(item.category for item in items)
+        self.states, self.state_codes = _encode(item.state for item in items)
+        self.names, name_of_full_name = _encode(
+            normalize_name(full_name) for full_name in self.full_names
+        )
+        self.name_positions = {name: p for p, name in enumerate(self.names)}
+        self.category_positions = {c: p for p, c in enumerate(self.categories)}
+        self.name_codes = name_of_full_name[self.full_name_codes]
+        self.dates = np.array(
+            [item.date_of_stock for item in items], dtype="datetime64[us]"
+        )
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def column(self, key: str) -> tuple:
+        """Returns (codes, values) of a column which can be grouped by"""
+        if key == "warehouse":
+            return self.warehouse_codes, self.warehouse_ids
+        if key == "full_name":
+            return self.full_name_codes, self.full_names
+        if key == "category":
+            return self.category_codes, self.categories
+        if key == "state":
+            return self.state_codes, self.states
+        raise KeyError(key)
+
+    @functools.cached_property
+    def name_counts(self):
+        """Matrix of amounts of items: normalized name x warehouse"""
+        shape = (len(self.names), len(self.warehouse_ids))
+        return np.bincount(
+            self.name_codes * shape[1] + self.warehouse_codes,
+            minlength=shape[0] * shape[1],
+        ).reshape(shape)
+
+    @functools.cached_property
+    def category_counts(self):
+        return np.bincount(self.category_codes, minlength=len(self.categories))
+
+    @functools.cached_property
+    def state_ranks(self):
+        """Position of each state in the sorted list of states"""
+        ranks = np.empty(len(self.states), dtype=np.int64)
+        ranks[sorted(range(len(self.states)), key=self.states.__getitem__)] = np.arange(
+            len(self.states)
+        )
+        return ranks
+
+    def age_ordered(self, rows):
+        """Returns rows ordered like the items of StockIndex:
+        by warehouse, then by index.age_order"""
+        return rows[
+            np.lexsort(
+                (
+                    self.state_ranks[self.state_codes[rows]],
+                    self.dates[rows],
+                    self.warehouse_codes[rows],
+                )
+            )
+        ]
+
+
+class NumpyWarehouseManager(WarehouseManager):
+    """WarehouseManager answering its queries with vectorized operations
+    on a columnar copy of the stock (see StockColumns).
+    The columns are rebuilt on the first query after the stock changes"""
+
+    GROUP_KEYS = ("full_name", "category", "state", "warehouse")
+
+    def __init__(self, *args, **kwargs) -> None:
+        if np is None:
+            raise ImportError(f"{type(self).__name__} requires NumPy")
+        super().__init__(*args, **kwargs)
+        self._columns_lock = threading.Lock()
+
+    def _load(self) -> None:
+        self._columns = None
+        super()._load()
+
+    def _index_stock(self, stock: list[Warehouse]) -> None:
+        for warehouse in stock:
+            warehouse.add_listener(self)
+        super()._index_stock(stock)
+
+    def _register_warehouse(self, warehouse: Warehouse) -> None:
+        super()._register_warehouse(warehouse)
+        warehouse.add_listener(self)
+        self._columns = None
+
+    def item_added(self, warehouse: Warehouse, item: Item) -> None:
+        self._columns = None
+
+    def item_removed(self, warehouse: Warehouse, item: Item) -> None:
+        self._columns = None
+
+    def items_removed(self, warehouse: Warehouse, items: list[Item]) -> None:
+        self._columns = None
+
+    @property
+    def columns(self) -> StockColumns:
+        stock = self._stock  # NOTE: this loads the data if needed
+        columns = self._columns
+        if columns is None:
+            # NOTE: readers run concurrently, only one of them builds the columns
+            # (writers, which invalidate them, run alone)
+            with self._columns_lock:
+                if self._columns is None:
+                    self._columns = StockColumns(stock)
+                columns = self._columns
+        return columns
+
+    @timed()
+    @reading
+    def calculate_total_amount(self) -> int:
+        return len(self.columns)
+
+    @timed()
+    @reading
+    def calculate_item_amount_in_warehouse(self, id: int, item_name: str) -> int:
+        columns = self.columns
+        name = columns.name_positions.get(normalize_name(item_name))
+        warehouse = columns.warehouse_positions.get(id)
+        if name is None or warehouse is None:
+            return 0
+        return int(columns.name_counts[name, warehouse])
+
+    @timed()
+    @reading
+    def calculate_item_total_amount(self, item_name: str = None) -> int:
+        columns = self.columns
+        name = columns.name_positions.get(normalize_name(item_name))
+        return 0 if name is None else int(columns.name_counts[name].sum())
+
+    @timed(items=len)
+    @reading
+    def get_unique_item_names(self) -> set:
+        return set(self.columns.full_names)
+
+    @timed(items=len)
+    @reading
+    def get_amount_of_item_in_each_warehouse(self, items: set) -> dict:
+        columns = self.columns
+        no_items = [0] * len(columns.warehouse_ids)
+        amounts = {}
+        for item_name in items:
+            name = columns.name_positions.get(normalize_name(item_name))
+            counts = no_items if name is None else columns.name_counts[name].tolist()
+            amounts[item_name] = dict(zip(columns.warehouse_ids, counts))
+        return amounts
+
+    @timed(items=len)
+    @reading
+    def get_unique_categories(self) -> set[str]:
+        return set(self.columns.categories)
+
+    @timed(items=len)
+    @reading
+    def calculate_amount_of_items_in_category(
+        self, categories: set[str]
+    ) -> list[tuple]:
+        columns = self.columns
+        return [
+            (
+                category,
+                int(columns.category_counts[columns.category_positions[category]])
+                if category in columns.category_positions
+                else 0,
+            )
+            for category in categories
+        ]
+
+    @timed(items=len)
+    @reading
+    def get_all_items_of_category(self, category: str) -> list[tuple]:
+        columns = self.columns
+        if category not in columns.category_positions:
+            return []
+        rows = columns.age_ordered(
+            np.flatnonzero(
+                columns.category_codes == columns.category_positions[category]
+            )
+        )
+        return [
+            (columns.full_names[full_name], columns.warehouse_ids[warehouse])
+            for full_name, warehouse in zip(
+                columns.full_name_codes[rows].tolist(),
+                columns.warehouse_codes[rows].tolist(),
+            )
+        ]
+
+    @timed(items=len)
+    @reading
+    def get_days_in_warehouse(self, item_name: str, today=None) -> list[tuple]:
+        columns = self.columns
+        name = columns.name_positions.get(normalize_name(item_name))
+        if name is None:
+            return []
+        today = today if today is not None else datetime.datetime.today()
+        rows = columns.age_ordered(np.flatnonzero(columns.name_codes == name))
+        days = (np.datetime64(today, "us") - columns.dates[rows]) // np.timedelta64(
+            1, "D"
+        )
+        return [
+            (columns.warehouse_ids[warehouse], day)
+            for warehouse, day in zip(
+                columns.warehouse_codes[rows].tolist(), days.tolist()
+            )
+        ]
+
+    @timed(items=len)
+    @reading
+    def aggregate(
+        self, by=("full_name",), statistics=("count",), now=None, filter=None
+    ) -> dict:
+        keys = [by] if isinstance(by, str) or callable(by) else list(by)
+        if filter is not None or not all(key in self.GROUP_KEYS for key in keys):
+            # NOTE: arbitrary Python functions can't be vectorized
+            return super().aggregate(by, statistics, now, filter)
+        validate_statistics(statistics)
+        columns = self.columns
+        if not len(columns):
+            return {}
+
+        key_columns = [columns.column(key) for key in keys]
+        group_codes = np.zeros(len(columns), dtype=np.int64)
+        for codes, values in key_columns:
+            group_codes = group_codes * len(values) + codes
+        _groups, first_rows, inverse = np.unique(
+            group_codes, return_index=True, return_inverse=True
+        )
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse).tolist()
+
+        def key_of(row):
+            values = tuple(values[codes[row]] for codes, values in key_columns)
+            return values[0] if isinstance(by, str) else values
+
+        min_dates = max_dates = total_ages = None
+        if "min_date" in statistics or "max_date" in statistics:
+            min_dates, max_dates = _min_max_by_group(
+                columns.dates.view(np.int64), inverse, len(counts)
+            )
+        if "mean_age" in statistics:
+            now = now if now is not None else datetime.datetime.today()
+            total_ages = _sum_by_group(
+                np.datetime64(now, "us").astype(np.int64)
+                - columns.dates.view(np.int64),
+                inverse,
+                len(counts),
+            )
+
+        result = {}
+        # NOTE: groups in order of first appearance, same as the Python path
+        for group in np.argsort(first_rows, kind="stable").tolist():
+            result[key_of(first_rows[group])] = GroupStatistics(
+                count=counts[group],
+                min_date=_datetime(min_dates[group])
+                if "min_date" in statistics
+                else None,
+                max_date=_datetime(max_dates[group])
+                if "max_date" in statistics
+                else None,
+                mean_age=mean_age(
+                    datetime.timedelta(microseconds=total_ages[group]), counts[group]
+                )
+                if total_ages is not None
+                else None,
+            )
+        return result
+
+
+def _encode(values) -> tuple:
+    """Returns (list of unique values, array of codes into that list)"""
+    positions = {}
+    codes = np.fromiter(
+        (positions.setdefault(value, len(positions)) for value in values),
+        dtype=np.int64,
+    )
+    return list(positions), codes
+
+
+def _min_max_by_group(values, groups, number_of_groups) -> tuple:
+    minimums = np.full(number_of_groups, np.iinfo(np.int64).max, dtype=np.int64)
+    maximums = np.full(number_of_groups, np.iinfo(np.int64).min, dtype=np.int64)
+    np.minimum.at(minimums, groups, values)
+    np.maximum.at(maximums, groups, values)
+    return minimums.tolist(), maximums.tolist()
+
+
+def _sum_by_group(values, groups, number_of_groups) -> list[int]:
+    """Exact integer sums of int64 values per group"""
+    low_mask = (1 << _AGE_SPLIT_BITS) - 1
+    highs = np.bincount(
+        groups, weights=values >> _AGE_SPLIT_BITS, minlength=number_of_groups
+    )
+    lows = np.bincount(groups, weights=values & low_mask, minlength=number_of_groups)
+    return [
+        (int(high) << _AGE_SPLIT_BITS) + int(low)
+        for high, low in zip(highs.tolist(), lows.tolist())
+    ]
+
+
+def _datetime(microseconds: int) -> datetime.datetime:
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(microseconds=microseconds)
@@ -0,0 +1,233 @@
+"""Profiles of single slow runs, see: python cli/profiling.py --help
+
+Off unless WAREHOUSE_PROFILE is set to cpu, memory or cpu,memory (or app.py --profile).
+Then the startup load and each menu operation write a numbered cProfile
+file (.prof, readable by pstats or snakeviz) and/or a report of the top
+allocations (.memory.txt) to WAREHOUSE_PROFILE_DIRECTORY (default: profiles).
+The report command summarizes the hottest functions of all .prof files"""
+from __future__ import annotations
+import argparse
+import contextlib
+import cProfile
+import functools
+import glob
+import itertools
+import os
+import pstats
+import threading
+import tracemalloc
+from typing import Callable, Iterator
+
+DEFAULT_DIRECTORY = "profiles"
+MODULES = ("loader.py", "classes.py", "app.py")
+
+
+class Profiler:
+    """Profiles blocks of code, one at a time: a block profiled inside another one
+    (or in another thread meanwhile) is part of the outer profile,
+    not a profile of its own"""
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_DIRECTORY,
+        cpu: bool = False,
+        memory: bool = False,
+        top: int = 25,
+    ) -> None:
+        self.directory = directory
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self._numbers = itertools.count(1)
+        self._active = threading.Lock()
+        # NOTE: worker processes forked while loading is profiled profile on their own
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        self._active = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}({self.directory!r}, "
+            f"cpu={self.cpu}, memory={self.memory})"
+        )
+
+    @classmethod
+    def from_environment(cls) -> Profiler:
+        profiler = cls(os.environ.get("WAREHOUSE_PROFILE_DIRECTORY", DEFAULT_DIRECTORY))
+        profiler.configure(os.environ.get("WAREHOUSE_PROFILE", ""))
+        return profiler
+
+    def configure(self, modes: str) -> None:
+        """Turns profiling on as given by "cpu", "memory" or "cpu,memory"
+        ("" turns it off)"""
+        modes = {mode.strip() for mode in modes.split(",") if mode.strip()}
+        unknown = modes - {"cpu", "memory"}
+        if unknown:
+            raise ValueError(f"Unknown profile mode: {', '.join(sorted(unknown))}")
+        self.cpu = "cpu" in modes
+        self.memory = "memory" in modes
+
+    @property
+    def enabled(self) -> bool:
+        return self.cpu or self.memory
+
+    @contextlib.contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        """Profiles the block (if enabled),
+        writes <pid>-<number>-<name>.prof / .memory.txt"""
+        if not self.enabled or not self._active.acquire(blocking=False):
+            yield
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(
+                self.directory, f"{os.getpid()}-{next(self._numbers):03d}-{name}"
+            )
+            with self._tracing_memory(path, name), self._profiling_cpu(path):
+                yield
+        finally:
+            self._active.release()
+
+    @contextlib.contextmanager
+    def _profiling_cpu(self, path: str) -> Iterator[None]:
+        if not self.cpu:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(f"{path}.prof")
+
+    @contextlib.contextmanager
+    def _tracing_memory(self, path: str, name: str) -> Iterator[None]:
+        if not self.memory:
+            yield
+            return
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            after = tracemalloc.take_snapshot()
+            _current, peak = tracemalloc.get_traced_memory()
+            if started:
+                tracemalloc.stop()
+            # NOTE: the snapshots themselves are not interesting
+            ignored = (tracemalloc.Filter(False, tracemalloc.__file__),)
+            differences = after.filter_traces(ignored).compare_to(
+                before.filter_traces(ignored), "lineno"
+            )
+            with open(f"{path}.memory.txt", "w") as f:
+                f.write(f"{name}: peak {peak / 2**20:.1f} MiB traced\n")
+                f.write(f"Top {self.top} allocations still in use, by line:\n")
+                for difference in differences[: self.top]:
+                    f.write(f"{difference}\n")
+
+    def profiled(self, name: str = None) -> Callable:
+        """Decorator profiling each call of the function (if enabled)"""
+
+        def decorator(function: Callable) -> Callable:
+            profile_name = name or function.__qualname__
+
+            @functools.wraps(function)
+            def profiled_function(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self.profile(profile_name):
+                    return function(*args, **kwargs)
+
+            return profiled_function
+
+        return decorator
+
+
+def hottest_functions(
+    files: list[str], modules=MODULES, sort: str = "tottime", top: int = 25
+) -> list[tuple]:
+    """Returns (function, "module:line", calls, tottime, cumtime) of the functions
+    of given modules which took most time in all the profiles together"""
+    stats = pstats.Stats(*files)
+    rows = [
+        (
+            function,
+            f"{os.path.basename(file_name)}:{line}",
+            calls,
+            tottime,
+            cumtime,
+        )
+        for (file_name, line, function), (
+            _primitive_calls,
+            calls,
+            tottime,
+            cumtime,
+            _callers,
+        ) in stats.stats.items()
+        if os.path.basename(file_name) in modules
+    ]
+    rows.sort(key=lambda row: row[3 if sort == "tottime" else 4], reverse=True)
+    return rows[:top]
+
+
+def profile_files(paths: list[str]) -> list[str]:
+    """Returns the .prof files given, or found in given directories"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.prof"))))
+        else:
+            files.append(path)
+    return files
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser(
+        "report", help="hottest functions of the app in all given profiles together"
+    )
+    report.add_argument(
+        "paths",
+        nargs="*",
+        default=[DEFAULT_DIRECTORY],
+        help=".prof files or directories of them (default: profiles)",
+    )
+    report.add_argument(
+        "--sort",
+        choices=["tottime", "cumtime"],
+        default="tottime",
+        help="time in the function itself, or including what it calls",
+    )
+    report.add_argument("--top", type=int, default=25, help="number of functions")
+    report.add_argument(
+        "--modules",
+        nargs="+",
+        default=list(MODULES),
+        help="only functions of these files",
+    )
+    arguments = parser.parse_args(argv)
+    files = profile_files(arguments.paths)
+    if not files:
+        parser.error(f"no .prof files in {', '.join(arguments.paths)}")
+    print(
+        f"Hottest functions of {', '.join(arguments.modules)} in {len(files)} profiles:"
+    )
+    print(f"{'tottime':>10}{'cumtime':>10}{'calls':>12}  function")
+    for function, location, calls, tottime, cumtime in hottest_functions(
+        files, arguments.modules, arguments.sort, arguments.top
+    ):
+        print(f"{tottime:>10.3f}{cumtime:>10.3f}{calls:>12}  {function} ({location})")
+
+
+# NOTE: the profiler of the process, configured by the environment
+PROFILER = Profiler.from_environment()
+profiled = PROFILER.profiled
+
+if __name__ == "__main__":
+    main()
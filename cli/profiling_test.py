@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from profiling import Profiler, hottest_functions, profile_files
+
+
+def build_items(n):
+    return list(map(str, range(n)))
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.directory = self._directory.name
+        self.profiler = Profiler(self.directory, cpu=True)
+
+    def files(self):
+        return sorted(file.split("-", 1)[1] for file in os.listdir(self.directory))
+
+    def test_disabled_writes_nothing(self):
+        self.profiler.configure("")
+        with self.profiler.profile("operation"):
+            build_items(10)
+        self.assertListEqual(os.listdir(self.directory), [])
+
+    def test_configure(self):
+        self.profiler.configure("memory, cpu")
+        self.assertTrue(self.profiler.cpu and self.profiler.memory)
+        with self.assertRaises(ValueError):
+            self.profiler.configure("gpu")
+
+    def test_cpu_and_memory_profiles_are_numbered(self):
+        self.profiler.configure("cpu,memory")
+        with self.profiler.profile("load"):
+            items = build_items(10_000)
+        self.profiler.profiled("operation")(build_items)(10)
+        self.assertListEqual(
+            self.files(),
+            [
+                "001-load.memory.txt",
+                "001-load.prof",
+                "002-operation.memory.txt",
+                "002-operation.prof",
+            ],
+        )
+        (memory_report,) = [
+            file
+            for file in os.listdir(self.directory)
+            if file.endswith("load.memory.txt")
+        ]
+        with open(os.path.join(self.directory, memory_report)) as f:
+            report = f.read()
+        self.assertIn("load: peak", report)
+        self.assertIn("profiling_test.py", report)
+        del items
+
+    def test_nested_block_is_part_of_the_outer_profile(self):
+        with self.profiler.profile("outer"):
+            with self.profiler.profile("inner"):
+                build_items(10)
+        self.assertListEqual(self.files(), ["001-outer.prof"])
+
+    def test_hottest_functions(self):
+        with self.profiler.profile("operation"):
+            build_items(1000)
+        files = profile_files([self.directory])
+        self.assertEqual(len(files), 1)
+        rows = hottest_functions(files, modules=["profiling_test.py"])
+        self.assertListEqual(
+            [
+                (function, location.split(":")[0], calls)
+                for function, location, calls, *_ in rows
+            ],
+            [("build_items", "profiling_test.py", 1)],
+        )
+        self.assertListEqual(hottest_functions(files, modules=["app.py"]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
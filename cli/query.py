@@ -0,0 +1,340 @@
+"""Non-interactive access to the warehouse, see: python cli/query.py --help
+
+Ordering needs an employee: WAREHOUSE_USER and WAREHOUSE_PASSWORD environment
+variables (whichever is missing is asked for, stdout is left for the results).
+Orders change the stock kept in the snapshot (see WAREHOUSE_SNAPSHOT), so later
+queries see them until the stock file changes; the stock file itself is never changed"""
+from __future__ import annotations
+import argparse
+import csv
+import getpass
+import json
+import os
+import sys
+from ages import DEFAULT_BUCKETS, bucket_labels
+from allocation import ALLOCATION_POLICIES, OrderResult
+from app import DEFAULT_PERSONNEL_FILE, DEFAULT_STOCK_FILE, manager_from_environment
+from classes import Employee
+from datetime import datetime
+from json_records import iter_json_records
+from typing import Iterable, Iterator, TextIO
+
+
+def read_orders(file_name: str) -> Iterator[tuple[str, int]]:
+    """Yields (item_name, amount) orders from a CSV file (with a header)
+    or a JSON / JSON Lines file of {"item_name": ..., "amount": ...} records"""
+    if file_name.lower().endswith(".csv"):
+        with open(file_name, newline="") as f:
+            for record in csv.DictReader(f):
+                yield record["item_name"], int(record["amount"])
+    else:
+        for record in iter_json_records(file_name):
+            yield record["item_name"], int(record["amount"])
+
+
+def order_rows(results: Iterable[OrderResult]) -> Iterator[dict]:
+    for result in results:
+        yield {
+            "item_name": result.item_name,
+            "amount": result.amount,
+            "status": result.status,
+            "ordered": len(result.allocation),
+            "warehouses": result.amounts_by_warehouse(),
+        }
+
+
+def write_json(rows: Iterable[dict], columns: list[str], file: TextIO) -> None:
+    """Writes rows as a JSON array, one row per line, as they come"""
+    del columns  # rows are self-describing
+    file.write("[")
+    separator = "\n"
+    for row in rows:
+        file.write(separator)
+        json.dump(row, file)
+        separator = ",\n"
+    file.write("\n]\n")
+
+
+def write_csv(rows: Iterable[dict], columns: list[str], file: TextIO) -> None:
+    """Writes rows as CSV with a header,
+    values which are not scalars are JSON encoded"""
+    writer = csv.writer(file)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(
+            json.dumps(value) if isinstance(value, (dict, list)) else value
+            for value in (row[column] for column in columns)
+        )
+
+
+WRITERS = {"json": write_json, "csv": write_csv}
+
+
+def log_in(manager) -> Employee:
+    """Returns the employee authenticated by WAREHOUSE_USER and WAREHOUSE_PASSWORD,
+    raises PermissionError if there is no such employee or the password is wrong"""
+    user_name = os.environ.get("WAREHOUSE_USER")
+    if user_name is None:
+        sys.stderr.write("Enter your name: ")
+        user_name = sys.stdin.readline().strip()
+    password = os.environ.get("WAREHOUSE_PASSWORD")
+    if password is None:
+        password = getpass.getpass("Password: ")
+    employee = manager.get_employee(user_name)
+    if employee is None or not employee.authenticate(password):
+        raise PermissionError(
+            f"can't log in as {user_name!r}, only employees can order"
+        )
+    return employee
+
+
+def item_rows(items: Iterable[tuple], today: datetime = None) -> Iterator[dict]:
+    today = today or datetime.today()
+    for warehouse_id, item in items:
+        yield {
+            "warehouse": warehouse_id,
+            "item_name": item.full_name(),
+            "state": item.state,
+            "category": item.category,
+            "date_of_stock": str(item.date_of_stock),
+            "days_in_warehouse": (today - item.date_of_stock).days,
+        }
+
+
+def command_list(manager, arguments) -> Iterator[dict]:
+    if arguments.amounts:
+        # NOTE: a single pass over the stock, just like "List all items" of the menu
+        for item_name, amounts in manager.get_item_amounts_by_warehouse().items():
+            for warehouse_id in sorted(amounts):
+                yield {
+                    "item_name": item_name,
+                    "warehouse": warehouse_id,
+                    "amount": amounts[warehouse_id],
+                }
+    else:
+        yield from item_rows(manager.iter_items())
+
+
+def command_search(manager, arguments) -> Iterator[dict]:
+    return item_rows(manager.iter_items(item_name=arguments.name))
+
+
+def command_suggest(manager, arguments) -> Iterator[dict]:
+    for match in manager.search_item_names(arguments.query, arguments.limit):
+        yield {
+            "item_name": match.name,
+            "match": match.kind,
+            "distance": match.distance,
+            "amount": manager.calculate_item_total_amount(match.name),
+        }
+
+
+def command_categories(manager, arguments) -> Iterator[dict]:
+    for category, amount in sorted(manager.get_categories_with_amount()):
+        yield {"category": category, "amount": amount}
+
+
+def command_category(manager, arguments) -> Iterator[dict]:
+    return item_rows(manager.iter_items(category=arguments.name))
+
+
+def command_stale(manager, arguments) -> Iterator[dict]:
+    today = datetime.today()
+    return item_rows(
+        manager.get_items_older_than(
+            arguments.days, arguments.name, arguments.category, today
+        ),
+        today,
+    )
+
+
+def command_oldest(manager, arguments) -> Iterator[dict]:
+    return item_rows(
+        manager.get_oldest_items(arguments.amount, arguments.name, arguments.category)
+    )
+
+
+def command_ages(manager, arguments) -> Iterator[dict]:
+    labels = bucket_labels(arguments.buckets)
+    histogram = manager.get_age_histogram(
+        arguments.buckets, arguments.name, arguments.category
+    )
+    for warehouse_id, amounts in histogram.items():
+        for label, amount in zip(labels, amounts):
+            yield {"warehouse": warehouse_id, "age_days": label, "amount": amount}
+
+
+def place_orders(
+    manager, orders: Iterable[tuple[str, int]], policy: str = None
+) -> list[OrderResult]:
+    """Places the orders and saves the changed stock to the snapshot,
+    without a snapshot the orders are only simulated (and stderr says so)"""
+    results = manager.place_orders(orders, policy=policy)
+    if manager.has_snapshot:
+        # NOTE: metadata (e.g. how far a delta feed was applied) stays as it is
+        manager.save_snapshot(manager.snapshot_metadata)
+    else:
+        print(
+            "Orders are simulated, nothing is saved without a snapshot "
+            "(WAREHOUSE_SNAPSHOT is empty)",
+            file=sys.stderr,
+        )
+    return results
+
+
+def command_order(manager, arguments) -> Iterator[dict]:
+    log_in(manager)
+    return order_rows(
+        place_orders(
+            manager, [(arguments.name, arguments.amount)], policy=arguments.policy
+        )
+    )
+
+
+def command_orders(manager, arguments) -> Iterator[dict]:
+    log_in(manager)
+    return order_rows(
+        place_orders(manager, read_orders(arguments.file), policy=arguments.policy)
+    )
+
+
+ITEM_COLUMNS = [
+    "warehouse",
+    "item_name",
+    "state",
+    "category",
+    "date_of_stock",
+    "days_in_warehouse",
+]
+AMOUNT_COLUMNS = ["item_name", "warehouse", "amount"]
+CATEGORY_COLUMNS = ["category", "amount"]
+SUGGESTION_COLUMNS = ["item_name", "match", "distance", "amount"]
+AGE_COLUMNS = ["warehouse", "age_days", "amount"]
+ORDER_COLUMNS = ["item_name", "amount", "status", "ordered", "warehouses"]
+
+
+def _add_policy_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--policy",
+        choices=sorted(ALLOCATION_POLICIES),
+        help="how items are chosen (default: WAREHOUSE_ALLOCATION_POLICY or fifo)",
+    )
+
+
+def _add_selection_arguments(parser: argparse.ArgumentParser) -> None:
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("--name", help="only items with this full name")
+    selection.add_argument("--category", help="only items of this category")
+
+
+def _buckets(text: str) -> list[int]:
+    try:
+        return sorted(int(days) for days in text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a list of days: {text!r}")
+
+
+def main(argv=None, output: TextIO = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--format", choices=sorted(WRITERS), default="json", help="output format"
+    )
+    parser.add_argument(
+        "--personnel-file", default=DEFAULT_PERSONNEL_FILE, help="personnel JSON file"
+    )
+    parser.add_argument(
+        "--stock-file", default=DEFAULT_STOCK_FILE, help="stock JSON file"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_ = commands.add_parser("list", help="list all items in stock")
+    list_.add_argument(
+        "--amounts",
+        action="store_true",
+        help="amounts of each item per warehouse instead of every single item",
+    )
+    list_.set_defaults(
+        run=command_list,
+        columns=lambda arguments: AMOUNT_COLUMNS if arguments.amounts else ITEM_COLUMNS,
+    )
+    search = commands.add_parser(
+        "search", help="items with a given name (case insensitive), oldest first"
+    )
+    search.add_argument("name", help="full name of the item, e.g. 'Blue Keyboard'")
+    search.set_defaults(run=command_search, columns=ITEM_COLUMNS)
+    suggest = commands.add_parser(
+        "suggest",
+        help="names of items in stock best matching a query: "
+        "words in any order, the last one maybe unfinished, typos allowed",
+    )
+    suggest.add_argument("query", help="e.g. 'remote', 'blue remote contrl'")
+    suggest.add_argument(
+        "--limit", type=int, default=10, help="number of names (default: 10)"
+    )
+    suggest.set_defaults(run=command_suggest, columns=SUGGESTION_COLUMNS)
+    categories = commands.add_parser(
+        "categories", help="all categories with the amount of items in each"
+    )
+    categories.set_defaults(run=command_categories, columns=CATEGORY_COLUMNS)
+    category = commands.add_parser(
+        "category", help="items of a given category, oldest first"
+    )
+    category.add_argument("name", help="name of the category, e.g. 'Keyboard'")
+    category.set_defaults(run=command_category, columns=ITEM_COLUMNS)
+    stale = commands.add_parser(
+        "stale", help="items in stock for at least a number of days, oldest first"
+    )
+    stale.add_argument("days", type=int, help="age in days")
+    _add_selection_arguments(stale)
+    stale.set_defaults(run=command_stale, columns=ITEM_COLUMNS)
+    oldest = commands.add_parser("oldest", help="a number of oldest items")
+    oldest.add_argument("amount", type=int, help="how many items")
+    _add_selection_arguments(oldest)
+    oldest.set_defaults(run=command_oldest, columns=ITEM_COLUMNS)
+    ages = commands.add_parser(
+        "ages", help="amounts of items of each age (in days) per warehouse"
+    )
+    ages.add_argument(
+        "--buckets",
+        type=_buckets,
+        default=list(DEFAULT_BUCKETS),
+        help="bounds of ages, comma separated "
+        f"(default: {','.join(map(str, DEFAULT_BUCKETS))})",
+    )
+    _add_selection_arguments(ages)
+    ages.set_defaults(run=command_ages, columns=AGE_COLUMNS)
+    order = commands.add_parser(
+        "order",
+        help="order an item, print the result "
+        "(saved to the snapshot, the stock file itself is not changed)",
+    )
+    order.add_argument("name", help="full name of the item")
+    order.add_argument("amount", type=int, help="how many to order")
+    _add_policy_argument(order)
+    order.set_defaults(run=command_order, columns=ORDER_COLUMNS)
+    orders = commands.add_parser(
+        "orders",
+        help="place all orders from a file, print the result of each "
+        "(saved to the snapshot, the stock file itself is not changed)",
+    )
+    orders.add_argument("file", help="CSV (item_name,amount) or JSON records of orders")
+    _add_policy_argument(orders)
+    orders.set_defaults(run=command_orders, columns=ORDER_COLUMNS)
+    arguments = parser.parse_args(argv)
+    columns = arguments.columns
+    if callable(columns):
+        columns = columns(arguments)
+    manager = manager_from_environment(arguments.personnel_file, arguments.stock_file)
+    try:
+        rows = arguments.run(manager, arguments)
+    except PermissionError as error:
+        parser.error(str(error))
+    WRITERS[arguments.format](rows, columns, output or sys.stdout)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except BrokenPipeError:
+        # NOTE: the reader (e.g. head) has seen enough, don't complain
+        # when the rest of the buffered output is flushed at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
@@ -0,0 +1,240 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import app
+import app_test
+from numpy_backend import np
+from query import main, read_orders
+
+
+@patch.dict(
+    os.environ,
+    {
+        "WAREHOUSE_SNAPSHOT": "",
+        "WAREHOUSE_BACKEND": "python",
+        "WAREHOUSE_USER": "Tomek",
+        "WAREHOUSE_PASSWORD": "q",
+    },
+)
+class TestQuery(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.personnel_file = self._write(
+            "personnel.json",
+            json.dumps(app_test.TestWarehouseManager.personnel_for_test_get_employee),
+        )
+        self.stock_file = self._write(
+            "stock.json",
+            json.dumps(app_test.TestWarehouseManager.warehouse_items_for_test),
+        )
+
+    def _write(self, file_name, content):
+        path = os.path.join(self._directory.name, file_name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def query(self, *argv):
+        output = io.StringIO()
+        main(
+            ["--personnel-file", self.personnel_file, "--stock-file", self.stock_file]
+            + list(argv),
+            output=output,
+        )
+        return output.getvalue()
+
+    def restart(self):
+        """Forgets loaded managers, as if the next query ran in a new process"""
+        app.WarehouseManager._instances.clear()
+
+    def test_read_orders_from_csv_and_json(self):
+        orders = [("Blue Remote control", 2), ("Black Smartwatch", 1)]
+        csv_file = self._write(
+            "orders.csv",
+            "item_name,amount\nBlue Remote control,2\nBlack Smartwatch,1\n",
+        )
+        json_file = self._write(
+            "orders.json",
+            json.dumps([{"item_name": name, "amount": n} for name, n in orders]),
+        )
+        self.assertListEqual(list(read_orders(csv_file)), orders)
+        self.assertListEqual(list(read_orders(json_file)), orders)
+
+    @patch("sys.stderr", new_callable=io.StringIO)
+    def test_orders_json(self, _stderr):
+        orders_file = self._write(
+            "orders.jsonl",
+            '{"item_name": "blue remote control", "amount": 5}\n'
+            '{"item_name": "Black Smartwatch", "amount": 1}\n',
+        )
+        self.assertListEqual(
+            json.loads(self.query("orders", orders_file)),
+            [
+                {
+                    "item_name": "blue remote control",
+                    "amount": 5,
+                    "status": "partial",
+                    "ordered": 4,
+                    "warehouses": {"1": 1, "2": 1, "3": 2},
+                },
+                {
+                    "item_name": "Black Smartwatch",
+                    "amount": 1,
+                    "status": "fulfilled",
+                    "ordered": 1,
+                    "warehouses": {"4": 1},
+                },
+            ],
+        )
+
+    @patch("sys.stderr", new_callable=io.StringIO)
+    def test_orders_csv(self, _stderr):
+        orders_file = self._write("orders.csv", "item_name,amount\nRed Book,1\n")
+        self.assertEqual(
+            self.query("--format", "csv", "orders", orders_file),
+            "item_name,amount,status,ordered,warehouses\r\n"
+            "Red Book,1,rejected,0,{}\r\n",
+        )
+
+    @patch("sys.stderr", new_callable=io.StringIO)
+    def test_orders_are_saved_to_the_snapshot(self, stderr):
+        orders_file = self._write(
+            "orders.csv", "item_name,amount\nBlue Remote control,3\n"
+        )
+        snapshot_file = os.path.join(self._directory.name, "warehouse.snapshot")
+        with patch.dict(os.environ, {"WAREHOUSE_SNAPSHOT": snapshot_file}):
+            self.assertEqual(
+                json.loads(self.query("orders", orders_file))[0]["ordered"], 3
+            )
+            self.restart()
+            self.assertEqual(
+                json.loads(self.query("orders", orders_file))[0]["ordered"], 1
+            )
+        self.assertEqual(stderr.getvalue(), "")
+
+    @patch("sys.stderr", new_callable=io.StringIO)
+    def test_the_same_order_twice_on_every_backend(self, _stderr):
+        for backend in sorted(app.BACKENDS):
+            if backend == "numpy" and np is None:
+                continue
+            snapshot_file = os.path.join(self._directory.name, f"{backend}.snapshot")
+            environment = {
+                "WAREHOUSE_BACKEND": backend,
+                "WAREHOUSE_SNAPSHOT": snapshot_file,
+            }
+            with self.subTest(backend=backend), patch.dict(os.environ, environment):
+                for ordered, left in [(3, 1), (1, 0)]:
+                    self.restart()
+                    (result,) = json.loads(
+                        self.query("order", "Blue Remote control", "3")
+                    )
+                    self.assertEqual(result["ordered"], ordered)
+                    self.restart()
+                    self.assertEqual(
+                        len(json.loads(self.query("search", "Blue Remote control"))),
+                        left,
+                    )
+
+    def test_list(self):
+        rows = json.loads(self.query("list"))
+        self.assertEqual(len(rows), 8)
+        self.assertDictEqual(
+            rows[0],
+            {
+                "warehouse": 1,
+                "item_name": "Blue Remote control",
+                "state": "Blue",
+                "category": "Remote control",
+                "date_of_stock": "2020-06-25 22:45:20",
+                "days_in_warehouse": rows[0]["days_in_warehouse"],
+            },
+        )
+
+    def test_list_amounts_csv(self):
+        self.assertEqual(
+            self.query("--format", "csv", "list", "--amounts").splitlines()[:4],
+            [
+                "item_name,warehouse,amount",
+                "Blue Remote control,1,1",
+                "Blue Remote control,2,1",
+                "Blue Remote control,3,2",
+            ],
+        )
+
+    def test_search(self):
+        rows = json.loads(self.query("search", "blue remote control"))
+        self.assertListEqual(
+            [(row["warehouse"], row["date_of_stock"]) for row in rows],
+            [
+                (1, "2020-06-25 22:45:20"),
+                (2, "2019-08-19 09:13:20"),
+                (3, "2020-09-02 07:19:05"),
+                (3, "2020-11-07 00:38:09"),
+            ],
+        )
+        self.assertEqual(self.query("search", "Red Book"), "[\n]\n")
+
+    def test_suggest(self):
+        self.assertEqual(
+            self.query(
+                "--format", "csv", "suggest", "blue remot contrl", "--limit", "1"
+            ),
+            "item_name,match,distance,amount\r\nBlue Remote control,fuzzy,2,4\r\n",
+        )
+
+    def test_stale_oldest_and_ages(self):
+        rows = json.loads(self.query("stale", "365", "--name", "blue remote control"))
+        self.assertListEqual([row["warehouse"] for row in rows], [2, 1, 3, 3])
+        rows = json.loads(self.query("oldest", "1", "--category", "Smartwatch"))
+        self.assertListEqual([row["item_name"] for row in rows], ["Black Smartwatch"])
+        self.assertEqual(
+            self.query("--format", "csv", "ages", "--buckets", "36500"),
+            "warehouse,age_days,amount\r\n"
+            "1,0-36499,1\r\n1,36500+,0\r\n2,0-36499,2\r\n2,36500+,0\r\n"
+            "3,0-36499,3\r\n3,36500+,0\r\n4,0-36499,2\r\n4,36500+,0\r\n",
+        )
+
+    def test_categories_and_category(self):
+        self.assertEqual(
+            self.query("--format", "csv", "categories"),
+            "category,amount\r\nRemote control,7\r\nSmartwatch,1\r\n",
+        )
+        rows = json.loads(self.query("category", "Smartwatch"))
+        self.assertListEqual(
+            [(row["warehouse"], row["item_name"]) for row in rows],
+            [(4, "Black Smartwatch")],
+        )
+
+    @patch("sys.stderr", new_callable=io.StringIO)
+    def test_order(self, stderr):
+        self.assertListEqual(
+            json.loads(self.query("order", "Blue Remote control", "1")),
+            [
+                {
+                    "item_name": "Blue Remote control",
+                    "amount": 1,
+                    "status": "fulfilled",
+                    "ordered": 1,
+                    "warehouses": {"2": 1},
+                }
+            ],
+        )
+        self.assertIn("Orders are simulated", stderr.getvalue())
+
+    @patch.dict(os.environ, {"WAREHOUSE_PASSWORD": "wrong"})
+    @patch("sys.stderr", new_callable=io.StringIO)
+    def test_order_needs_an_employee(self, stderr):
+        with self.assertRaises(SystemExit):
+            self.query("order", "Blue Remote control", "1")
+        self.assertIn("can't log in as 'Tomek'", stderr.getvalue())
+        self.assertEqual(
+            len(json.loads(self.query("search", "blue remote control"))), 4
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
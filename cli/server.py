@@ -0,0 +1,310 @@
+"""Warehouse sessions over TCP (or a Unix socket), see: python cli/server.py --help
+
+Each connection gets its own session (an AsyncController with its own user),
+all sessions share one loaded WarehouseManager. Try it with: nc localhost 8023"""
+from __future__ import annotations
+import argparse
+import asyncio
+import contextlib
+import copy
+import functools
+import io
+from app import (
+    ConsoleUserInterface,
+    Controller,
+    DEFAULT_PERSONNEL_FILE,
+    DEFAULT_STOCK_FILE,
+    SUGGESTIONS,
+    WarehouseManager,
+    manager_from_environment,
+)
+from classes import User
+from metrics import REGISTRY, timed
+from typing import Callable
+
+DEFAULT_PORT = 8023
+
+# NOTE: many operators connect at once (asyncio's default backlog is only 100)
+BACKLOG = 4096
+
+# how often metrics are exported to WAREHOUSE_METRICS_FILE while serving
+METRICS_EXPORT_SECONDS = 15
+
+
+class AsyncConsoleUserInterface(ConsoleUserInterface):
+    """ConsoleUserInterface of a network session: asking awaits a line from the client,
+    displaying runs the usual (printing) methods with their output sent to the client"""
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.reader = reader
+        self.writer = writer
+        # NOTE: each session prints to its own buffer, sys.stdout is left alone
+        self.output = io.StringIO()
+
+    async def input(self, prompt: str) -> str:
+        """Like input(), raises EOFError when the client is gone"""
+        self.writer.write(prompt.encode())
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise EOFError
+        return line.decode(errors="replace").rstrip("\r\n")
+
+    def render(self, display: Callable, *args) -> str:
+        """Returns whatever display(*args) prints (to self.output)"""
+        display(*args)
+        text = self.output.getvalue()
+        self.output.seek(0)
+        self.output.truncate()
+        return text
+
+    async def send(self, text: str) -> None:
+        self.writer.write(text.encode())
+        await self.writer.drain()
+
+    async def show(self, display: Callable, *args) -> None:
+        """Sends whatever display(*args) prints (to self.output) to the client"""
+        await self.send(self.render(display, *args))
+
+    async def ask_user_name(self) -> str:
+        return await self.input("\nEnter your name: ")
+
+    async def ask_for_operation(self) -> str:
+        valid_operations = ["1", "2", "3", "4"]
+        operation = await self.input("\nType the number of the operation: ")
+        while operation not in valid_operations:
+            await self.show(self.print_no_operation_error, operation)
+            await self.show(self.display_operations)
+            operation = await self.input("\nType the number of the operation: ")
+        return operation
+
+    async def ask_for_item_name(self) -> str:
+        return await self.input("\nEnter name of the item: ")
+
+    async def _ask_yes_or_no(self, question: str) -> bool:
+        action = await self.input(question)
+        while action not in ("y", "n"):
+            await self.show(self.print_no_operation_error, action)
+            action = await self.input(question)
+        return action == "y"
+
+    async def ask_if_user_want_to_order(self) -> bool:
+        return await self._ask_yes_or_no("\nDo you wanat to order? (y/n): ")
+
+    async def ask_for_password(self) -> str:
+        return await self.input("\nPassword or press enter to quit: ")
+
+    async def ask_how_much_to_order(self) -> int:
+        amount_to_order = await self.input("\nHow many would you like to order? ")
+        while not amount_to_order.isnumeric():
+            await self.show(self.print_input_not_valid)
+            amount_to_order = await self.input("\nHow many would you like to order? ")
+        return int(amount_to_order)
+
+    async def ask_if_user_want_to_order_max_amount(self, max_amount: int) -> bool:
+        return await self._ask_yes_or_no(
+            f"\nDo you want to order maximum amount ({max_amount})? (y/n): "
+        )
+
+    async def ask_for_number_of_category_to_browse(self) -> str:
+        return await self.input("\nType the number of category you want to browse: ")
+
+
+class AsyncController(Controller):
+    """Controller of one network session: the flow of Controller.main,
+    awaiting an AsyncConsoleUserInterface. Manager queries run in worker threads
+    (WarehouseManager is thread safe), so a long one doesn't stall other sessions"""
+
+    async def _query(self, method: Callable, *args):
+        return await asyncio.to_thread(method, *args)
+
+    async def _query_and_show(self, method: Callable, display: Callable, *args):
+        """Like _query, but display(result) is formatted in the same worker thread
+        (big results take a while to format too) and sent. Returns the result"""
+
+        def query_and_render():
+            result = method(*args)
+            return result, self.console.render(display, result)
+
+        result, text = await asyncio.to_thread(query_and_render)
+        await self.console.send(text)
+        return result
+
+    async def log_in(self):
+        while not self.user.is_authenticated:
+            password = await self.console.ask_for_password()
+            if password == "":
+                return False
+            self.user.authenticate(password)
+        return True
+
+    async def do_you_want_to_order(self):
+        if not await self.console.ask_if_user_want_to_order():
+            return False
+        return await self.log_in()
+
+    async def order(self, item_name, max_amount):
+        order_amount = await self.console.ask_how_much_to_order()
+        if order_amount <= max_amount:
+            return order_amount
+        await self.console.show(
+            self.console.print_not_enough_items_in_stock, max_amount, item_name
+        )
+        if await self.console.ask_if_user_want_to_order_max_amount(max_amount):
+            return max_amount
+
+    async def _welcome_user(self):
+        user_name = await self.console.ask_user_name()
+        employee = await self._query(self.manager.get_employee, user_name)
+        # NOTE: employees are shared by all sessions, logging in must stay in this one
+        self.user = copy.copy(employee) if employee else User(user_name)
+        await self.console.show(self.console.greet_user, self.user)
+
+    async def _main_menu(self):
+        await self.console.show(self.console.display_operations)
+        return await self.console.ask_for_operation()
+
+    @timed()
+    async def operation_list_items_by_warehouse(self):
+        amounts = await self._query_and_show(
+            self.manager.get_item_amounts_by_warehouse, self.console.display_items
+        )
+        amount_of_all_items = sum(sum(a.values()) for a in amounts.values())
+        self._actions.append(f"You have listed all {amount_of_all_items} items")
+
+    @timed()
+    async def operation_search_an_item_and_place_an_order(self):
+        item_name = await self.console.ask_for_item_name()
+        items_list = await self._query_and_show(
+            self.manager.get_items_named, self.console.display_search_result, item_name
+        )
+        if items_list:
+            item_name = items_list[0][1].full_name()
+        self._actions.append(f"You have searched for {item_name}")
+        if not items_list:
+            matches = await self._query(
+                self.manager.search_item_names, item_name, SUGGESTIONS
+            )
+            await self.console.show(self.console.display_suggestions, matches)
+            return
+        if not await self.do_you_want_to_order():
+            await self.console.show(self.console.print_order_cancelled)
+            return
+        if not self.user.is_authenticated:
+            return
+        ordered_number = await self.order(item_name, len(items_list))
+        if ordered_number:
+            removed = await self._query(
+                self.manager.remove_ordered_items, item_name, ordered_number
+            )
+            await self.console.show(self.console.print_order, len(removed), item_name)
+            self._actions.append(f"You have ordered {len(removed)} {item_name}")
+        else:
+            await self.console.show(self.console.print_order_cancelled)
+
+    @timed()
+    async def operation_browse_by_category(self):
+        category_and_amount = await self._query(self.manager.get_categories_with_amount)
+        categories_numbered = {
+            f"{id}": item for id, item in enumerate(category_and_amount, 1)
+        }
+        await self.console.show(self.console.display_categories, categories_numbered)
+        number = await self.console.ask_for_number_of_category_to_browse()
+        if number in categories_numbered:
+            category, _ = categories_numbered[number]
+            await self._query_and_show(
+                self.manager.get_all_items_of_category,
+                functools.partial(self.console.display_all_items_of_category, category),
+                category,
+            )
+            self._actions.append(f"You have searched for category: {category}")
+
+    @timed()
+    async def operation_quit(self):
+        # NOTE: the same goodbye as Controller, metrics are exported by serve
+        text = await asyncio.to_thread(self.console.render, self._say_goodbye)
+        await self.console.send(text)
+
+    async def main(self):
+        await self._welcome_user()
+        operations = {
+            "1": self.operation_list_items_by_warehouse,
+            "2": self.operation_search_an_item_and_place_an_order,
+            "3": self.operation_browse_by_category,
+        }
+        while (operation_number := await self._main_menu()) != "4":
+            await operations[operation_number]()
+        await self.operation_quit()
+
+
+async def handle_session(
+    manager: WarehouseManager,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+) -> None:
+    controller = AsyncController(
+        manager=manager, console=AsyncConsoleUserInterface(reader, writer)
+    )
+    try:
+        await controller.main()
+    except (EOFError, ConnectionError):
+        pass  # NOTE: the client went away in the middle of the session
+    finally:
+        writer.close()
+        with contextlib.suppress(ConnectionError):
+            await writer.wait_closed()
+
+
+async def start_server(
+    manager: WarehouseManager, host: str = None, port: int = None, path: str = None
+) -> asyncio.AbstractServer:
+    """Starts serving sessions on a Unix socket (path) or TCP (host, port),
+    loads the manager first, so that the first session doesn't wait for it"""
+    await asyncio.to_thread(manager.calculate_total_amount)
+    handler = functools.partial(handle_session, manager)
+    if path:
+        return await asyncio.start_unix_server(handler, path, backlog=BACKLOG)
+    return await asyncio.start_server(handler, host, port, backlog=BACKLOG)
+
+
+async def serve(arguments) -> None:
+    manager = manager_from_environment(arguments.personnel_file, arguments.stock_file)
+    server = await start_server(manager, arguments.host, arguments.port, arguments.unix)
+    sockets = ", ".join(str(socket.getsockname()) for socket in server.sockets)
+    print(f"Serving warehouse sessions on {sockets}")
+    exporting = asyncio.create_task(export_metrics()) if REGISTRY.file_name else None
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if exporting:
+            exporting.cancel()
+            REGISTRY.export()
+
+
+async def export_metrics() -> None:
+    while True:
+        await asyncio.sleep(METRICS_EXPORT_SECONDS)
+        await asyncio.to_thread(REGISTRY.export)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="localhost", help="TCP host")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port")
+    parser.add_argument("--unix", help="serve on this Unix socket instead of TCP")
+    parser.add_argument(
+        "--personnel-file", default=DEFAULT_PERSONNEL_FILE, help="personnel JSON file"
+    )
+    parser.add_argument(
+        "--stock-file", default=DEFAULT_STOCK_FILE, help="stock JSON file"
+    )
+    arguments = parser.parse_args(argv)
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve(arguments))
+
+
+if __name__ == "__main__":
+    main()
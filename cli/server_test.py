@@ -0,0 +1,103 @@
+import asyncio
+import sys
+import unittest
+from unittest.mock import AsyncMock, Mock, patch
+from app import WarehouseManager
+import app_test
+from metrics import REGISTRY
+from server import AsyncConsoleUserInterface, start_server
+
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        test_data = app_test.TestWarehouseManager
+        self.manager = WarehouseManager(
+            personnel_records=test_data.personnel_for_test_get_employee,
+            item_records=test_data.warehouse_items_for_test,
+        )
+        self.server = await start_server(self.manager, "localhost", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def session(self, *lines: str) -> str:
+        """Returns everything the server sent in a session typing given lines"""
+        reader, writer = await asyncio.open_connection("localhost", self.port)
+        writer.write("".join(f"{line}\n" for line in lines).encode())
+        writer.write_eof()  # NOTE: a script too short ends the session, not hangs it
+        output = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+        return output.decode()
+
+    async def test_list_and_quit(self):
+        output = await self.session("Anna", "1", "4")
+        self.assertIn("Hello, Anna!", output)
+        self.assertIn("Total amount of item in Warehouse 3: 2", output)
+        self.assertIn("Thank you for your visit, Anna!", output)
+
+    async def test_search_and_order(self):
+        output = await self.session(
+            "Tomek", "2", "blue remote control", "y", "q", "2", "4"
+        )
+        self.assertIn("4 Blue Remote control in stock", output)
+        self.assertIn("You have ordered 2 Blue Remote control", output)
+        self.assertEqual(
+            self.manager.calculate_item_total_amount("Blue Remote control"), 2
+        )
+
+    async def test_search_not_in_stock_suggests_names(self):
+        output = await self.session("Anna", "2", "blak smartwach", "4")
+        self.assertIn("Not in stock", output)
+        self.assertIn("Did you mean: Black Smartwatch?", output)
+
+    async def test_log_in_is_not_shared_between_sessions(self):
+        await self.session("Tomek", "2", "black smartwatch", "y", "q", "0", "4")
+        self.assertFalse(self.manager.get_employee("Tomek").is_authenticated)
+        output = await self.session("Tomek", "2", "black smartwatch", "y", "", "4")
+        self.assertIn("Order cancelled", output.split("Black Smartwatch in stock")[-1])
+
+    async def test_concurrent_sessions(self):
+        outputs = await asyncio.gather(
+            *(self.session(f"Operator {n}", "3", "1", "4") for n in range(50))
+        )
+        for n, output in enumerate(outputs):
+            self.assertIn(f"Thank you for your visit, Operator {n}!", output)
+
+    async def test_metrics_are_shown_on_quit_only_to_employees(self):
+        with patch.object(REGISTRY, "enabled", True):
+            self.addCleanup(REGISTRY.clear)
+            employee = await self.session(
+                "Tomek", "2", "black smartwatch", "y", "q", "0", "4"
+            )
+            customer = await self.session("Anna", "1", "4")
+        self.assertIn("Operation statistics", employee.split("Thank you")[-1])
+        self.assertNotIn("Operation statistics", customer)
+
+    async def test_show_prints_to_the_session_not_to_sys_stdout(self):
+        writer = Mock(drain=AsyncMock())
+        console = AsyncConsoleUserInterface(None, writer)
+        stdout = []
+
+        def display():
+            stdout.append(sys.stdout)
+            console.print_order_cancelled()
+
+        await console.show(display)
+        self.assertListEqual(stdout, [sys.stdout])
+        writer.write.assert_called_once_with(b"\nOrder cancelled\n")
+
+    async def test_client_leaving_in_the_middle(self):
+        reader, writer = await asyncio.open_connection("localhost", self.port)
+        writer.write(b"Anna\n2\n")
+        await writer.drain()
+        await reader.readuntil(b"Enter name of the item: ")
+        writer.close()
+        await writer.wait_closed()
+        self.assertIn("Hello, Bob!", await self.session("Bob", "4"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+"""Binary image of loaded warehouses and personnel, used to skip parsing on restart"""
+from __future__ import annotations
+import datetime
+import hashlib
+import itertools
+import mmap
+import os
+import pickle
+import tempfile
+import warnings
+from array import array
+from classes import Employee, Item, Warehouse
+from typing import Optional
+
+# NOTE: bump whenever the layout of the snapshot changes
+SNAPSHOT_VERSION = 1
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_hash(file_name: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Snapshot:
+    """Snapshot file of the data loaded from source files.
+    It is only used as long as the source files don't change:
+    unchanged mtime and size are trusted, otherwise the content hash is compared"""
+
+    def __init__(self, file_name: str, sources: list[str]) -> None:
+        self.file_name = file_name
+        self.sources = [os.path.abspath(source) for source in sources]
+        self._fingerprints = None
+        # saved along with the data (e.g. how far a delta feed was applied to it),
+        # as of the last load() or save()
+        self.metadata = {}
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(file_name={self.file_name!r}, "
+            f"sources={self.sources})"
+        )
+
+    def load(self) -> Optional[tuple[list[Employee], list[Warehouse]]]:
+        """Returns (personnel, warehouses) if the snapshot is up to date,
+        otherwise None"""
+        image = self._read_image()
+        if image is None or not self.is_up_to_date(image["sources"]):
+            return None
+        # NOTE: sources are known to be unchanged,
+        # save() doesn't need to hash them again
+        self._fingerprints = image["sources"]
+        self.metadata = image.get("metadata", {})
+        return image["personnel"], _decode_warehouses(image["warehouses"])
+
+    def save(
+        self,
+        personnel: list[Employee],
+        warehouses: list[Warehouse],
+        metadata: dict = None,
+    ) -> None:
+        """Writes the snapshot (atomically), a failure only results in a warning"""
+        self.metadata = metadata or {}
+        image = {
+            "version": SNAPSHOT_VERSION,
+            "sources": self.fingerprints(),
+            "personnel": personnel,
+            "warehouses": _encode_warehouses(warehouses),
+            "metadata": self.metadata,
+        }
+        temporary_file_name = None
+        try:
+            # NOTE: a unique file, as two threads (or processes) may save at once
+            descriptor, temporary_file_name = tempfile.mkstemp(
+                prefix=f"{os.path.basename(self.file_name)}.",
+                suffix=".tmp",
+                dir=os.path.dirname(os.path.abspath(self.file_name)),
+            )
+            with open(descriptor, "wb") as f:
+                pickle.dump(image, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_file_name, self.file_name)
+        except OSError as error:
+            warnings.warn(f"Snapshot {self.file_name} not saved: {error}")
+            if temporary_file_name and os.path.exists(temporary_file_name):
+                os.remove(temporary_file_name)
+
+    def _read_image(self) -> Optional[dict]:
+        try:
+            with open(self.file_name, "rb") as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mapping:
+                image = pickle.loads(mapping)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None  # no snapshot yet (or a broken one)
+        if not isinstance(image, dict) or image.get("version") != SNAPSHOT_VERSION:
+            return None
+        return image
+
+    def is_up_to_date(self, fingerprints: list[dict]) -> bool:
+        """Returns True if fingerprints (saved with the data)
+        are those of the sources now"""
+        if [fingerprint["path"] for fingerprint in fingerprints] != self.sources:
+            return False
+        # NOTE: versions stored as JSON (e.g. by sqlite_backend) come back as lists
+        if all(
+            _file_version(fingerprint["path"])
+            == (tuple(fingerprint["version"]) if fingerprint["version"] else None)
+            for fingerprint in fingerprints
+        ):
+            return True
+        # NOTE: files were touched (or changed), only the content can tell
+        # keep the fingerprints, so that save() doesn't need to hash again
+        self._fingerprints = self._current_fingerprints()
+        return [fingerprint["hash"] for fingerprint in fingerprints] == [
+            fingerprint["hash"] for fingerprint in self._fingerprints
+        ]
+
+    def fingerprints(self) -> list[dict]:
+        """Returns fingerprints of the sources, to be saved with data loaded from them
+        (those of the last check, the sources are not hashed again)"""
+        self._fingerprints = self._fingerprints or self._current_fingerprints()
+        return self._fingerprints
+
+    def _current_fingerprints(self) -> list[dict]:
+        return [
+            {
+                "path": source,
+                "version": _file_version(source),
+                "hash": file_hash(source),
+            }
+            for source in self.sources
+        ]
+
+
+def _file_version(file_name: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _encode_warehouses(warehouses: list[Warehouse]) -> dict:
+    """Stores items column by column: codes into a table of strings
+    and dates as microseconds since the epoch"""
+    strings = {}
+    states = array("I")
+    categories = array("I")
+    dates = array("q")
+    for warehouse in warehouses:
+        for item in warehouse.stock:
+            states.append(strings.setdefault(item.state, len(strings)))
+            categories.append(strings.setdefault(item.category, len(strings)))
+            dates.append((item.date_of_stock - EPOCH) // MICROSECOND)
+    return {
+        "ids": [warehouse.id for warehouse in warehouses],
+        "sizes": [warehouse.occupancy() for warehouse in warehouses],
+        "strings": list(strings),
+        "states": states,
+        "categories": categories,
+        "dates": dates,
+    }
+
+
+def _decode_warehouses(columns: dict) -> list[Warehouse]:
+    strings = columns["strings"]
+    # NOTE: timestamps repeat a lot, build each datetime only once
+    dates = {}
+
+    def date_of_stock(microseconds):
+        date = dates.get(microseconds)
+        if date is None:
+            date = dates[microseconds] = EPOCH + microseconds * MICROSECOND
+        return date
+
+    rows = zip(columns["states"], columns["categories"], columns["dates"])
+    warehouses = []
+    for id, size in zip(columns["ids"], columns["sizes"]):
+        warehouses.append(
+            Warehouse(
+                id,
+                [
+                    Item(strings[state], strings[category], id, date_of_stock(date))
+                    for state, category, date in itertools.islice(rows, size)
+                ],
+            )
+        )
+    return warehouses
@@ -0,0 +1,731 @@
+"""WarehouseManager keeping the stock in a SQLite database instead of Python objects
+
+Items are rows of (warehouse, name_id, date_of_stock), dates are microseconds since
+the epoch (as in snapshots), names (state, category) are rows of their own table.
+Queries are indexed SQL, Items are only built for the rows a query returns.
+
+With a snapshot, the database is the file next to it (warehouse.sqlite next to
+warehouse.snapshot): it is imported from the source files once and used by every
+process as long as they don't change. Changes of stock are stored right away.
+Only the names of items in stock (for search as you type) are kept in memory,
+so a database file should only be changed by one manager at a time"""
+from __future__ import annotations
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import threading
+from aggregation import GroupStatistics, mean_age, validate_statistics
+from ages import DEFAULT_BUCKETS
+from app import WarehouseManager
+from classes import Item
+from concurrency import reading, writing
+from index import NameMatch, NameSearch, normalize_name
+from loader import PersonnelLoader
+from metrics import timed
+from snapshot import EPOCH, MICROSECOND
+from typing import Iterable, Iterator
+
+# NOTE: bump whenever the schema changes, older databases are imported again
+DATABASE_VERSION = 1
+
+# NOTE: (category, state) is unique, it also serves queries by category
+_SCHEMA = (
+    """CREATE TABLE names (
+        id INTEGER PRIMARY KEY,
+        state TEXT NOT NULL,
+        category TEXT NOT NULL,
+        name TEXT NOT NULL -- normalized full name, for case insensitive lookups
+    )""",
+    "CREATE TABLE warehouses (id INTEGER PRIMARY KEY)",
+    """CREATE TABLE items (
+        warehouse INTEGER NOT NULL,
+        name_id INTEGER NOT NULL,
+        date_of_stock INTEGER NOT NULL
+    )""",
+    "CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+)
+# NOTE: created after the bulk import, building them at once is much faster
+_INDEXES = (
+    "CREATE UNIQUE INDEX names_category_state ON names (category, state)",
+    "CREATE INDEX names_name ON names (name)",
+    "CREATE INDEX items_name ON items (name_id, warehouse, date_of_stock)",
+    "CREATE INDEX items_warehouse ON items (warehouse)",
+    "CREATE INDEX items_date_of_stock ON items (date_of_stock)",
+)
+_TABLES = ("names", "warehouses", "items", "metadata")
+
+_INSERT_ITEMS = "INSERT INTO items (warehouse, name_id, date_of_stock) VALUES (?, ?, ?)"
+# NOTE: one of the items equal to the given one, found by the items_name index
+_DELETE_ITEM = """DELETE FROM items WHERE rowid = (
+    SELECT rowid FROM items
+    WHERE name_id = ? AND warehouse = ? AND date_of_stock = ? LIMIT 1
+)"""
+_SAVE_METADATA = "INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)"
+_IN_STOCK = "EXISTS (SELECT 1 FROM items i WHERE i.name_id = n.id)"
+# (warehouse, Item) rows of items joined with their names, see _pairs
+_ITEMS_OF_NAMES = """SELECT i.warehouse, i.name_id, i.date_of_stock
+    FROM names n JOIN items i ON i.name_id = n.id"""
+# by warehouse, then like index.age_order
+_BY_WAREHOUSE_AND_AGE = "ORDER BY i.warehouse, i.date_of_stock, n.state, i.rowid"
+_BY_AGE = "ORDER BY i.date_of_stock, n.state, i.warehouse, i.rowid"
+
+# ages are summed in two parts, so that sums of many dates don't overflow 64 bits
+_AGE_SPLIT_BITS = 20
+
+_in_memory_databases = itertools.count()
+
+
+def database_file(snapshot_file: str) -> str:
+    """Returns the database file kept next to the snapshot file"""
+    return os.path.splitext(snapshot_file)[0] + ".sqlite"
+
+
+def _microseconds(date: datetime.datetime) -> int:
+    return (date - EPOCH) // MICROSECOND
+
+
+def _selection(item_name: str = None, category: str = None) -> tuple[str, tuple]:
+    """Returns (SQL condition on names n, parameters) selecting items
+    with a given name or category, or all items"""
+    if item_name is not None:
+        return "n.name = ?", (normalize_name(item_name),)
+    if category is not None:
+        return "n.category = ?", (category,)
+    return "1", ()
+
+
+@contextlib.contextmanager
+def transaction(connection: sqlite3.Connection, begin: str = "BEGIN") -> Iterator[None]:
+    """Runs the block in a transaction (or in the one the connection is in already),
+    committed at the end, rolled back on error"""
+    if connection.in_transaction:
+        yield
+        return
+    connection.execute(begin)
+    try:
+        yield
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
+
+
+class ConnectionPool:
+    """Connections to one SQLite database. A thread holds a connection while it uses it
+    (also in nested calls), then it is returned to the pool for any other thread,
+    so there are only as many connections as threads using the database at once"""
+
+    def __init__(self, database: str, uri: bool = False) -> None:
+        self.database = database
+        self.uri = uri
+        self._idle = []
+        self._connections = []  # NOTE: all of them, to be closed at the end
+        self._lock = threading.Lock()
+        self._local = threading.local()  # .connection, .uses of this thread
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}({self.database!r}, "
+            f"connections={len(self._connections)})"
+        )
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def _connect(self) -> sqlite3.Connection:
+        # NOTE: transactions are explicit (see SqliteWarehouseManager._transaction)
+        connection = sqlite3.connect(
+            self.database, uri=self.uri, isolation_level=None, check_same_thread=False
+        )
+        if not self.uri:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        local = self._local
+        if getattr(local, "connection", None) is None:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    connection = self._connect()
+                    self._connections.append(connection)
+            local.connection = connection
+            local.uses = 0
+        local.uses += 1
+        try:
+            yield local.connection
+        finally:
+            local.uses -= 1
+            if not local.uses:
+                with self._lock:
+                    self._idle.append(local.connection)
+                local.connection = None
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+            self._idle.clear()
+
+
+class SqliteWarehouseManager(WarehouseManager):
+    """WarehouseManager storing the stock in SQLite (see the module documentation).
+    Without a snapshot, the database is private to the manager and kept in memory"""
+
+    GROUP_KEYS = ("full_name", "category", "state", "warehouse")
+
+    # built by _load() when any of them is used for the first time
+    _LAZY_ATTRIBUTES = (
+        "_personnel",
+        "_personnel_index",
+        "_names",
+        "_name_ids",
+        "_warehouse_ids",
+        "_amounts",
+        "_name_search",
+    )
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if self._snapshot:
+            self.database = database_file(self._snapshot.file_name)
+            self._pool = ConnectionPool(self.database)
+        else:
+            # NOTE: a named in-memory database is shared by all connections of the pool
+            self.database = (
+                f"file:warehouse-{os.getpid()}-{next(_in_memory_databases)}"
+                "?mode=memory&cache=shared"
+            )
+            self._pool = ConnectionPool(self.database, uri=True)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(database={self.database!r})"
+
+    def close(self) -> None:
+        """Closes all connections to the database"""
+        self._pool.close()
+
+    @property
+    def is_loaded(self) -> bool:
+        return "_name_search" in self.__dict__
+
+    @timed()
+    def _load(self) -> None:
+        """Imports the item records into the database, unless it is up to date"""
+        self._index_personnel(
+            list(PersonnelLoader().load_records(self._personnel_records))
+        )
+        # NOTE: another process may be importing, the immediate transaction waits for it
+        with self._pool.connection() as connection, transaction(
+            connection, "BEGIN IMMEDIATE"
+        ):
+            if not self._is_up_to_date(connection):
+                self._import(connection)
+            self._read_names(connection)
+        # NOTE: records are not needed anymore, let them be garbage collected
+        del self._personnel_records, self._item_records
+
+    def _is_up_to_date(self, connection: sqlite3.Connection) -> bool:
+        if self._snapshot is None:
+            return False  # NOTE: a new in-memory database
+        tables = {
+            name
+            for (name,) in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+        if not tables >= set(_TABLES):
+            return False
+        metadata = dict(
+            connection.execute(
+                "SELECT key, value FROM metadata WHERE key IN ('version', 'sources')"
+            ).fetchall()
+        )
+        if json.loads(metadata.get("version", "null")) != DATABASE_VERSION:
+            return False
+        return self._snapshot.is_up_to_date(json.loads(metadata["sources"]))
+
+    def _import(self, connection: sqlite3.Connection) -> None:
+        """(Re)creates the tables with items loaded from the records, chunk by chunk"""
+        for table in _TABLES:
+            connection.execute(f"DROP TABLE IF EXISTS {table}")
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        name_ids = {}
+        warehouse_ids = set()
+        # NOTE: datetimes are shared by items stocked at the same time
+        # (see CachedDateParser)
+        microseconds = {}
+        for partial in self._warehouse_loader.load_chunks(self._item_records):
+            rows = []
+            for warehouse_id, items in partial.items():
+                warehouse_ids.add(warehouse_id)
+                for item in items:
+                    name_id = name_ids.get((item.state, item.category))
+                    if name_id is None:
+                        name_id = name_ids[item.state, item.category] = (
+                            len(name_ids) + 1
+                        )
+                    date = microseconds.get(item.date_of_stock)
+                    if date is None:
+                        date = microseconds[item.date_of_stock] = _microseconds(
+                            item.date_of_stock
+                        )
+                    rows.append((warehouse_id, name_id, date))
+            connection.executemany(_INSERT_ITEMS, rows)
+        connection.executemany(
+            "INSERT INTO names (id, state, category, name) VALUES (?, ?, ?, ?)",
+            (
+                (name_id, state, category, normalize_name(f"{state} {category}"))
+                for (state, category), name_id in name_ids.items()
+            ),
+        )
+        connection.executemany(
+            "INSERT INTO warehouses (id) VALUES (?)", ((id,) for id in warehouse_ids)
+        )
+        for statement in _INDEXES:
+            connection.execute(statement)
+        # NOTE: without statistics, the planner may pick a much less selective index
+        connection.execute("ANALYZE")
+        connection.executemany(
+            _SAVE_METADATA,
+            [
+                ("version", json.dumps(DATABASE_VERSION)),
+                (
+                    "sources",
+                    json.dumps(self._snapshot.fingerprints() if self._snapshot else []),
+                ),
+                ("metadata", json.dumps({})),
+            ],
+        )
+
+    def _read_names(self, connection: sqlite3.Connection) -> None:
+        """Reads what is kept in memory: names, warehouses and amounts of each name"""
+        self._names = {}  # id -> (state, category)
+        self._name_ids = {}  # (state, category) -> id
+        for id, state, category in connection.execute(
+            "SELECT id, state, category FROM names"
+        ):
+            # NOTE: loaded items share their strings, like those of WarehouseLoader
+            name = self._names[id] = (sys.intern(state), sys.intern(category))
+            self._name_ids[name] = id
+        self._warehouse_ids = {
+            id for (id,) in connection.execute("SELECT id FROM warehouses")
+        }
+        self._amounts = dict(
+            connection.execute(
+                "SELECT name_id, COUNT(*) FROM items GROUP BY name_id"
+            ).fetchall()
+        )
+        name_search = NameSearch()
+        for name_id in self._amounts:
+            name_search.add(self._full_name(name_id), sort=False)
+        self._name_search = name_search
+
+    def _full_name(self, name_id: int) -> str:
+        return "{} {}".format(*self._names[name_id])
+
+    @contextlib.contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        self._name_search  # NOTE: loads the data, if not loaded yet
+        with self._pool.connection() as connection:
+            yield connection
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Runs the block in a transaction
+        (or in the one already started by the thread)"""
+        with self._connection() as connection:
+            try:
+                with transaction(connection):
+                    yield connection
+            except BaseException:
+                if not connection.in_transaction:
+                    # NOTE: names and warehouses added in memory
+                    # may have been rolled back
+                    self._read_names(connection)
+                raise
+
+    def _query(self, sql: str, parameters: Iterable = ()) -> list[tuple]:
+        with self._connection() as connection:
+            return connection.execute(sql, parameters).fetchall()
+
+    def _count(self, sql: str, parameters: Iterable = ()) -> int:
+        return self._query(sql, parameters)[0][0]
+
+    def _pairs(self, sql: str, parameters: Iterable = ()) -> Iterator[tuple]:
+        """Yields (warehouse_id, Item) of (warehouse, name_id, date_of_stock) rows"""
+        names = self._names
+        # NOTE: items stocked at the same time share one datetime (as when loaded)
+        dates = {}
+        with self._connection() as connection:
+            for warehouse_id, name_id, microseconds in connection.execute(
+                sql, parameters
+            ):
+                date = dates.get(microseconds)
+                if date is None:
+                    date = dates[microseconds] = EPOCH + microseconds * MICROSECOND
+                yield warehouse_id, Item(*names[name_id], warehouse_id, date)
+
+    def _items_named(self, item_name: str) -> dict[int, list[Item]]:
+        items_per_warehouse = {}
+        for warehouse_id, item in self._all_named_items_with_warehouse_id(item_name):
+            items_per_warehouse.setdefault(warehouse_id, []).append(item)
+        return items_per_warehouse
+
+    def _add_item(self, warehouse_id: int, item: Item) -> None:
+        self._insert_items([(warehouse_id, item)])
+
+    def _insert_items(self, pairs: list[tuple]) -> None:
+        """Inserts (warehouse_id, Item) pairs,
+        creating their names and warehouses if needed"""
+        with self._transaction() as connection:
+            rows = []
+            for warehouse_id, item in pairs:
+                if warehouse_id not in self._warehouse_ids:
+                    connection.execute(
+                        "INSERT INTO warehouses (id) VALUES (?)", (warehouse_id,)
+                    )
+                    self._warehouse_ids.add(warehouse_id)
+                name_id = self._name_id(connection, item.state, item.category)
+                rows.append((warehouse_id, name_id, _microseconds(item.date_of_stock)))
+                amount = self._amounts.get(name_id, 0)
+                if not amount:
+                    self._name_search.add(self._full_name(name_id))
+                self._amounts[name_id] = amount + 1
+            connection.executemany(_INSERT_ITEMS, rows)
+
+    def _name_id(
+        self, connection: sqlite3.Connection, state: str, category: str
+    ) -> int:
+        name_id = self._name_ids.get((state, category))
+        if name_id is None:
+            name_id = connection.execute(
+                "INSERT INTO names (state, category, name) VALUES (?, ?, ?)",
+                (state, category, normalize_name(f"{state} {category}")),
+            ).lastrowid
+            name = self._names[name_id] = (sys.intern(state), sys.intern(category))
+            self._name_ids[name] = name_id
+        return name_id
+
+    def _remove_item(self, warehouse_id: int, item: Item) -> Item:
+        if warehouse_id not in self._warehouse_ids:
+            raise KeyError(warehouse_id)
+        name_id = self._name_ids.get((item.state, item.category))
+        with self._transaction() as connection:
+            if (
+                name_id is None
+                or not connection.execute(
+                    _DELETE_ITEM,
+                    (name_id, warehouse_id, _microseconds(item.date_of_stock)),
+                ).rowcount
+            ):
+                raise ValueError(f"{item!r} not in warehouse {warehouse_id}")
+            self._count_removed([name_id])
+        return Item(*self._names[name_id], warehouse_id, item.date_of_stock)
+
+    def _remove_allocated(self, allocation: Iterable[tuple]) -> None:
+        rows = [
+            (
+                self._name_ids[item.state, item.category],
+                warehouse_id,
+                _microseconds(item.date_of_stock),
+            )
+            for warehouse_id, item in allocation
+        ]
+        with self._transaction() as connection:
+            connection.executemany(_DELETE_ITEM, rows)
+            self._count_removed([name_id for name_id, _warehouse, _date in rows])
+
+    def _count_removed(self, name_ids: list[int]) -> None:
+        """Counts removed items of given names, names which are out of stock
+        can't be searched for anymore"""
+        for name_id in name_ids:
+            self._amounts[name_id] -= 1
+            if not self._amounts[name_id]:
+                del self._amounts[name_id]
+                self._name_search.discard(self._full_name(name_id))
+
+    @timed()
+    @writing
+    def apply_stock_changes(
+        self, changes: Iterable[tuple], metadata: dict = None
+    ) -> list[tuple]:
+        missing = []
+        with self._transaction() as connection:
+            # NOTE: consecutive additions are inserted at once
+            for event, group in itertools.groupby(
+                changes, key=lambda change: change[0]
+            ):
+                if event == "add":
+                    self._insert_items([(id, item) for _event, id, item in group])
+                    continue
+                for change in group:
+                    try:
+                        self._remove_item(change[1], change[2])
+                    except (KeyError, ValueError):
+                        missing.append(change)
+            if metadata is not None:
+                self._save_metadata(connection, metadata)
+        return missing
+
+    def _save_metadata(self, connection: sqlite3.Connection, metadata: dict) -> None:
+        connection.execute(_SAVE_METADATA, ("metadata", json.dumps(metadata)))
+
+    @timed()
+    @writing
+    def save_snapshot(self, metadata: dict = None) -> None:
+        """Stores metadata in the database, the stock is stored there already"""
+        if self._snapshot is None:
+            raise ValueError("There is no snapshot file to save to")
+        with self._transaction() as connection:
+            self._save_metadata(connection, metadata or {})
+
+    @property
+    def snapshot_metadata(self) -> dict:
+        if self._snapshot is None:
+            return {}
+        with self.lock.read():
+            ((value,),) = self._query(
+                "SELECT value FROM metadata WHERE key = 'metadata'"
+            )
+        return json.loads(value)
+
+    def _all_items_in_warehouse_filtered(self, source=None, filter=lambda _x: True):
+        # NOTE: there are no Warehouse objects with stock to take items from
+        return (
+            (warehouse_id, item)
+            for warehouse_id, item in self._all_items_with_warehouse_id()
+            if filter(item)
+        )
+
+    def _all_items_with_warehouse_id(self):
+        # NOTE: rows of each warehouse in the order they were stocked
+        # (as its stock list)
+        return self._pairs(
+            "SELECT warehouse, name_id, date_of_stock FROM items "
+            "ORDER BY warehouse, rowid"
+        )
+
+    def _all_named_items_with_warehouse_id(self, item_name):
+        return self._pairs(
+            f"{_ITEMS_OF_NAMES} WHERE n.name = ? {_BY_WAREHOUSE_AND_AGE}",
+            (normalize_name(item_name),),
+        )
+
+    def _all_items_of_category_with_warehouse_id(self, category):
+        return self._pairs(
+            f"{_ITEMS_OF_NAMES} WHERE n.category = ? {_BY_WAREHOUSE_AND_AGE}",
+            (category,),
+        )
+
+    @timed(items=len)
+    @reading
+    def search_item_names(self, query: str, limit: int = 10) -> list[NameMatch]:
+        return self._name_search.search(query, limit)
+
+    @timed(items=len)
+    @reading
+    def get_items_older_than(
+        self, days: int, item_name: str = None, category: str = None, today=None
+    ) -> list[tuple]:
+        today = today if today is not None else datetime.datetime.today()
+        selection, parameters = _selection(item_name, category)
+        return list(
+            self._pairs(
+                f"{_ITEMS_OF_NAMES} WHERE {selection} "
+                f"AND i.date_of_stock <= ? {_BY_AGE}",
+                (*parameters, _microseconds(today - datetime.timedelta(days=days))),
+            )
+        )
+
+    @timed(items=len)
+    @reading
+    def get_oldest_items(
+        self, amount: int, item_name: str = None, category: str = None
+    ) -> list[tuple]:
+        selection, parameters = _selection(item_name, category)
+        return list(
+            self._pairs(
+                f"{_ITEMS_OF_NAMES} WHERE {selection} {_BY_AGE} LIMIT ?",
+                (*parameters, amount),
+            )
+        )
+
+    @timed(items=len)
+    @reading
+    def get_age_histogram(
+        self,
+        buckets=DEFAULT_BUCKETS,
+        item_name: str = None,
+        category: str = None,
+        today=None,
+    ) -> dict[int, list[int]]:
+        bounds = sorted(buckets)
+        today = today if today is not None else datetime.datetime.today()
+        selection, parameters = _selection(item_name, category)
+        # NOTE: numbers of items at least as old as each bound, as in ages.age_histogram
+        at_least = "".join(", SUM(i.date_of_stock <= ?)" for _bound in bounds)
+        histogram = {}
+        for warehouse_id, *amounts in self._query(
+            f"""SELECT i.warehouse, COUNT(*){at_least}
+            FROM names n JOIN items i ON i.name_id = n.id
+            WHERE {selection} GROUP BY i.warehouse ORDER BY i.warehouse""",
+            (
+                *(
+                    _microseconds(today - datetime.timedelta(days=days))
+                    for days in bounds
+                ),
+                *parameters,
+            ),
+        ):
+            amounts.append(0)
+            histogram[warehouse_id] = [
+                amounts[bucket] - amounts[bucket + 1]
+                for bucket in range(len(bounds) + 1)
+            ]
+        return histogram
+
+    @timed()
+    @reading
+    def calculate_total_amount(self) -> int:
+        return self._count("SELECT COUNT(*) FROM items")
+
+    @timed()
+    @reading
+    def calculate_item_amount_in_warehouse(self, id: int, item_name: str) -> int:
+        return self._count(
+            """SELECT COUNT(*) FROM names n JOIN items i ON i.name_id = n.id
+            WHERE n.name = ? AND i.warehouse = ?""",
+            (normalize_name(item_name), id),
+        )
+
+    @timed()
+    @reading
+    def calculate_item_total_amount(self, item_name: str = None) -> int:
+        return self._count(
+            "SELECT COUNT(*) FROM names n JOIN items i ON i.name_id = n.id "
+            "WHERE n.name = ?",
+            (normalize_name(item_name),),
+        )
+
+    @timed(items=len)
+    @reading
+    def get_unique_item_names(self) -> set:
+        return {
+            full_name
+            for (full_name,) in self._query(
+                f"SELECT n.state || ' ' || n.category FROM names n WHERE {_IN_STOCK}"
+            )
+        }
+
+    @timed(items=len)
+    @reading
+    def get_amount_of_item_in_each_warehouse(self, items: set) -> dict:
+        warehouse_ids = sorted(self._warehouse_ids)
+        amounts = {}
+        for item_name in items:
+            amounts[item_name] = dict.fromkeys(warehouse_ids, 0)
+            amounts[item_name].update(
+                self._query(
+                    """SELECT i.warehouse, COUNT(*)
+                    FROM names n JOIN items i ON i.name_id = n.id
+                    WHERE n.name = ? GROUP BY i.warehouse""",
+                    (normalize_name(item_name),),
+                )
+            )
+        return amounts
+
+    @timed(items=len)
+    @reading
+    def get_unique_categories(self) -> set[str]:
+        return {
+            category
+            for (category,) in self._query(
+                f"SELECT DISTINCT n.category FROM names n WHERE {_IN_STOCK}"
+            )
+        }
+
+    @timed(items=len)
+    @reading
+    def calculate_amount_of_items_in_category(
+        self, categories: set[str]
+    ) -> list[tuple]:
+        return [
+            (
+                category,
+                self._count(
+                    """SELECT COUNT(*) FROM names n JOIN items i ON i.name_id = n.id
+                    WHERE n.category = ?""",
+                    (category,),
+                ),
+            )
+            for category in categories
+        ]
+
+    @timed(items=len)
+    @reading
+    def aggregate(
+        self, by=("full_name",), statistics=("count",), now=None, filter=None
+    ) -> dict:
+        keys = [by] if isinstance(by, str) or callable(by) else list(by)
+        if filter is not None or not all(key in self.GROUP_KEYS for key in keys):
+            # NOTE: arbitrary Python functions can't be run by SQLite
+            return super().aggregate(by, statistics, now, filter)
+        validate_statistics(statistics)
+        now = now if now is not None else datetime.datetime.today()
+        low_mask = (1 << _AGE_SPLIT_BITS) - 1
+        # NOTE: every key is a function of the name and the warehouse,
+        # so SQLite groups by those (scanning only the items_name index)
+        # and their groups are merged here, in order of first appearance in the stock,
+        # same as the Python path
+        groups = {}
+        for name_id, warehouse_id, count, min_date, max_date, high, low in self._query(
+            f"""SELECT name_id, warehouse, COUNT(*),
+                MIN(date_of_stock), MAX(date_of_stock),
+                SUM(date_of_stock >> {_AGE_SPLIT_BITS}), SUM(date_of_stock & {low_mask})
+            FROM items GROUP BY name_id, warehouse ORDER BY warehouse, MIN(rowid)"""
+        ):
+            state, category = self._names[name_id]
+            values = {
+                "full_name": f"{state} {category}",
+                "category": category,
+                "state": state,
+                "warehouse": warehouse_id,
+            }
+            key = values[by] if isinstance(by, str) else tuple(values[k] for k in keys)
+            dates = (high << _AGE_SPLIT_BITS) + low
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [count, min_date, max_date, dates]
+            else:
+                group[0] += count
+                group[1] = min(group[1], min_date)
+                group[2] = max(group[2], max_date)
+                group[3] += dates
+
+        def statistic(name, value):
+            return value if name in statistics else None
+
+        return {
+            key: GroupStatistics(
+                count=count,
+                min_date=statistic("min_date", EPOCH + min_date * MICROSECOND),
+                max_date=statistic("max_date", EPOCH + max_date * MICROSECOND),
+                mean_age=statistic(
+                    "mean_age",
+                    mean_age(
+                        (now - EPOCH) * count - dates * MICROSECOND,
+                        count,
+                    ),
+                ),
+            )
+            for key, (count, min_date, max_date, dates) in groups.items()
+        }
@@ -0,0 +1,491 @@
+"""Compact binary stock file, see: python cli/stock_file.py --help
+
+Items are fixed-width records, so a file is scanned in place (mapped into memory),
+without parsing it and without building an Item for every record.
+Layout (little endian):
+    header       magic, version, numbers of warehouses, records and strings,
+                 length of the metadata
+    warehouses   (id, number of records) of each warehouse, by ID
+    records      (state id, category id, warehouse id, date_of_stock) of each item,
+                 warehouse by warehouse, in the order they were stocked;
+                 ids are positions in the string table, dates are microseconds
+                 since the epoch (as in snapshots)
+    strings      (length, UTF-8 bytes) of each string
+    metadata     JSON (e.g. fingerprints of the files it was converted from)"""
+from __future__ import annotations
+import argparse
+import heapq
+import io
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from classes import Item, Warehouse
+from json_records import JSONRecords
+from loader import WarehouseLoader
+from snapshot import EPOCH, MICROSECOND
+from typing import Iterable, Iterator, Optional
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, scans fall back to struct.iter_unpack
+    np = None
+
+MAGIC = b"WHSTOCK\0"
+# NOTE: bump whenever the layout changes, older files are converted again
+FORMAT_VERSION = 2
+
+HEADER = struct.Struct("<8sIIQII")
+WAREHOUSE = struct.Struct("<qQ")
+# NOTE: warehouse IDs are 64 bit, as in the warehouse table
+RECORD = struct.Struct("<IIqq")
+STRING_LENGTH = struct.Struct("<I")
+# the same record as a NumPy structured type, to view the records without copying
+RECORD_DTYPE = (
+    np.dtype(
+        [("state", "<u4"), ("category", "<u4"), ("warehouse", "<i8"), ("date", "<i8")]
+    )
+    if np is not None
+    else None
+)
+
+# dates are summed in two parts, so that sums of many dates don't overflow 64 bits
+_SPLIT_BITS = 20
+
+
+def _microseconds(date) -> int:
+    return (date - EPOCH) // MICROSECOND
+
+
+class StockFileWriter:
+    """Collects items (each warehouse in the order they are added)
+    and writes them as a stock file"""
+
+    def __init__(self) -> None:
+        self._strings = {}
+        self._records = {}  # warehouse id -> packed records
+        # NOTE: datetimes are shared by items stocked at the same time
+        # (see CachedDateParser)
+        self._dates = {}
+
+    def __len__(self) -> int:
+        return sum(len(records) for records in self._records.values()) // RECORD.size
+
+    def _string(self, string: str) -> int:
+        return self._strings.setdefault(string, len(self._strings))
+
+    def add(self, warehouse_id: int, item: Item) -> None:
+        date = self._dates.get(item.date_of_stock)
+        if date is None:
+            date = self._dates[item.date_of_stock] = _microseconds(item.date_of_stock)
+        records = self._records.get(warehouse_id)
+        if records is None:
+            records = self._records[warehouse_id] = bytearray()
+        records += RECORD.pack(
+            self._string(item.state), self._string(item.category), warehouse_id, date
+        )
+
+    def add_chunks(self, chunks: Iterable[dict[int, list[Item]]]) -> None:
+        """Adds { warehouse_id: [Item, ...] } chunks
+        (see WarehouseLoader.load_chunks)"""
+        for partial in chunks:
+            for warehouse_id, items in partial.items():
+                for item in items:
+                    self.add(warehouse_id, item)
+
+    def add_warehouses(self, warehouses: Iterable[Warehouse]) -> None:
+        for warehouse in warehouses:
+            self._records.setdefault(warehouse.id, bytearray())
+            for item in warehouse.stock:
+                self.add(warehouse.id, item)
+
+    def write(self, f, metadata: dict = None) -> None:
+        _write(
+            f,
+            [(id, self._records[id]) for id in sorted(self._records)],
+            list(self._strings),
+            metadata or {},
+        )
+
+    def save(self, file_name: str, metadata: dict = None) -> None:
+        """Writes the file (atomically)"""
+        _save(file_name, lambda f: self.write(f, metadata))
+
+    def to_buffer(self, metadata: dict = None) -> memoryview:
+        """Returns the stock file as a buffer in memory"""
+        f = io.BytesIO()
+        self.write(f, metadata)
+        return f.getbuffer()
+
+
+def _write(f, warehouses: list[tuple], strings: list[str], metadata: dict) -> None:
+    """Writes (warehouse id, packed records) of each warehouse, strings and metadata"""
+    encoded_metadata = json.dumps(metadata).encode()
+    f.write(
+        HEADER.pack(
+            MAGIC,
+            FORMAT_VERSION,
+            len(warehouses),
+            sum(len(records) for _id, records in warehouses) // RECORD.size,
+            len(strings),
+            len(encoded_metadata),
+        )
+    )
+    for id, records in warehouses:
+        f.write(WAREHOUSE.pack(id, len(records) // RECORD.size))
+    for _id, records in warehouses:
+        f.write(records)
+    for string in strings:
+        encoded = string.encode()
+        f.write(STRING_LENGTH.pack(len(encoded)))
+        f.write(encoded)
+    f.write(encoded_metadata)
+
+
+def _save(file_name: str, write) -> None:
+    # NOTE: a unique file, as two threads (or processes) may save at once
+    descriptor, temporary_file_name = tempfile.mkstemp(
+        prefix=f"{os.path.basename(file_name)}.",
+        suffix=".tmp",
+        dir=os.path.dirname(os.path.abspath(file_name)),
+    )
+    try:
+        with open(descriptor, "wb") as f:
+            write(f)
+        os.replace(temporary_file_name, file_name)
+    finally:
+        if os.path.exists(temporary_file_name):
+            os.remove(temporary_file_name)
+
+
+def convert(
+    records: Iterable,
+    file_name: str,
+    loader: WarehouseLoader = None,
+    metadata: dict = None,
+) -> int:
+    """Writes item records (e.g. of stock.json) as a stock file,
+    returns the number of items"""
+    writer = StockFileWriter()
+    writer.add_chunks((loader or WarehouseLoader()).load_chunks(records))
+    writer.save(file_name, metadata)
+    return len(writer)
+
+
+class StockFile:
+    """Read-only view of a stock file mapped into memory
+    (or of a buffer in that format).
+    Records are unpacked only while they are scanned, nothing is copied"""
+
+    def __init__(self, source, vectorized: bool = True) -> None:
+        """source is a file name or a buffer (e.g. StockFileWriter.to_buffer()),
+        records are scanned with NumPy if vectorized (and NumPy is installed)"""
+        self.vectorized = vectorized
+        self._mapping = None
+        self._columns = None
+        self._columns_lock = threading.Lock()
+        if isinstance(source, str):
+            self.file_name = source
+            with open(source, "rb") as f:
+                self._mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._buffer = memoryview(self._mapping)
+        else:
+            self.file_name = None
+            self._buffer = memoryview(source)
+        try:
+            self._read(self._buffer)
+        except (struct.error, ValueError, UnicodeDecodeError) as error:
+            self.close()
+            raise ValueError(f"Not a stock file: {source!r} ({error})") from None
+
+    def _read(self, buffer: memoryview) -> None:
+        (
+            magic,
+            version,
+            number_of_warehouses,
+            number_of_records,
+            number_of_strings,
+            metadata_length,
+        ) = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"format {magic!r} version {version}")
+        offset = HEADER.size
+        # id -> (first record, end of records) of each warehouse
+        self.warehouses = {}
+        first = 0
+        for id, size in WAREHOUSE.iter_unpack(
+            buffer[offset : offset + number_of_warehouses * WAREHOUSE.size]
+        ):
+            self.warehouses[id] = (first, first + size)
+            first += size
+        if first != number_of_records:
+            raise ValueError("sizes of warehouses don't add up")
+        offset += number_of_warehouses * WAREHOUSE.size
+        self.records = buffer[offset : offset + number_of_records * RECORD.size]
+        offset += len(self.records)
+        self.strings = []
+        for _string in range(number_of_strings):
+            (length,) = STRING_LENGTH.unpack_from(buffer, offset)
+            offset += STRING_LENGTH.size
+            # NOTE: items share their strings, like those of WarehouseLoader
+            self.strings.append(
+                sys.intern(str(buffer[offset : offset + length], "utf-8"))
+            )
+            offset += length
+        self.metadata = json.loads(
+            str(buffer[offset : offset + metadata_length], "utf-8")
+        )
+        if len(self.records) != number_of_records * RECORD.size:
+            raise ValueError("the file is truncated")
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(file_name={self.file_name!r}, records={len(self)})"
+        )
+
+    def __len__(self) -> int:
+        return len(self.records) // RECORD.size
+
+    def close(self) -> None:
+        """Unmaps the file,
+        unless its records are still in use (e.g. by NumPy arrays)"""
+        self._columns = None
+        try:
+            for view in (getattr(self, "records", None), self._buffer):
+                if view is not None:
+                    view.release()
+            if self._mapping is not None:
+                self._mapping.close()
+        except BufferError:
+            pass  # NOTE: the mapping is closed when the last view of it is collected
+
+    def rows(self, start: int = 0, end: int = None) -> Iterator[tuple]:
+        """Yields (state id, category id, warehouse id, date) of records
+        from start to end"""
+        end = len(self) if end is None else end
+        return RECORD.iter_unpack(self.records[start * RECORD.size : end * RECORD.size])
+
+    @property
+    def columns(self):
+        """Returns the records as a NumPy structured array (a view of the mapping),
+        None if not vectorized"""
+        if np is None or not self.vectorized:
+            return None
+        if self._columns is None:
+            with self._columns_lock:
+                if self._columns is None:
+                    self._columns = np.frombuffer(self.records, dtype=RECORD_DTYPE)
+        return self._columns
+
+    def select(
+        self, names: Optional[set[tuple]] = None, stocked_until: int = None
+    ) -> list[int]:
+        """Returns positions of the records (in the order of the file)
+        with (state id, category id) in names (of all, if None)
+        stocked until a date (in microseconds since the epoch, any if None)"""
+        columns = self.columns
+        if columns is not None:
+            selected = np.ones(len(columns), dtype=bool)
+            if names is not None:
+                selected &= np.isin(
+                    _name_keys(columns),
+                    np.array(
+                        [state << 32 | category for state, category in names],
+                        dtype=np.int64,
+                    ),
+                )
+            if stocked_until is not None:
+                selected &= columns["date"] <= stocked_until
+            return np.flatnonzero(selected).tolist()
+        if stocked_until is None:
+            stocked_until = float("inf")
+        return [
+            position
+            for position, (state, category, _warehouse, date) in enumerate(self.rows())
+            if date <= stocked_until and (names is None or (state, category) in names)
+        ]
+
+    def group_statistics(self) -> dict[tuple, list[int]]:
+        """Returns { (state id, category id, warehouse id):
+        [count, min date, max date, sum of dates] } of all records,
+        in order of first appearance, in a single scan"""
+        columns = self.columns
+        if columns is not None:
+            return self._group_statistics_vectorized(columns)
+        groups = {}
+        for state, category, warehouse, date in self.rows():
+            group = groups.get((state, category, warehouse))
+            if group is None:
+                groups[state, category, warehouse] = [1, date, date, date]
+            else:
+                group[0] += 1
+                if date < group[1]:
+                    group[1] = date
+                elif date > group[2]:
+                    group[2] = date
+                group[3] += date
+        return groups
+
+    def _group_statistics_vectorized(self, columns) -> dict[tuple, list[int]]:
+        keys = _name_keys(columns)
+        dates = columns["date"]
+        statistics = {}
+        # NOTE: records of a warehouse are contiguous, each warehouse is sorted by name
+        # (stably, the first record of a name stays first) and reduced name by name
+        for warehouse_id, (start, end) in self.warehouses.items():
+            if start == end:
+                continue
+            order = np.argsort(keys[start:end], kind="stable")
+            names = keys[start:end][order]
+            starts = np.flatnonzero(np.concatenate(([True], names[1:] != names[:-1])))
+            ordered_dates = dates[start:end][order]
+            # NOTE: sums of many dates overflow 64 bits,
+            # they are summed in two exact parts
+            highs = np.add.reduceat(ordered_dates >> _SPLIT_BITS, starts).tolist()
+            lows = np.add.reduceat(
+                ordered_dates & (1 << _SPLIT_BITS) - 1, starts
+            ).tolist()
+            counts = np.diff(starts, append=end - start).tolist()
+            minimums = np.minimum.reduceat(ordered_dates, starts).tolist()
+            maximums = np.maximum.reduceat(ordered_dates, starts).tolist()
+            names = names[starts].tolist()
+            for group in np.argsort(order[starts]).tolist():
+                statistics[
+                    names[group] >> 32, names[group] & 0xFFFFFFFF, warehouse_id
+                ] = [
+                    counts[group],
+                    minimums[group],
+                    maximums[group],
+                    (highs[group] << _SPLIT_BITS) + lows[group],
+                ]
+        return statistics
+
+    def rows_at(self, positions: Iterable[int]) -> Iterator[tuple]:
+        """Yields (state id, category id, warehouse id, date)
+        of the records at positions"""
+        unpack_from = RECORD.unpack_from
+        records = self.records
+        for position in positions:
+            yield unpack_from(records, position * RECORD.size)
+
+    def age_ordered(
+        self, positions: list[int], by_warehouse: bool = True, limit: int = None
+    ) -> list[int]:
+        """Returns positions of records ordered by warehouse (if by_warehouse),
+        then like index.age_order (up to limit of them, if given)"""
+        columns = self.columns
+        if columns is not None:
+            positions = np.asarray(positions, dtype=np.int64)
+            selected = columns[positions]
+            ranks = np.empty(len(self.strings), dtype=np.int64)
+            ranks[
+                sorted(range(len(self.strings)), key=self.strings.__getitem__)
+            ] = np.arange(len(self.strings))
+            states = ranks[selected["state"]]
+            # NOTE: the sort is stable, equal records stay in the order of the file
+            order = np.lexsort(
+                (states, selected["date"], selected["warehouse"])
+                if by_warehouse
+                else (selected["warehouse"], states, selected["date"])
+            )
+            return positions[order[:limit]].tolist()
+        strings = self.strings
+
+        def key(position_and_row):
+            _position, (state, _category, warehouse, date) = position_and_row
+            if by_warehouse:
+                return warehouse, date, strings[state]
+            return date, strings[state], warehouse
+
+        pairs = zip(positions, self.rows_at(positions))
+        return [
+            position
+            for position, _row in (
+                sorted(pairs, key=key)
+                if limit is None
+                else heapq.nsmallest(limit, pairs, key=key)
+            )
+        ]
+
+    def pairs(self, positions: Iterable[int]) -> Iterator[tuple]:
+        """Yields (warehouse_id, Item) of the records at given positions,
+        Items are only built now"""
+        strings = self.strings
+        # NOTE: items stocked at the same time share one datetime (as when loaded)
+        dates = {}
+        for state, category, warehouse_id, microseconds in self.rows_at(positions):
+            date = dates.get(microseconds)
+            if date is None:
+                date = dates[microseconds] = EPOCH + microseconds * MICROSECOND
+            yield warehouse_id, Item(
+                strings[state], strings[category], warehouse_id, date
+            )
+
+    def load_warehouses(self) -> list[Warehouse]:
+        """Returns all items as Warehouses of Python objects"""
+        warehouses = []
+        pairs = self.pairs(range(len(self)))
+        for id, (start, end) in self.warehouses.items():
+            warehouses.append(
+                Warehouse(
+                    id, [item for _id, item in itertools.islice(pairs, end - start)]
+                )
+            )
+        return warehouses
+
+    def save(self, file_name: str, metadata: dict) -> None:
+        """Writes a copy of the file (atomically) with other metadata"""
+        _save(
+            file_name,
+            lambda f: _write(
+                f,
+                [
+                    (id, self.records[start * RECORD.size : end * RECORD.size])
+                    for id, (start, end) in self.warehouses.items()
+                ],
+                self.strings,
+                metadata,
+            ),
+        )
+
+
+def _name_keys(columns):
+    """Returns (state id, category id) of each record as one int64"""
+    return columns["state"].astype(np.int64) << 32 | columns["category"]
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("source", help="stock JSON (or JSON Lines) file")
+    parser.add_argument("target", help="stock file to write")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="processes loading the records"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=WarehouseLoader.DEFAULT_CHUNK_SIZE,
+        help="records loaded at once",
+    )
+    arguments = parser.parse_args(argv)
+    start = time.perf_counter()
+    items = convert(
+        JSONRecords(arguments.source),
+        arguments.target,
+        WarehouseLoader(workers=arguments.workers, chunk_size=arguments.chunk_size),
+    )
+    size = os.path.getsize(arguments.target)
+    print(
+        f"{items} items written to {arguments.target} in "
+        f"{time.perf_counter() - start:.3f} s, {size} bytes"
+        + (f" ({size / items:.1f} per item)" if items else "")
+    )
+
+
+if __name__ == "__main__":
+    main()
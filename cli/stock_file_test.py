@@ -0,0 +1,116 @@
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime
+from unittest.mock import patch
+import app_test
+import stock_file
+from app import DEFAULT_STOCK_FILE
+from classes import Item, Warehouse
+from snapshot import EPOCH, MICROSECOND
+from stock_file import RECORD, StockFile, StockFileWriter, convert
+
+
+class TestStockFile(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.file_name = os.path.join(self._directory.name, "stock.bin")
+        self.items = convert(
+            app_test.TestWarehouseManager.warehouse_items_for_test,
+            self.file_name,
+            metadata={"delta_offset": 3},
+        )
+        self.stock_file = StockFile(self.file_name)
+        self.addCleanup(self.stock_file.close)
+
+    def test_records_are_fixed_width(self):
+        self.assertEqual(self.items, 8)
+        self.assertEqual(len(self.stock_file), 8)
+        self.assertEqual(len(self.stock_file.records), 8 * RECORD.size)
+        self.assertEqual(self.stock_file.metadata, {"delta_offset": 3})
+        self.assertEqual(
+            self.stock_file.warehouses, {1: (0, 1), 2: (1, 3), 3: (3, 6), 4: (6, 8)}
+        )
+
+    def test_warehouses_are_loaded_in_order_of_stock(self):
+        warehouses = self.stock_file.load_warehouses()
+        self.assertEqual([warehouse.id for warehouse in warehouses], [1, 2, 3, 4])
+        self.assertEqual(
+            [item.state for item in warehouses[2].stock], ["Blue", "Brand new", "Blue"]
+        )
+        self.assertEqual(
+            warehouses[3].stock[0].date_of_stock, datetime(2021, 7, 20, 3, 51, 6)
+        )
+
+    def test_scans_without_numpy_give_the_same_results(self):
+        strings = self.stock_file.strings
+        blue = {(strings.index("Blue"), strings.index("Remote control"))}
+        until = (datetime(2020, 7, 1) - EPOCH) // MICROSECOND
+        scans = [
+            lambda: self.stock_file.group_statistics(),
+            lambda: self.stock_file.select(blue),
+            lambda: self.stock_file.select(None, until),
+            lambda: self.stock_file.age_ordered(list(range(8)), by_warehouse=False),
+            lambda: self.stock_file.age_ordered([7, 6, 5, 4, 3], limit=2),
+        ]
+        vectorized = [scan() for scan in scans]
+        with patch("stock_file.np", None):
+            self.assertEqual([scan() for scan in scans], vectorized)
+        self.assertEqual(vectorized[1], [0, 2, 3, 5])
+
+    def test_saved_copy_has_other_metadata(self):
+        copy = os.path.join(self._directory.name, "copy.bin")
+        self.stock_file.save(copy, {"delta_offset": 5})
+        with open(self.file_name, "rb") as original, open(copy, "rb") as saved:
+            self.assertEqual(
+                original.read().replace(b'"delta_offset": 3', b'"delta_offset": 5'),
+                saved.read(),
+            )
+
+    def test_empty_warehouses_are_kept(self):
+        writer = StockFileWriter()
+        writer.add_warehouses(
+            [
+                Warehouse(1, []),
+                Warehouse(2, [Item("Red", "Book", 2, datetime(2021, 1, 1))]),
+            ]
+        )
+        loaded = StockFile(writer.to_buffer()).load_warehouses()
+        self.assertEqual([warehouse.occupancy() for warehouse in loaded], [0, 1])
+
+    def test_large_warehouse_ids(self):
+        writer = StockFileWriter()
+        for id in (2 ** 31, 2 ** 40, -1):
+            writer.add(id, Item("Red", "Book", id, datetime(2021, 1, 1)))
+        loaded = StockFile(writer.to_buffer())
+        self.assertEqual(
+            [warehouse.id for warehouse in loaded.load_warehouses()],
+            [-1, 2 ** 31, 2 ** 40],
+        )
+        statistics = loaded.group_statistics()
+        with patch("stock_file.np", None):
+            self.assertEqual(loaded.group_statistics(), statistics)
+
+    def test_not_a_stock_file(self):
+        with self.assertRaises(ValueError):
+            StockFile(b"[]")
+        with open(self.file_name, "rb") as f:
+            truncated = f.read()[:-40]
+        with self.assertRaises(ValueError):
+            StockFile(truncated)
+
+    def test_main_converts_json(self):
+        target = os.path.join(self._directory.name, "converted.bin")
+        with redirect_stdout(io.StringIO()) as output:
+            stock_file.main([DEFAULT_STOCK_FILE, target])
+        self.assertIn("5000 items written", output.getvalue())
+        converted = StockFile(target)
+        self.addCleanup(converted.close)
+        self.assertEqual(len(converted), 5000)
+
+
+if __name__ == "__main__":
+    unittest.main()